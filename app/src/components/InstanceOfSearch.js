@@ -110,7 +110,7 @@ const InstanceOfSearch = ({ onSelect }) => {
       setLoading(true)
 
       if (process.env.REACT_APP_USE_KGTK_KYPHER_BACKEND === '1') {
-        fetchSearchResults(inputValue, 'true').then((results) => {
+        fetchSearchResults(inputValue, 'true', undefined, 'instance-of').then((results) => {
           setLoading(false)
           setOptions(results)
         })
@@ -64,7 +64,7 @@ const NavBarSearch = () => {
     timeoutID.current = setTimeout(() => {
       setLoading(true)
       if ( process.env.REACT_APP_USE_KGTK_KYPHER_BACKEND === '1' ) {
-        fetchSearchResults(inputValue).then((results) => {
+        fetchSearchResults(inputValue, undefined, undefined, 'navbar').then((results) => {
           setLoading(false)
           setOptions(results)
           setOpen(true)
@@ -10,7 +10,13 @@ const fetchESSearchResults = (q, is_class, instance_of) => {
     url += `&instance_of=${instance_of}`
   }
 
-  if (process.env.REACT_APP_KGTK_SEARCH_ES_URL) {
+  if (process.env.REACT_APP_USE_KGTK_EMBEDDED_SEARCH === '1') {
+    // the browser backend serves the same API from its own search index
+    url = `/kb/search?${ url.slice('/api?'.length) }`
+    if (process.env.REACT_APP_BACKEND_URL) {
+      url = `${process.env.REACT_APP_BACKEND_URL}${ url }`
+    }
+  } else if (process.env.REACT_APP_KGTK_SEARCH_ES_URL) {
     url = `${process.env.REACT_APP_KGTK_SEARCH_ES_URL}${ url }`
   } else {
     url = `https://kgtk.isi.edu${ url }`
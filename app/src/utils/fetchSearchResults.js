@@ -1,6 +1,14 @@
-const fetchSearchResults = (q, is_class, instance_of) => {
+// Identifies this page's search boxes to the backend, which drops queries
+// that a newer query from the same search box has superseded.
+const clientToken = Math.random().toString(36).slice(2)
+const sequenceNumbers = {}
 
-  let url = `/kb/query?q=${q}`
+const fetchSearchResults = (q, is_class, instance_of, searchBox = 'search') => {
+
+  const seq = (sequenceNumbers[searchBox] || 0) + 1
+  sequenceNumbers[searchBox] = seq
+
+  let url = `/kb/query?q=${q}&client=${clientToken}-${searchBox}&seq=${seq}`
   if (is_class === 'true') {
     url += `&is_class=true`
   }
@@ -16,7 +24,12 @@ const fetchSearchResults = (q, is_class, instance_of) => {
   return new Promise((resolve, reject) => {
     fetch(url, {method: 'GET'})
     .then(response => response.json())
-    .then(response => resolve(response.matches))
+    .then(response => {
+      // superseded queries are never resolved, the newer query's results win
+      if ( !response.superseded ) {
+        resolve(response.matches)
+      }
+    })
     .catch(err => reject(err))
   })
 }
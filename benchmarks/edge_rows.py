@@ -0,0 +1,111 @@
+"""
+Measure memory of item edge rows: list rows vs. 'ItemEdge' rows.
+
+Fetches the edges of a synthetic item from an in-memory SQLite table in the
+RB_NODE_EDGES_QUERY column order, either copying each cursor row into a list
+(as the capped edge query used to) or producing 'browser.backend.rows.ItemEdge'
+rows directly with a cursor row factory that shares repeated strings, and then
+sorts them and reads the fields the renderer reads.  Reports the memory held by
+the rows and the peak traced allocations (tracemalloc), the time, and the peak
+RSS of a fresh process running each variant:
+
+    python benchmarks/edge_rows.py --edges 100000
+"""
+
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser.backend.rows import ItemEdge, ItemEdgeFactory
+
+
+VARIANTS = ('list', 'item_edge')
+
+
+def make_db(num_edges, seed=0):
+    """Return an in-memory database with 'num_edges' item edges of a hub item.
+    """
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE edges (id, node1, label, node2, label_label, target, target_label, target_desc, datatype)')
+    rows = []
+    for i in range(num_edges):
+        prop = 'P%d' % rnd.randint(1, 300)
+        node2 = 'Q%d' % rnd.randint(1, 10 ** 7)
+        rows.append(('Q1-%s-%d' % (prop, i), 'Q1', prop, node2, "'property %s'@en" % prop, node2,
+                     "'value %d'@en" % rnd.randint(1, 10 ** 6), "'a description of %s'@en" % node2, 'wikibase-item'))
+    conn.executemany('INSERT INTO edges VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return conn
+
+
+def fetch(conn, variant):
+    cursor = conn.execute('SELECT * FROM edges ORDER BY label, node2, id')
+    if variant == 'list':
+        return [list(row) for row in cursor]
+    cursor.row_factory = ItemEdgeFactory()
+    return cursor.fetchall()
+
+
+def render(edges):
+    """Touch the fields the renderer reads, the way it reads them.
+    """
+    edges = sorted(edges, key=lambda edge: (edge[2], edge[6] or edge[5]))
+    chars = 0
+    for edge in edges:
+        if isinstance(edge, ItemEdge):
+            chars += len(edge.target_node) + len(edge.target_label or '') + len(edge.relationship)
+        else:
+            edge_id, node1, relationship, node2, relationship_label, target_node, target_label, \
+                target_description, wikidatatype = edge
+            chars += len(target_node) + len(target_label or '') + len(relationship)
+    return chars
+
+
+def run_variant(num_edges, variant):
+    """Measure one variant in this process and print a result line.
+    """
+    conn = make_db(num_edges)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    render(fetch(conn, variant))
+    elapsed = (time.perf_counter() - start) * 1000.0
+    # tracing slows down allocations, so we trace a second, untimed run:
+    tracemalloc.start()
+    edges = fetch(conn, variant)
+    held, _ = tracemalloc.get_traced_memory()
+    render(edges)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux:
+    print('%-10s %10d %12.1f %12.1f %10.1f %14.1f' % (variant, len(edges), held / 2 ** 20, peak / 2 ** 20, elapsed,
+                                                       (rss_after - rss_before) / 1024.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, default=100000, help='number of edges of the synthetic item')
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        run_variant(args.edges, args.variant)
+        return
+
+    print('%-10s %10s %12s %12s %10s %14s' % ('rows', 'edges', 'held MB', 'peak MB', 'ms', 'peak RSS +MB'))
+    for variant in VARIANTS:
+        # a fresh process per variant, so their peak RSS can be compared:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--edges', str(args.edges), '--variant', variant],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark building node data frames: row-based vs. columnar fast dataframes.
+
+Runs the frame pipeline of 'BrowserBackend.get_node_data_frames' (build the
+edge and qualifier frames from query result rows, collect their core edge
+columns and their target node labels, images and fanouts, and union them)
+followed by the JSON conversion of 'format.JsonTripleFormat' on the
+results of a synthetic hub item, once with 'FastDataFrame' and once with the
+dictionary-encoded 'ColumnarDataFrame', and reports the best time and the peak
+memory allocated by each:
+
+    python benchmarks/fastdf_node_data.py --edges 10000 100000 500000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser.backend.fastdf import FastDataFrame, ColumnarDataFrame
+import browser.backend.format as fmt
+
+
+NODE_EDGES_COLUMNS = ('id', 'node1', 'label', 'node2', 'node_label', 'node_image', 'node_fanout')
+NODE_LABELS_COLUMNS = ('node1', 'node_label')
+
+
+def make_rows(node, num_edges, num_properties=300, num_targets=None, id_prefix='E', seed=0):
+    """Return 'num_edges' result rows of NODE_EDGES_QUERY for a synthetic hub item 'node'.
+    Targets repeat, since the values of hub items reuse a limited set of nodes.
+    """
+    rnd = random.Random(seed)
+    num_targets = num_targets or max(num_edges // 4, 1)
+    properties = ['P%d' % rnd.randint(1, 10000) for _ in range(num_properties)]
+    weights = [1.0 / (rank + 1) for rank in range(num_properties)]
+    rows = []
+    for i in range(num_edges):
+        target = rnd.randint(1, num_targets)
+        node2 = 'Q%d' % target
+        # not all targets have labels, images or fanouts:
+        label = "'Value %d'@en" % target if target % 10 else None
+        image = 'Image_%d.jpg' % target if target % 3 == 0 else None
+        fanout = str(target % 1000) if target % 5 else None
+        rows.append((id_prefix + str(i), node, rnd.choices(properties, weights=weights)[0], node2, label, image, fanout))
+    return rows
+
+
+def collect_edges(edges_df):
+    if edges_df is not None:
+        df = edges_df.project(fmt.KGTK_EDGE_COLUMNS)
+        df.drop_duplicates(inplace=True)
+        return df
+    return None
+
+
+def collect_edge_node_values(edges_df, column):
+    if edges_df is not None:
+        df = edges_df.project([fmt.NODE2_COLUMN, column])
+        df.drop_nulls(inplace=True)
+        df.drop_duplicates(inplace=True)
+        return df
+    return None
+
+
+def build_node_data(frame_class, node, edge_rows, qual_rows):
+    """Mirror 'get_node_data_frames' and the JSON conversion of its result with 'frame_class'.
+    """
+    node_labels = frame_class(NODE_LABELS_COLUMNS, [(node, "'Hub item'@en")])
+    node_images = frame_class(('node1', 'node_image'), [])
+    edges = frame_class(NODE_EDGES_COLUMNS, edge_rows)
+    quals = frame_class(NODE_EDGES_COLUMNS, qual_rows)
+
+    all_edges = collect_edges(edges).union(collect_edges(None))
+    all_quals = collect_edges(quals).union(collect_edges(None))
+    all_labels = node_labels.union(collect_edge_node_values(edges, fmt.NODE_LABEL_COLUMN),
+                                   collect_edge_node_values(quals, fmt.NODE_LABEL_COLUMN))
+    all_images = node_images.union(collect_edge_node_values(edges, fmt.NODE_IMAGE_COLUMN),
+                                   collect_edge_node_values(quals, fmt.NODE_IMAGE_COLUMN))
+    all_fanouts = collect_edge_node_values(edges, fmt.NODE_FANOUT_COLUMN).union(
+        collect_edge_node_values(quals, fmt.NODE_FANOUT_COLUMN))
+
+    formatter = fmt.JsonTripleFormat()
+    return {
+        'edges': formatter.edges_df_to_json(all_edges),
+        'qualifiers': formatter.edges_df_to_json(all_quals),
+        'labels': formatter.values_df_to_json(all_labels),
+        'images': formatter.values_df_to_json(all_images),
+        'fanouts': formatter.value_df_to_json(all_fanouts),
+    }
+
+
+def time_it(frame_class, node, edge_rows, qual_rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build_node_data(frame_class, node, edge_rows, qual_rows)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(frame_class, node, edge_rows, qual_rows):
+    tracemalloc.start()
+    try:
+        build_node_data(frame_class, node, edge_rows, qual_rows)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, nargs='+', default=[10000, 100000, 500000], help='hub item sizes')
+    parser.add_argument('--qualifiers', type=float, default=0.5, help='qualifiers per edge')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    node = 'Q1'
+    print('%10s %12s %12s %8s %12s %12s' % ('edges', 'rows ms', 'columns ms', 'speedup', 'rows MB', 'columns MB'))
+    for num_edges in args.edges:
+        edge_rows = make_rows(node, num_edges)
+        qual_rows = make_rows(node, int(num_edges * args.qualifiers), id_prefix='Q', seed=1)
+        # both frame classes have to produce the same node data:
+        assert (build_node_data(FastDataFrame, node, edge_rows, qual_rows) ==
+                build_node_data(ColumnarDataFrame, node, edge_rows, qual_rows))
+        old = time_it(FastDataFrame, node, edge_rows, qual_rows, args.repeat)
+        new = time_it(ColumnarDataFrame, node, edge_rows, qual_rows, args.repeat)
+        old_memory = peak_memory(FastDataFrame, node, edge_rows, qual_rows)
+        new_memory = peak_memory(ColumnarDataFrame, node, edge_rows, qual_rows)
+        print('%10d %12.1f %12.1f %7.1fx %12.1f %12.1f'
+              % (num_edges, old, new, old / new, old_memory, new_memory))
+
+
+if __name__ == '__main__':
+    main()
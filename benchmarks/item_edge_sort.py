@@ -0,0 +1,95 @@
+"""
+Benchmark sorting the edges of hub items: per-edge row keys vs. ranked keys.
+
+Compares the former item edge sort (build a lowercased
+'{priority}|{label}|{target}|{idx}' key per edge, store the edges in a dict
+and sort its keys) with 'browser.backend.edgesort.sort_edges' (rank the
+distinct relationships once, then one stable 'list.sort' on keys made of the
+relationship rank and the casefolded target label).  Edges are generated in
+the relationship order of the RB_NODE_EDGES_QUERY results:
+
+    python benchmarks/item_edge_sort.py --edges 10000 100000 500000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser.backend.edgesort import sort_edges
+
+
+PRIORITY_WIDTH = 5
+DEFAULT_PRIORITY = 99999
+
+
+def make_edges(num_edges, num_properties=300, seed=0):
+    """Return 'num_edges' item edges of a synthetic hub item in RB_NODE_EDGES_QUERY format.
+    """
+    rnd = random.Random(seed)
+    properties = ['P%d' % rnd.randint(1, 10000) for _ in range(num_properties)]
+    labels = {prop: "'property %s'@en" % prop.lower() for prop in properties}
+    # hub items have a few properties with very many values:
+    weights = [1.0 / (rank + 1) for rank in range(num_properties)]
+    edges = []
+    for i in range(num_edges):
+        prop = rnd.choices(properties, weights=weights)[0]
+        node2 = 'Q%d' % rnd.randint(1, 10 ** 7)
+        label = "'Value %s %d'@en" % (rnd.choice(['Alpha', 'beta', 'Gamma', 'delta']), rnd.randint(1, 10 ** 6))
+        edges.append(['E%d' % i, 'Q1', prop, node2, labels[prop], node2, label, None, 'wikibase-item'])
+    edges.sort(key=lambda edge: (edge[2], edge[5]))
+    return edges
+
+
+def sort_row_keys(edges, priority_map):
+    keyed_edges = dict()
+    for idx, edge in enumerate(edges):
+        edge_id, node1, relationship, node2, relationship_label, target_node, target_label, target_description, wikidatatype = edge
+        if relationship_label is None:
+            relationship_label = relationship
+        if target_label is None:
+            target_label = target_node
+        priority = str(priority_map.get(relationship, DEFAULT_PRIORITY)).zfill(PRIORITY_WIDTH)
+        keyed_edges[f'{priority}|{relationship_label}|{target_label}|{str(idx + 1000000)}'.lower()] = edge
+    return [keyed_edges[key] for key in sorted(keyed_edges.keys())]
+
+
+def sort_ranked_keys(edges, priority_map):
+    return sort_edges(edges, relationship_idx=2, relationship_label_idx=4, target_idx=5, target_label_idx=6,
+                      priority_map=priority_map, default_priority=DEFAULT_PRIORITY)
+
+
+def time_it(fn, edges, priority_map, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(edges, priority_map)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, nargs='+', default=[10000, 100000, 500000], help='hub item sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    priority_map = {'P31': 0, 'P279': 1, 'P17': 2}
+    print('%10s %16s %16s %8s' % ('edges', 'row keys ms', 'ranked keys ms', 'speedup'))
+    for num_edges in args.edges:
+        edges = make_edges(num_edges)
+        # both sorts have to group the values of each relationship the same way:
+        old_groups = [edge[2] for edge in sort_row_keys(edges, priority_map)]
+        new_groups = [edge[2] for edge in sort_ranked_keys(edges, priority_map)]
+        assert old_groups == new_groups
+        old = time_it(sort_row_keys, edges, priority_map, args.repeat)
+        new = time_it(sort_ranked_keys, edges, priority_map, args.repeat)
+        print('%10d %16.1f %16.1f %7.1fx' % (num_edges, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
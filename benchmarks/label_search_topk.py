@@ -0,0 +1,107 @@
+"""
+Benchmark label search on high-frequency tokens: sort-all vs. top-k.
+
+Compares the ranking strategy of the MATCH_LABELS_TEXTSEARCH_* queries (match
+every label via FTS, compute 'score*prank' for all hits and ORDER BY it before
+the LIMIT) with the pagerank-ordered FTS index of 'browser.backend.fts' (stream
+matches highest pagerank first into a bounded top-k heap).
+
+The benchmark runs on a synthetic l_d_pgr_ud-style label table with Zipf-
+distributed tokens, so it needs nothing but Python's sqlite3 with FTS5:
+
+    python benchmarks/label_search_topk.py --labels 500000 --limit 20
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser.backend.fts import LabelFtsIndex
+
+
+COMMON_TOKENS = ['john', 'de', 'the', 'saint', 'river']
+RARE_TOKENS = ['zyx', 'qwerty']
+
+
+class ConnectionStore(object):
+    """Minimal stand-in for the graph cache's SqliteStore.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, *args):
+        return self.conn.executemany(*args)
+
+    def commit(self):
+        self.conn.commit()
+
+    def has_table(self, table):
+        return self.conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE name=?', (table,)).fetchone()[0] > 0
+
+
+def make_labels(conn, num_labels, seed=0):
+    rnd = random.Random(seed)
+    vocabulary = COMMON_TOKENS + ['w%d' % i for i in range(50000)] + RARE_TOKENS
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    conn.execute('CREATE TABLE labels (node1 TEXT, label TEXT, node2 TEXT, '
+                 '"node1;pagerank" TEXT, "node1;description" TEXT)')
+    rows = []
+    for i in range(num_labels):
+        words = rnd.choices(vocabulary, cum_weights=cum_weights, k=rnd.randint(1, 4))
+        rows.append(('Q%d' % i, 'label', "'%s'@en" % ' '.join(words), repr(rnd.paretovariate(1.0) * 1e-8), ''))
+    conn.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?)', rows)
+    # baseline: a plain FTS index over the label table as the graph cache has it:
+    conn.execute("CREATE VIRTUAL TABLE labels_fts USING fts5(text, tokenize='unicode61 remove_diacritics 2')")
+    conn.execute("INSERT INTO labels_fts (rowid, text) SELECT rowid, node2 FROM labels")
+    conn.commit()
+
+
+def search_sort_all(conn, token, limit):
+    query = ('SELECT l.node1, l.node2, bm25(labels_fts) AS score, CAST(l."node1;pagerank" AS REAL) AS prank, '
+             'l."node1;description" FROM labels_fts JOIN labels l ON l.rowid=labels_fts.rowid '
+             'WHERE labels_fts MATCH ? ORDER BY score*prank LIMIT ?')
+    return conn.execute(query, ('"%s"*' % token, limit)).fetchall()
+
+
+def time_it(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', type=int, default=200000, help='number of synthetic labels')
+    parser.add_argument('--limit', type=int, default=20, help='number of results per search (k)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs per token')
+    parser.add_argument('--tokens', nargs='+', default=COMMON_TOKENS + RARE_TOKENS, help='search tokens')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(':memory:')
+    start = time.perf_counter()
+    make_labels(conn, args.labels)
+    index = LabelFtsIndex(ConnectionStore(conn))
+    index.build('labels', log=None)
+    print('Built %d synthetic labels and both indexes in %.1f secs' % (args.labels, time.perf_counter() - start))
+
+    print('%-10s %10s %14s %14s %8s' % ('token', 'hits', 'sort-all ms', 'top-k ms', 'speedup'))
+    for token in args.tokens:
+        (hits,) = conn.execute('SELECT COUNT(*) FROM labels_fts WHERE labels_fts MATCH ?', ('"%s"*' % token,)).fetchone()
+        sort_all = time_it(lambda: search_sort_all(conn, token, args.limit), args.repeat)
+        top_k = time_it(lambda: index.search(token, limit=args.limit), args.repeat)
+        print('%-10s %10d %14.2f %14.2f %7.1fx' % (token, hits, sort_all, top_k, sort_all / max(top_k, 1e-6)))
+
+
+if __name__ == '__main__':
+    main()
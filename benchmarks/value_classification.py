@@ -0,0 +1,98 @@
+"""
+Microbenchmark value classification for item rendering: KgtkValue vs. fast path.
+
+Compares what the item renderers used to do for every edge and qualifier value
+(construct a 'KgtkValue', 'classify()' it and parse the fields of quantities and
+dates) with 'browser.backend.values' (classify on the leading character where
+possible and memoize parsed values).  The benchmark uses the node2 values of a
+synthetic item with a Wikidata-like mix of value types, rendered twice to show
+the effect of the parsed value cache:
+
+    python benchmarks/value_classification.py --edges 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kgtk.kgtkformat import KgtkFormat
+from kgtk.value.kgtkvalue import KgtkValue
+
+from browser.backend.values import classify_value, get_kgtk_value, get_cache_info
+
+
+PARSED_TYPES = (KgtkFormat.DataType.QUANTITY, KgtkFormat.DataType.DATE_AND_TIMES)
+
+
+def make_values(num_edges, seed=0):
+    """Return the node2 values of a synthetic item with 'num_edges' edges.
+    """
+    rnd = random.Random(seed)
+    quantities = ['+%d' % rnd.randint(1, 10 ** 6) for _ in range(200)] + \
+                 ['+%.2fQ%d' % (rnd.random() * 1000, rnd.choice([11573, 828224, 712226])) for _ in range(800)]
+    dates = ['^%04d-%02d-%02dT00:00:00Z/%d' % (rnd.randint(1500, 2020), rnd.randint(1, 12), rnd.randint(1, 28),
+                                                 rnd.choice([9, 10, 11])) for _ in range(2000)]
+    values = []
+    for _ in range(num_edges):
+        kind = rnd.random()
+        if kind < 0.60:
+            values.append('Q%d' % rnd.randint(1, 10 ** 7))
+        elif kind < 0.70:
+            values.append('"external-id-%d"' % rnd.randint(1, 10 ** 6))
+        elif kind < 0.80:
+            values.append("'label %d'@%s" % (rnd.randint(1, 10 ** 6), rnd.choice(['en', 'de', 'fr', 'zh-hant'])))
+        elif kind < 0.90:
+            values.append(rnd.choice(quantities))
+        elif kind < 0.98:
+            values.append(rnd.choice(dates))
+        else:
+            values.append('@%.4f/%.4f' % (rnd.uniform(-90, 90), rnd.uniform(-180, 180)))
+    return values
+
+
+def render_kgtk_value(values):
+    for node2 in values:
+        value = KgtkValue(node2)
+        if value.classify() in PARSED_TYPES:
+            value.do_parse_fields()
+
+
+def render_fast_path(values):
+    for node2 in values:
+        if classify_value(node2) in PARSED_TYPES:
+            get_kgtk_value(node2).do_parse_fields()
+
+
+def time_it(fn, values):
+    start = time.perf_counter()
+    fn(values)
+    return (time.perf_counter() - start) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edges', type=int, default=50000, help='number of edges of the synthetic item')
+    args = parser.parse_args()
+
+    values = make_values(args.edges)
+    mismatches = [value for value in values if classify_value(value) != KgtkValue(value).classify()]
+    if mismatches:
+        print('Classification mismatches: %s' % mismatches[:10])
+        sys.exit(1)
+    get_kgtk_value.cache_clear()
+
+    print('%-22s %12s %12s' % ('', 'first ms', 'repeat ms'))
+    baseline = [time_it(render_kgtk_value, values), time_it(render_kgtk_value, values)]
+    print('%-22s %12.1f %12.1f' % ('KgtkValue.classify', *baseline))
+    fast = [time_it(render_fast_path, values), time_it(render_fast_path, values)]
+    print('%-22s %12.1f %12.1f' % ('classify_value', *fast))
+    print('%-22s %11.1fx %11.1fx' % ('speedup', baseline[0] / fast[0], baseline[1] / fast[1]))
+    print(get_cache_info())
+
+
+if __name__ == '__main__':
+    main()
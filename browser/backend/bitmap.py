@@ -0,0 +1,138 @@
+"""
+Compressed integer bitmaps in the style of Roaring bitmaps.
+
+The 32-bit integer space is split into chunks of 2^16 values keyed by the high
+16 bits of their members.  Each non-empty chunk is stored in a container that
+is either a sorted array of the low 16 bits (for sparse chunks with at most
+'ARRAY_CONTAINER_MAX' members) or a plain 8KB bitmap (for dense chunks), so
+membership tests are a binary search over chunk keys followed by either a
+binary search or a single bit test.
+"""
+
+import bisect
+import itertools
+import struct
+import sys
+from array import array
+
+
+ARRAY_CONTAINER_MAX = 4096
+BITMAP_CONTAINER_BYTES = (1 << 16) // 8
+
+ARRAY_CONTAINER = 0
+BITMAP_CONTAINER = 1
+
+MAGIC = b'RBM1'
+HEADER = struct.Struct('<4sI')
+CONTAINER_HEADER = struct.Struct('<HBI')
+# array containers are serialized in little-endian byte order:
+BIG_ENDIAN = sys.byteorder == 'big'
+
+
+class RoaringBitmap(object):
+    """
+    Immutable compressed set of non-negative 32-bit integers.
+    """
+
+    def __init__(self, keys=None, containers=None, cardinality=None):
+        # sorted high 16-bit chunk keys and their parallel (kind, data) containers:
+        self.keys = keys or []
+        self.containers = containers or []
+        if cardinality is None:
+            cardinality = sum(self.container_cardinality(kind, data) for kind, data in self.containers)
+        self.cardinality = cardinality
+
+    @staticmethod
+    def container_cardinality(kind, data):
+        if kind == ARRAY_CONTAINER:
+            return len(data)
+        return sum(bin(byte).count('1') for byte in data)
+
+    @classmethod
+    def from_sorted(cls, values):
+        """Build a bitmap from an ascending iterable of integers (duplicates are ignored).
+        """
+        keys = []
+        containers = []
+        cardinality = 0
+        for key, group in itertools.groupby(values, key=lambda value: value >> 16):
+            lows = array('H', sorted(set(value & 0xFFFF for value in group)))
+            cardinality += len(lows)
+            keys.append(key)
+            if len(lows) <= ARRAY_CONTAINER_MAX:
+                containers.append((ARRAY_CONTAINER, lows))
+            else:
+                bits = bytearray(BITMAP_CONTAINER_BYTES)
+                for low in lows:
+                    bits[low >> 3] |= 1 << (low & 7)
+                containers.append((BITMAP_CONTAINER, bytes(bits)))
+        return cls(keys, containers, cardinality)
+
+    def __len__(self):
+        return self.cardinality
+
+    def __contains__(self, value):
+        key = value >> 16
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return False
+        kind, data = self.containers[i]
+        low = value & 0xFFFF
+        if kind == ARRAY_CONTAINER:
+            j = bisect.bisect_left(data, low)
+            return j < len(data) and data[j] == low
+        return (data[low >> 3] >> (low & 7)) & 1 == 1
+
+    def __iter__(self):
+        for key, (kind, data) in zip(self.keys, self.containers):
+            base = key << 16
+            if kind == ARRAY_CONTAINER:
+                for low in data:
+                    yield base | low
+            else:
+                for byte_idx, byte in enumerate(data):
+                    while byte:
+                        bit = byte & -byte
+                        yield base | (byte_idx << 3) | (bit.bit_length() - 1)
+                        byte ^= bit
+
+    def to_bytes(self):
+        """Serialize this bitmap into a bytes object.
+        """
+        chunks = [HEADER.pack(MAGIC, len(self.keys))]
+        for key, (kind, data) in zip(self.keys, self.containers):
+            count = len(data) if kind == ARRAY_CONTAINER else self.container_cardinality(kind, data)
+            chunks.append(CONTAINER_HEADER.pack(key, kind, count))
+            if kind == ARRAY_CONTAINER and BIG_ENDIAN:
+                data = array('H', data)
+                data.byteswap()
+            chunks.append(data.tobytes() if kind == ARRAY_CONTAINER else data)
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Deserialize a bitmap from a 'blob' produced by 'to_bytes'.
+        """
+        magic, num_containers = HEADER.unpack_from(blob, 0)
+        if magic != MAGIC:
+            raise ValueError('not a serialized bitmap')
+        offset = HEADER.size
+        keys = []
+        containers = []
+        cardinality = 0
+        for _ in range(num_containers):
+            key, kind, count = CONTAINER_HEADER.unpack_from(blob, offset)
+            offset += CONTAINER_HEADER.size
+            if kind == ARRAY_CONTAINER:
+                data = array('H')
+                data.frombytes(blob[offset:offset + 2 * count])
+                if BIG_ENDIAN:
+                    data.byteswap()
+                offset += 2 * count
+            else:
+                data = bytes(blob[offset:offset + BITMAP_CONTAINER_BYTES])
+                offset += BITMAP_CONTAINER_BYTES
+            keys.append(key)
+            containers.append((kind, data))
+            cardinality += count
+        return cls(keys, containers, cardinality)
@@ -0,0 +1,123 @@
+"""
+Bookkeeping for auxiliary tables built into the graph cache by 'kgtk browser' build commands.
+
+Each build records its name, configuration, the tables it created, when it ran
+and how much disk space its tables use, so the server can detect missing or
+incompatible builds at startup and operators can see what an index costs.
+"""
+
+import json
+import sqlite3
+import time
+
+
+BUILD_INFO_TABLE = 'rb_build_info'
+
+
+def ensure_build_info_table(store):
+    store.execute(f'CREATE TABLE IF NOT EXISTS {BUILD_INFO_TABLE} '
+                  '(name TEXT PRIMARY KEY, config TEXT, tables TEXT, built REAL, size INTEGER)')
+
+
+def get_shadow_tables(store, tables):
+    """Return the shadow tables holding the data of the virtual tables among 'tables',
+    such as the '_data' and '_idx' tables of an FTS5 table.
+    """
+    shadow_tables = []
+    for table in tables:
+        row = store.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        if row is not None and row[0] is not None and row[0].upper().startswith('CREATE VIRTUAL TABLE'):
+            shadow_tables.extend(name for (name,) in store.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND substr(name, 1, ?)=?",
+                (len(table) + 1, table + '_')))
+    return shadow_tables
+
+
+def get_tables_size(store, tables):
+    """Return the number of bytes used by 'tables' and their indexes in 'store',
+    or None if the SQLite library was compiled without the 'dbstat' virtual table.
+    """
+    if not tables:
+        return 0
+    tables = list(tables) + get_shadow_tables(store, tables)
+    marks = ','.join('?' * len(tables))
+    try:
+        # dbstat reports b-trees by name, which for indexes differs from the table name:
+        query = (f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({marks}) OR name IN "
+                 f"(SELECT name FROM sqlite_master WHERE type='index' AND tbl_name IN ({marks}))")
+        (size,) = store.execute(query, list(tables) * 2).fetchone()
+        return size or 0
+    except sqlite3.OperationalError:
+        return None
+
+
+def record_build(store, name, config, tables):
+    """Record a completed build 'name' with its 'config' dict and the list of
+    'tables' it created.  Return the recorded info as a dict.
+    """
+    ensure_build_info_table(store)
+    info = {
+        'name': name,
+        'config': config,
+        'tables': list(tables),
+        'built': time.time(),
+        'size': get_tables_size(store, tables),
+    }
+    store.execute(f'INSERT OR REPLACE INTO {BUILD_INFO_TABLE} VALUES (?, ?, ?, ?, ?)',
+                  (name, json.dumps(config, sort_keys=True), json.dumps(info['tables']), info['built'], info['size']))
+    store.commit()
+    return info
+
+
+def get_build_info(store, name):
+    """Return the recorded info dict for build 'name', or None if it was never built.
+    """
+    if not store.has_table(BUILD_INFO_TABLE):
+        return None
+    row = store.execute(f'SELECT name, config, tables, built, size FROM {BUILD_INFO_TABLE} WHERE name=?',
+                        (name,)).fetchone()
+    if row is None:
+        return None
+    return {
+        'name': row[0],
+        'config': json.loads(row[1]),
+        'tables': json.loads(row[2]),
+        'built': row[3],
+        'size': row[4],
+    }
+
+
+def get_stale_sources(store, info, tables):
+    """Return the graph cache tables among 'tables' that build 'info' was built from
+    but that no longer exist or have been (re)imported since the build was recorded.
+    """
+    stale = []
+    for table in tables:
+        graph = store.get_graph_info(table) if store.has_table(table) else None
+        if graph is None or graph.acctime is not None and float(graph.acctime) > info['built']:
+            stale.append(table)
+    return stale
+
+
+def drop_build(store, name):
+    """Drop all tables of build 'name' and forget about it.
+    """
+    info = get_build_info(store, name)
+    if info is None:
+        return
+    for table in info['tables']:
+        store.execute(f'DROP TABLE IF EXISTS {table}')
+    store.execute(f'DELETE FROM {BUILD_INFO_TABLE} WHERE name=?', (name,))
+    store.commit()
+
+
+def format_size(size):
+    """Format a byte 'size' for human consumption.
+    """
+    if size is None:
+        return 'unknown size'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f TB' % size
@@ -0,0 +1,154 @@
+"""
+Bounded in-memory caches with LRU eviction and size accounting.
+
+The app keeps a number of lookup caches (unit labels, language names, image
+formatters, qualifier query results) in every pool worker process.  A
+'BoundedCache' limits such a cache by number of entries and by an estimate of
+the bytes held by its keys and values, evicting the least recently used
+entries first, and counts hits, misses and evictions.  Keys built from long
+ID lists can be reduced to a fixed-size digest with 'hash_key', so the cache
+doesn't hold on to a joined string of every ID.
+"""
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+
+# Default limits per cache:
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Entries that don't fit this fraction of 'max_bytes' are not cached at all:
+MAX_ENTRY_FRACTION = 0.25
+
+_MISSING = object()
+
+
+def hash_key(*parts):
+    """Return a 16-byte digest of the string 'parts' to use as a fixed-size cache key.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        # separate parts, so ('ab', 'c') and ('a', 'bc') hash differently:
+        digest.update(b'\x00')
+    return digest.digest()
+
+
+def estimate_size(obj):
+    """Return an estimate of the bytes held by 'obj' and, for lists, tuples, sets
+    and dicts, by their elements.  Shared objects are counted once per reference.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        for elt in obj:
+            size += estimate_size(elt)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key) + estimate_size(value)
+    return size
+
+
+class BoundedCache(object):
+    """
+    Dict-like LRU cache bounded by 'max_entries' and by 'max_bytes' as estimated by
+    'sizeof' for each key and value.  Lookups with 'in', '[]' or 'get' count as hits
+    or misses and mark the entry as most recently used.  Safe to use from several
+    threads.
+    """
+
+    def __init__(self, name, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, sizeof=estimate_size):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.entry_sizes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        register_cache(self)
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        entry_size = self.sizeof(key) + self.sizeof(value)
+        with self.lock:
+            self.discard(key)
+            if entry_size > self.max_bytes * MAX_ENTRY_FRACTION:
+                return
+            self.entries[key] = value
+            self.entry_sizes[key] = entry_size
+            self.size += entry_size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                old_key, _ = self.entries.popitem(last=False)
+                self.size -= self.entry_sizes.pop(old_key)
+                self.evictions += 1
+
+    def discard(self, key):
+        """Remove 'key' from the cache if it is there, without counting a lookup.
+        """
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+                self.size -= self.entry_sizes.pop(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.entry_sizes.clear()
+            self.size = 0
+
+    def get_stats(self):
+        """Return a dict with the hit/miss/eviction counts and the current size of this cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+_caches = []
+
+
+def register_cache(cache):
+    _caches.append(cache)
+
+
+def get_cache_stats():
+    """Return the statistics of all bounded caches of this process.
+    """
+    return [cache.get_stats() for cache in _caches]
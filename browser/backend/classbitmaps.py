@@ -0,0 +1,138 @@
+"""
+Precomputed class membership bitmaps for the 'is_class' and 'instance_of' search filters.
+
+Every labeled node gets a dense integer ID (in descending pagerank order), and
+for every class we store a compressed bitmap of the IDs of its transitive
+instances and subclasses from the P31P279star graph, plus one bitmap of all
+nodes that are classes themselves.  Search candidates can then be filtered by
+bitmap membership in memory instead of joining against 'p31279star' or 'claims'.
+"""
+
+import itertools
+import sys
+import time
+from functools import lru_cache
+
+import browser.backend.buildinfo as buildinfo
+from browser.backend.bitmap import RoaringBitmap
+
+
+CLASS_BITMAPS_BUILD_NAME = 'class-bitmaps'
+NODE_IDS_TABLE = 'rb_node_ids'
+CLASS_BITMAPS_TABLE = 'rb_class_bitmaps'
+
+# key of the bitmap of all classes, which can't clash with a node name:
+ALL_CLASSES_KEY = '*classes*'
+
+# Number of class bitmaps kept in memory:
+DEFAULT_CACHE_SIZE = 256
+
+# Maximum number of SQL parameters we use per statement:
+SQL_CHUNK_SIZE = 500
+
+
+class ClassBitmaps(object):
+    """
+    Class membership bitmaps stored in the graph cache managed by 'store'.
+    """
+
+    def __init__(self, store, cache_size=DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.get_bitmap = lru_cache(maxsize=cache_size)(self.load_bitmap)
+
+    @classmethod
+    def load(cls, store, cache_size=DEFAULT_CACHE_SIZE):
+        """Return the class bitmaps in 'store', or None if they have not been built.
+        """
+        if not (store.has_table(NODE_IDS_TABLE) and store.has_table(CLASS_BITMAPS_TABLE)):
+            return None
+        return cls(store, cache_size=cache_size)
+
+    ### Building:
+
+    def build(self, nodes_table, star_table, star_label, edges_table, subclass_label, log=sys.stderr):
+        """Build node IDs for all nodes in the l_d_pgr_ud-style 'nodes_table', a bitmap for
+        each class in 'star_table' from its 'star_label' edges, and the bitmap of all classes
+        from the 'subclass_label' edges in 'edges_table'.  Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        for table in (NODE_IDS_TABLE, CLASS_BITMAPS_TABLE):
+            store.execute(f'DROP TABLE IF EXISTS {table}')
+        store.execute(f'CREATE TABLE {NODE_IDS_TABLE} (node1 TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID')
+        store.execute(f'INSERT INTO {NODE_IDS_TABLE} '
+                      f'SELECT node1, ROW_NUMBER() OVER (ORDER BY MAX(CAST("node1;pagerank" AS REAL)) DESC, node1) '
+                      f'FROM {nodes_table} GROUP BY node1')
+        if log:
+            print('Assigned node IDs in %.1f secs' % (time.time() - start), file=log, flush=True)
+
+        # bitmap blobs can be large, so we use a rowid table here:
+        store.execute(f'CREATE TABLE {CLASS_BITMAPS_TABLE} (class TEXT PRIMARY KEY, cardinality INTEGER, bitmap BLOB)')
+        members = store.execute(f'SELECT s.node2, i.id FROM {star_table} s JOIN {NODE_IDS_TABLE} i ON i.node1=s.node1 '
+                                f'WHERE s.label=? AND s.node1!=s.node2 ORDER BY s.node2, i.id', (star_label,))
+        num_classes = 0
+        for cls, rows in itertools.groupby(members, key=lambda row: row[0]):
+            bitmap = RoaringBitmap.from_sorted(row[1] for row in rows)
+            store.execute(f'INSERT INTO {CLASS_BITMAPS_TABLE} VALUES (?, ?, ?)', (cls, len(bitmap), bitmap.to_bytes()))
+            num_classes += 1
+        classes = store.execute(f'SELECT DISTINCT i.id FROM {edges_table} e JOIN {NODE_IDS_TABLE} i ON i.node1=e.node1 '
+                                f'WHERE e.label=? ORDER BY i.id', (subclass_label,))
+        bitmap = RoaringBitmap.from_sorted(row[0] for row in classes)
+        store.execute(f'INSERT INTO {CLASS_BITMAPS_TABLE} VALUES (?, ?, ?)',
+                      (ALL_CLASSES_KEY, len(bitmap), bitmap.to_bytes()))
+        store.commit()
+
+        config = {
+            'nodes': nodes_table,
+            'star': [star_table, star_label],
+            'subclass': [edges_table, subclass_label],
+        }
+        info = buildinfo.record_build(store, CLASS_BITMAPS_BUILD_NAME, config, [NODE_IDS_TABLE, CLASS_BITMAPS_TABLE])
+        if log:
+            print('Built bitmaps for %d classes and %d class nodes in %.1f secs, %s on disk'
+                  % (num_classes, len(bitmap), time.time() - start, buildinfo.format_size(info['size'])),
+                  file=log, flush=True)
+        return info
+
+    ### Filtering:
+
+    def load_bitmap(self, key):
+        """Load the bitmap stored under 'key' (a class node or 'ALL_CLASSES_KEY').
+        Classes without any instances get an empty bitmap.
+        """
+        row = self.store.execute(f'SELECT bitmap FROM {CLASS_BITMAPS_TABLE} WHERE class=?', (key,)).fetchone()
+        if row is None:
+            return RoaringBitmap()
+        return RoaringBitmap.from_bytes(row[0])
+
+    def get_node_ids(self, nodes):
+        """Return a dict mapping each of 'nodes' that has a node ID to its ID.
+        """
+        ids = {}
+        nodes = list(nodes)
+        for i in range(0, len(nodes), SQL_CHUNK_SIZE):
+            chunk = nodes[i:i + SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            ids.update(self.store.execute(f'SELECT node1, id FROM {NODE_IDS_TABLE} WHERE node1 IN ({marks})', chunk))
+        return ids
+
+    def get_class_bitmap(self, is_class=False, instance_of=None):
+        """Return the bitmap of the class restriction given by 'is_class' and 'instance_of',
+        or None if there is no restriction.
+        """
+        if instance_of is not None:
+            return self.get_bitmap(instance_of)
+        elif is_class:
+            return self.get_bitmap(ALL_CLASSES_KEY)
+        return None
+
+    def filter_nodes(self, nodes, is_class=False, instance_of=None):
+        """Return the subset of 'nodes' that are instances or subclasses of 'instance_of'
+        (if given), or else that are classes (if 'is_class').
+        """
+        bitmap = self.get_class_bitmap(is_class=is_class, instance_of=instance_of)
+        if bitmap is None:
+            return set(nodes)
+        if len(bitmap) == 0:
+            return set()
+        return {node for node, node_id in self.get_node_ids(nodes).items() if node_id in bitmap}
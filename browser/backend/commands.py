@@ -0,0 +1,205 @@
+"""
+Offline build commands for the KGTK browser, run via 'kgtk browser <action>'.
+
+These commands add auxiliary tables to the graph cache configured by
+KGTK_BROWSER_GRAPH_CACHE, so they need write access to it and should be
+run while no browser server is using the cache.
+"""
+
+import os
+import sys
+
+from browser.backend.kypher import BrowserBackend
+import browser.backend.trigram as trigram
+import browser.backend.search as search
+import browser.backend.classbitmaps as classbitmaps
+import browser.backend.fts as fts
+import browser.backend.materialize as materialize
+import browser.backend.display as display
+import browser.backend.sortkeys as sortkeys
+
+
+# graph cache alias of the label search table with pagerank and description columns:
+SEARCH_LABELS_GRAPH = 'l_d_pgr_ud'
+
+DEFAULT_CONFIG_FILE = 'browser/backend/kgtk_browser_config.py'
+
+
+def get_build_backend():
+    """Return a browser backend connected to the configured graph cache, with the
+    browser configuration file named by KGTK_BROWSER_CONFIG imported (if it exists).
+    """
+    # imported here, since loading the browser configuration has side effects:
+    import flask
+    from browser.backend.kypher_queries import KypherAPIObject
+    backend = BrowserBackend(api=KypherAPIObject())
+    config = flask.Config(os.getcwd())
+    config.from_pyfile(os.environ.get('KGTK_BROWSER_CONFIG', DEFAULT_CONFIG_FILE), silent=True)
+    backend.import_config(config)
+    return backend
+
+
+def get_required_table(backend, name):
+    table = backend.get_graph_table(name)
+    if table is None:
+        raise ValueError('graph cache does not contain required graph: %s' % name)
+    return table
+
+
+def build_trigram_index(languages=None, batch_size=None, log=sys.stderr):
+    """Build the trigram label index used by the 'match_label_trigrams' search mode.
+    """
+    backend = get_build_backend()
+    source = get_required_table(backend, SEARCH_LABELS_GRAPH)
+    index = trigram.TrigramIndex(backend.get_sql_store())
+    return index.build(source,
+                       label=backend.get_config('KG_LABELS_LABEL', 'label'),
+                       languages=languages,
+                       batch_size=batch_size or trigram.DEFAULT_BATCH_SIZE,
+                       log=log)
+
+
+def build_search_index(languages=None, batch_size=None, log=sys.stderr):
+    """Build the BM25 full-text search index served at '/kb/search' for each of
+    'languages' (defaults to the configured DEFAULT_LANGUAGE).
+    """
+    backend = get_build_backend()
+    sources = {
+        'label': (get_required_table(backend, 'labels'), backend.get_config('KG_LABELS_LABEL', 'label')),
+        'alias': (get_required_table(backend, 'aliases'), backend.get_config('KG_ALIASES_LABEL', 'alias')),
+        'description': (get_required_table(backend, 'descriptions'),
+                        backend.get_config('KG_DESCRIPTIONS_LABEL', 'description')),
+    }
+    pagerank_table = backend.get_graph_table(SEARCH_LABELS_GRAPH)
+    infos = []
+    for lang in languages or [backend.get_lang()]:
+        index = search.SearchIndex(backend.get_sql_store(), lang)
+        infos.append(index.build(sources,
+                                 pagerank_table=pagerank_table,
+                                 batch_size=batch_size or search.DEFAULT_BATCH_SIZE,
+                                 log=log))
+    return infos
+
+
+def build_class_bitmaps(log=sys.stderr):
+    """Build the class membership bitmaps used by the 'is_class' and 'instance_of' search filters.
+    """
+    backend = get_build_backend()
+    bitmaps = classbitmaps.ClassBitmaps(backend.get_sql_store())
+    return bitmaps.build(get_required_table(backend, SEARCH_LABELS_GRAPH),
+                         get_required_table(backend, 'p31279star'),
+                         backend.get_config('KG_P31P279STAR_LABEL', 'P31P279star'),
+                         get_required_table(backend, 'edges'),
+                         backend.get_config('KG_SUBCLASS_LABEL', 'P279'),
+                         log=log)
+
+
+def build_fts(tokenizer=None, prefix=None, batch_size=None, log=sys.stderr):
+    """Build the pagerank-ordered label FTS index used by the label prefix search.  The
+    FTS5 'tokenizer' and 'prefix' lengths default to the configured LABEL_FTS_TOKENIZER
+    and LABEL_FTS_PREFIX.
+    """
+    backend = get_build_backend()
+    index = fts.LabelFtsIndex(backend.get_sql_store())
+    return index.build(get_required_table(backend, SEARCH_LABELS_GRAPH),
+                       label=backend.get_config('KG_LABELS_LABEL', 'label'),
+                       tokenizer=tokenizer or backend.get_config('LABEL_FTS_TOKENIZER', fts.DEFAULT_TOKENIZER),
+                       prefix=prefix or backend.get_config('LABEL_FTS_PREFIX', fts.DEFAULT_PREFIX),
+                       batch_size=batch_size or fts.DEFAULT_BATCH_SIZE,
+                       log=log)
+
+
+def build_display_edges(languages=None, log=sys.stderr):
+    """Build the display edge tables read by the item edge queries for each of
+    'languages' (defaults to the configured DEFAULT_LANGUAGE).
+    """
+    backend = get_build_backend()
+    # make sure the graph cache has its label indexes and the language user function loaded:
+    backend.prepare_capped_edge_queries()
+    infos = []
+    for lang in languages or [backend.get_lang()]:
+        table = display.DisplayEdgeTable(backend.get_sql_store(), lang)
+        infos.append(table.build(get_required_table(backend, 'edges'),
+                                 get_required_table(backend, 'labels'),
+                                 get_required_table(backend, 'datatypes'),
+                                 label=backend.get_config('KG_LABELS_LABEL', 'label'),
+                                 datatype=backend.get_config('KG_DATATYPES_LABEL', 'datatype'),
+                                 log=log))
+    return infos
+
+
+def build_display_qualifiers(languages=None, log=sys.stderr):
+    """Build the display qualifier tables read by the qualifier queries for each of
+    'languages' (defaults to the configured DEFAULT_LANGUAGE).
+    """
+    backend = get_build_backend()
+    # make sure the graph cache has its qualifier indexes and the language user function loaded:
+    backend.prepare_edge_id_qualifier_queries()
+    infos = []
+    for lang in languages or [backend.get_lang()]:
+        table = display.DisplayQualifierTable(backend.get_sql_store(), lang)
+        infos.append(table.build(get_required_table(backend, 'edges'),
+                                 get_required_table(backend, 'qualifiers'),
+                                 get_required_table(backend, 'labels'),
+                                 label=backend.get_config('KG_LABELS_LABEL', 'label'),
+                                 log=log))
+    return infos
+
+
+def build_sort_keys(log=sys.stderr):
+    """Build the quantity and time sort keys used to page through property values at
+    '/kb/property', for claims and for the sort qualifiers named by the configured
+    AJAX_PROPERTIES_SORT_METADATA.
+    """
+    backend = get_build_backend()
+    sort_metadata = backend.get_config('AJAX_PROPERTIES_SORT_METADATA', None) or {}
+    qualifier_sorts = [(prop, metadata['Psort_qualifier']) for prop, metadata in sort_metadata.items()
+                       if metadata.get('Psort_qualifier') is not None
+                       and metadata.get('qualifier_datatype') in sortkeys.SORTABLE_DATATYPES]
+    keys = sortkeys.SortKeys(backend.get_sql_store())
+    return keys.build(get_required_table(backend, 'edges'),
+                      get_required_table(backend, 'qualifiers'),
+                      get_required_table(backend, 'datatypes'),
+                      datatype=backend.get_config('KG_DATATYPES_LABEL', 'datatype'),
+                      qualifier_sorts=qualifier_sorts,
+                      log=log)
+
+
+def materialize_pages(count=None, items_file=None, languages=None, processes=None, store_path=None,
+                      log=sys.stderr):
+    """Render the '/kb/xitem' and '/kb/ritem' responses of the top 'count' items by
+    pagerank (or of the items listed in 'items_file') for each of 'languages' into
+    the materialized page store at 'store_path' (defaults to MATERIALIZED_STORE).
+    """
+    # imported here, since the app loads its configuration and connects to the
+    # graph cache on import, and its helpers render the pages:
+    import kgtk_browser_app as browser_app
+    backend = browser_app.backend
+    config = browser_app.app.config
+    store_path = store_path or config.get('MATERIALIZED_STORE')
+    if store_path is None:
+        raise ValueError('no materialized page store given, use --store or set MATERIALIZED_STORE')
+    count = count or materialize.DEFAULT_COUNT
+    if items_file is not None:
+        items = materialize.read_items_file(items_file, count)
+    else:
+        items = materialize.get_top_items(backend, count, get_required_table(backend, SEARCH_LABELS_GRAPH))
+    tasks = []
+    for lang in languages or [backend.get_lang()]:
+        for endpoint in materialize.ENDPOINTS:
+            limits = browser_app.rb_get_page_limits(endpoint)
+            for item in items:
+                tasks.append((materialize.make_key(endpoint, item, lang, limits), endpoint, item, lang))
+    store = materialize.MaterializedStore(store_path)
+    try:
+        graph_signature = materialize.get_graph_signature(backend, config.get('GRAPH_ID'), config.get('GRAPH_CACHE'))
+        if store.get_meta('graph') not in (None, graph_signature):
+            # pages of a different graph can't be resumed from:
+            store.clear()
+        store.set_meta('graph', graph_signature)
+        # SQLite connections must not be carried across a fork, each worker opens its own:
+        backend.close_sql_store()
+        return materialize.materialize(store, tasks, browser_app.materialize_page_helper,
+                                       processes=processes, log=log)
+    finally:
+        store.close()
@@ -0,0 +1,237 @@
+"""
+Denormalized per-language display tables for the item page queries.
+
+The item edge queries join every edge of an item with the label of its
+relationship, the label of its node2 and the datatype of its relationship,
+filtering each label join by language with a user function.  (They also ask
+for node2 descriptions, but their description clause reuses the edge variable
+and never matches, so the tables leave descriptions empty as well.)  These
+joins are re-evaluated for every edge on every request.  A display edge table
+carries the joined columns for one language precomputed and is a WITHOUT ROWID
+table whose primary key starts with node1, so the edges of an item are stored
+together in the order the queries return them and fetching them is a single
+index range scan.  Display qualifier tables do the same for qualifiers,
+clustered by the ID of the qualified edge, so the qualifiers of a set of edges
+come out of the primary key already in display order.  The tables are opt-in:
+they are only used for languages they have been built for with
+'kgtk browser build-display-edges' and 'kgtk browser build-display-qualifiers',
+and only as long as the graphs they were built from have not been reimported.
+"""
+
+import json
+import re
+import sys
+import time
+
+import browser.backend.buildinfo as buildinfo
+
+
+DISPLAY_EDGES_BUILD_NAME = 'display-edges'
+DISPLAY_EDGES_TABLE = 'rb_display_edges'
+DISPLAY_QUALIFIERS_BUILD_NAME = 'display-qualifiers'
+DISPLAY_QUALIFIERS_TABLE = 'rb_display_qualifiers'
+
+EXTERNAL_ID_DATATYPE = 'external-id'
+
+
+def get_language_suffix(lang):
+    return re.sub(r'[^A-Za-z0-9]', '_', lang)
+
+
+class DisplayTable(object):
+    """
+    Base class of the display tables, which record the graph cache tables they
+    were built from under the build config keys listed in SOURCES.
+    """
+
+    SOURCES = ()
+
+    def exists(self):
+        return self.store.has_table(self.table)
+
+    def get_build_info(self):
+        return buildinfo.get_build_info(self.store, self.build_name)
+
+    def check_build(self):
+        """Return a list of messages describing why this table does not match the
+        graph cache it was built from, which is empty if it can be used.
+        """
+        info = self.get_build_info()
+        if info is None:
+            return ['display table %s has no recorded build' % self.table]
+        sources = [info['config'].get(key) for key in self.SOURCES]
+        return ['display table %s was built from graph %s, which has been reimported or dropped since'
+                % (self.table, table) for table in buildinfo.get_stale_sources(self.store, info, sources)]
+
+
+class DisplayEdgeTable(DisplayTable):
+    """
+    Display edge table for language 'lang' stored in the graph cache managed by 'store'.
+    """
+
+    SOURCES = ('edges', 'labels', 'datatypes')
+
+    def __init__(self, store, lang):
+        self.store = store
+        self.lang = lang
+        self.table = '%s_%s' % (DISPLAY_EDGES_TABLE, get_language_suffix(lang))
+        self.build_name = '%s-%s' % (DISPLAY_EDGES_BUILD_NAME, lang)
+
+    ### Building:
+
+    def build(self, edges_table, labels_table, datatypes_table,
+              label='label', datatype='datatype', log=sys.stderr):
+        """Build the table from 'edges_table' with the 'label' edges of 'labels_table' and the
+        'datatype' edges of 'datatypes_table'.  The 'kgtk_lqstring_lang' user function has to
+        be loaded.  Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        store.execute(f'DROP TABLE IF EXISTS {self.table}')
+        store.execute(f'CREATE TABLE {self.table} '
+                      '(node1 TEXT NOT NULL, label TEXT NOT NULL, node2 TEXT NOT NULL, id TEXT NOT NULL, '
+                      'relationship_label TEXT, target_label TEXT, wikidatatype TEXT, '
+                      'PRIMARY KEY (node1, label, node2, id)) WITHOUT ROWID')
+        lang = self.lang
+        # we keep one row per edge, the first label in the language if there are several:
+        store.execute(f"""
+            INSERT OR IGNORE INTO {self.table}
+            SELECT e.node1, e.label, e.node2, e.id,
+                (SELECT MIN(l.node2) FROM {labels_table} l
+                 WHERE l.node1=e.label AND l.label=? AND kgtk_lqstring_lang(l.node2)=?),
+                (SELECT MIN(l.node2) FROM {labels_table} l
+                 WHERE l.node1=e.node2 AND l.label=? AND kgtk_lqstring_lang(l.node2)=?),
+                (SELECT MIN(dt.node2) FROM {datatypes_table} dt WHERE dt.node1=e.label AND dt.label=?)
+            FROM {edges_table} e
+            ORDER BY e.node1, e.label, e.node2, e.id""",
+                      (label, lang, label, lang, datatype))
+        (num_edges,) = store.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()
+        store.commit()
+
+        config = {
+            'lang': lang,
+            'edges': edges_table,
+            'labels': labels_table,
+            'datatypes': datatypes_table,
+        }
+        info = buildinfo.record_build(store, self.build_name, config, [self.table])
+        if log:
+            edges_size = buildinfo.get_tables_size(store, [edges_table])
+            print('Built %s display edge table over %d edges in %.1f secs, %s on disk (edges table: %s)'
+                  % (lang, num_edges, time.time() - start, buildinfo.format_size(info['size']),
+                     buildinfo.format_size(edges_size)), file=log, flush=True)
+        return info
+
+    ### Querying:
+
+    def get_edges(self, node, limit, properties=None, max_values_per_property=0, uncapped_properties=()):
+        """Return a cursor over the display edges of 'node' in 'RB_NODE_EDGES_QUERY' column
+        order, restricted to the list of 'properties' if given.  If 'max_values_per_property'
+        is positive, only return that many edges for each property other than the
+        'uncapped_properties' and external identifiers.
+        """
+        params = [node]
+        property_filter = ''
+        if properties:
+            property_filter = 'AND label IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(list(properties)))
+        columns = 'id, node1, label, node2, relationship_label, node2, target_label, NULL, wikidatatype'
+        if max_values_per_property > 0:
+            params.extend([max_values_per_property, json.dumps(list(uncapped_properties)), EXTERNAL_ID_DATATYPE, limit])
+            query = f"""
+                SELECT {columns} FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY label ORDER BY node2, id) AS rank
+                    FROM {self.table} WHERE node1=? {property_filter})
+                WHERE rank<=? OR label IN (SELECT value FROM json_each(?)) OR wikidatatype=?
+                ORDER BY label, node2, id
+                LIMIT ?"""
+        else:
+            params.append(limit)
+            query = f"""
+                SELECT {columns} FROM {self.table}
+                WHERE node1=? {property_filter}
+                ORDER BY node1, label, node2, id
+                LIMIT ?"""
+        return self.store.execute(query, params)
+
+
+class DisplayQualifierTable(DisplayTable):
+    """
+    Display qualifier table for language 'lang' stored in the graph cache managed by 'store'.
+    """
+
+    SOURCES = ('edges', 'qualifiers', 'labels')
+
+    def __init__(self, store, lang):
+        self.store = store
+        self.lang = lang
+        self.table = '%s_%s' % (DISPLAY_QUALIFIERS_TABLE, get_language_suffix(lang))
+        self.node1_index = self.table + '_node1_idx'
+        self.build_name = '%s-%s' % (DISPLAY_QUALIFIERS_BUILD_NAME, lang)
+
+    ### Building:
+
+    def build(self, edges_table, qualifiers_table, labels_table, label='label', log=sys.stderr):
+        """Build the table from the qualifiers in 'qualifiers_table' of the edges in 'edges_table'
+        with the 'label' edges of 'labels_table'.  The 'kgtk_lqstring_lang' user function has
+        to be loaded.  Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        store.execute(f'DROP TABLE IF EXISTS {self.table}')
+        store.execute(f'CREATE TABLE {self.table} '
+                      '(edge_id TEXT NOT NULL, node1 TEXT NOT NULL, qual_relationship TEXT NOT NULL, '
+                      'qual_node2 TEXT NOT NULL, qual_id TEXT NOT NULL, qual_relationship_label TEXT, '
+                      'qual_node2_label TEXT, '
+                      'PRIMARY KEY (edge_id, qual_relationship, qual_node2, qual_id)) WITHOUT ROWID')
+        lang = self.lang
+        # we keep one row per qualifier, the first label in the language if there are several:
+        store.execute(f"""
+            INSERT OR IGNORE INTO {self.table}
+            SELECT e.id, e.node1, q.label, q.node2, q.id,
+                (SELECT MIN(l.node2) FROM {labels_table} l
+                 WHERE l.node1=q.label AND l.label=? AND kgtk_lqstring_lang(l.node2)=?),
+                (SELECT MIN(l.node2) FROM {labels_table} l
+                 WHERE l.node1=q.node2 AND l.label=? AND kgtk_lqstring_lang(l.node2)=?)
+            FROM {qualifiers_table} q
+            JOIN {edges_table} e ON e.id=q.node1
+            ORDER BY e.id, q.label, q.node2, q.id""",
+                      (label, lang, label, lang))
+        # the qualifiers of all edges of an item, in primary key order per item:
+        store.execute(f'CREATE INDEX {self.node1_index} ON {self.table} (node1)')
+        (num_qualifiers,) = store.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()
+        store.commit()
+
+        config = {
+            'lang': lang,
+            'edges': edges_table,
+            'qualifiers': qualifiers_table,
+            'labels': labels_table,
+        }
+        info = buildinfo.record_build(store, self.build_name, config, [self.table])
+        if log:
+            qualifiers_size = buildinfo.get_tables_size(store, [qualifiers_table])
+            print('Built %s display qualifier table over %d qualifiers in %.1f secs, %s on disk (qualifiers table: %s)'
+                  % (lang, num_qualifiers, time.time() - start, buildinfo.format_size(info['size']),
+                     buildinfo.format_size(qualifiers_size)), file=log, flush=True)
+        return info
+
+    ### Querying:
+
+    COLUMNS = ('edge_id, node1, qual_id, qual_relationship, qual_node2, qual_relationship_label, '
+               'qual_node2_label, NULL')
+    ORDER = 'edge_id, qual_relationship, qual_node2, qual_id'
+
+    def get_qualifiers(self, edge_ids, limit):
+        """Return a cursor over the qualifiers of the edges with 'edge_ids' in
+        'RB_NODE_EDGE_QUALIFIERS_QUERY' column order.
+        """
+        query = (f'SELECT {self.COLUMNS} FROM {self.table} '
+                 f'WHERE edge_id IN (SELECT value FROM json_each(?)) ORDER BY {self.ORDER} LIMIT ?')
+        return self.store.execute(query, (json.dumps(list(edge_ids)), limit))
+
+    def get_node_qualifiers(self, node, limit):
+        """Return a cursor over the qualifiers of all edges that have 'node' as their node1.
+        """
+        query = f'SELECT {self.COLUMNS} FROM {self.table} WHERE node1=? ORDER BY node1, {self.ORDER} LIMIT ?'
+        return self.store.execute(query, (node, limit))
@@ -0,0 +1,64 @@
+"""
+Sorting of item edges for display.
+
+Item edges are displayed ordered by property priority, then by relationship
+label and then by target label, ignoring case.  The relationships of a set of
+edges are few compared to the edges, so we rank the distinct relationships
+first (casefolding each relationship label once) and then sort the edges with
+a single 'list.sort' on keys that combine the fixed-width relationship rank
+with the casefolded target label.  Keeping the keys plain strings rather than
+tuples lets CPython use its fast string comparison during the sort.  The sort
+is stable, so edges with equal keys keep the order in which the query
+returned them.
+"""
+
+from typing import List, Mapping, Optional, Sequence
+
+
+def rank_relationships(edges: Sequence[Sequence[str]],
+                       relationship_idx: int,
+                       relationship_label_idx: int,
+                       priority_map: Optional[Mapping[str, int]],
+                       default_priority: int) -> Mapping[str, str]:
+    """Return a dict that maps each relationship of 'edges' to a fixed-width rank
+    string, ordered by relationship priority, casefolded relationship label and
+    relationship.  Including the relationship keeps the edges of a relationship
+    together even if two relationships share a label.
+    """
+    get_priority = (priority_map or {}).get
+    relationship_keys: dict = dict()
+    for edge in edges:
+        relationship: str = edge[relationship_idx]
+        if relationship not in relationship_keys:
+            relationship_label: Optional[str] = edge[relationship_label_idx]
+            relationship_keys[relationship] = (get_priority(relationship, default_priority),
+                                               (relationship_label if relationship_label is not None
+                                                else relationship).casefold(),
+                                               relationship)
+    width: int = len(str(len(relationship_keys)))
+    return {relationship: str(rank).zfill(width)
+            for rank, relationship in enumerate(sorted(relationship_keys, key=relationship_keys.get))}
+
+
+def sort_edges(edges: Sequence[Sequence[str]],
+               relationship_idx: int,
+               relationship_label_idx: int,
+               target_idx: int,
+               target_label_idx: int,
+               priority_map: Optional[Mapping[str, int]],
+               default_priority: int) -> List[Sequence[str]]:
+    """Return a new list of 'edges' sorted by the priority of their relationship in
+    'priority_map' (or 'default_priority' if it isn't listed), their relationship
+    label (or relationship), the relationship itself and their target label (or
+    target node), ignoring case.  The '*_idx' arguments locate these fields in the edges.
+    """
+    ranks: Mapping[str, str] = rank_relationships(edges, relationship_idx, relationship_label_idx,
+                                                  priority_map, default_priority)
+
+    def sort_key(edge: Sequence[str]) -> str:
+        target_label: Optional[str] = edge[target_label_idx]
+        if target_label is None:
+            target_label = edge[target_idx] or ''
+        return ranks[edge[relationship_idx]] + target_label.casefold()
+
+    return sorted(edges, key=sort_key)
@@ -4,17 +4,146 @@ Fast and simple dataframe implementation.
 
 import io
 import csv
-from operator import itemgetter
-from collections import OrderedDict
+from operator import itemgetter, is_not, methodcaller
+from functools import partial
 import itertools
 
+import numpy as np
+import pandas as pd
+
 from kgtk.exceptions import KGTKException
 
 
+class RowPlan(object):
+    """
+    Lazily evaluated operation on the rows of a 'FastDataFrame'.  Frame operations
+    stack plans on top of each other instead of computing rows, and iterating a plan
+    runs the whole stack as one stream of chained C-level iterators.  Plans are
+    iterables, so they can serve as the 'rows' of a frame like any other iterable,
+    and they can be run any number of times.
+    """
+
+    # rows are atoms instead of tuples (for single columns projected by name or index):
+    atomic = False
+
+    def __iter__(self):
+        return self.stream()
+
+    def stream(self, deduped=False):
+        """Return an iterator over the rows of this plan.  'deduped' indicates that
+        an enclosing plan removes duplicates anyway, so any nested duplicate removal
+        can be skipped without changing the rows or their order in the final result.
+        """
+        raise KGTKException('not implemented')
+
+    def explain(self, deduped=False, indent=0):
+        """Return a list of lines describing this plan as it will be run.
+        """
+        raise KGTKException('not implemented')
+
+
+class ScanPlan(RowPlan):
+
+    def __init__(self, rows):
+        self.rows = [] if rows is None else rows
+
+    def stream(self, deduped=False):
+        rows = self.rows
+        if not isinstance(rows, (list, set, tuple, FastDataFrame)):
+            # one-shot iterators are listified when first run, so the plan can be run again:
+            rows = self.rows = list(rows)
+        return iter(rows)
+
+    def explain(self, deduped=False, indent=0):
+        rows = self.rows
+        if isinstance(rows, (list, set, tuple, FastDataFrame)):
+            source = '%s (%d rows)' % (type(rows).__name__, len(rows))
+        else:
+            source = type(rows).__name__
+        return ['%sScan %s' % (' ' * indent, source)]
+
+
+class ProjectPlan(RowPlan):
+
+    def __init__(self, input, icols, columns, atomic=False):
+        self.input = input
+        self.icols = icols
+        self.columns = columns
+        self.atomic = atomic
+
+    def stream(self, deduped=False):
+        if len(self.icols) > 1 or self.atomic:
+            getter = itemgetter(*self.icols)
+        else:
+            # ensure single-item tuple, itemgetter converts to atom in this case:
+            col = self.icols[0]
+            getter = lambda r: (r[col],)
+        return map(getter, self.input.stream(deduped=deduped))
+
+    def explain(self, deduped=False, indent=0):
+        return (['%sProject %s%s' % (' ' * indent, list(self.columns), self.atomic and ' as atoms' or '')] +
+                self.input.explain(deduped=deduped, indent=indent + 2))
+
+
+class DropNullsPlan(RowPlan):
+
+    def __init__(self, input):
+        self.input = input
+        self.atomic = input.atomic
+
+    def stream(self, deduped=False):
+        rows = self.input.stream(deduped=deduped)
+        if self.atomic:
+            return filter(partial(is_not, None), rows)
+        return itertools.filterfalse(methodcaller('__contains__', None), rows)
+
+    def explain(self, deduped=False, indent=0):
+        return ['%sDropNulls' % (' ' * indent)] + self.input.explain(deduped=deduped, indent=indent + 2)
+
+
+class DropDuplicatesPlan(RowPlan):
+
+    def __init__(self, input):
+        self.input = input
+        self.atomic = input.atomic
+
+    def stream(self, deduped=False):
+        if deduped:
+            return self.input.stream(deduped=True)
+        # a dict is an insertion-ordered set, filled in one pass over the fused input stream:
+        return iter(dict.fromkeys(self.input.stream(deduped=True)))
+
+    def explain(self, deduped=False, indent=0):
+        if deduped:
+            return ['%sDropDuplicates (done by enclosing DropDuplicates)' % (' ' * indent)] + \
+                self.input.explain(deduped=True, indent=indent + 2)
+        return ['%sDropDuplicates' % (' ' * indent)] + self.input.explain(deduped=True, indent=indent + 2)
+
+
+class ConcatPlan(RowPlan):
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.atomic = inputs[0].atomic
+
+    def stream(self, deduped=False):
+        return itertools.chain.from_iterable(input.stream(deduped=deduped) for input in self.inputs)
+
+    def explain(self, deduped=False, indent=0):
+        lines = ['%sConcat' % (' ' * indent)]
+        for input in self.inputs:
+            lines.extend(input.explain(deduped=deduped, indent=indent + 2))
+        return lines
+
+
 class FastDataFrame(object):
     """
     Fast and simple dataframe implementation that mirrors the functionality we
     previously implemented via pandas.  This is less general but about 10x faster.
+    Operations are lazy: 'project', 'drop_nulls', 'drop_duplicates', 'concat' and
+    'union' build a 'RowPlan' that is only run when the rows are needed, which runs
+    all of them in a single pass with at most one duplicate-removing set per result.
+    Use 'explain' to see the plan of a frame.
     """
     
     def __init__(self, columns, rows):
@@ -45,6 +174,9 @@ class FastDataFrame(object):
         return len(self) == 0
 
     def copy(self):
+        if isinstance(self.rows, RowPlan):
+            # plans are never modified, so the copy can share it:
+            return FastDataFrame(self.columns, self.rows)
         # if it is an iterable, we need to listify first, otherwise copying will exhaust the iter:
         rows = self.get_rows()
         return FastDataFrame(self.columns, rows.copy())
@@ -57,6 +189,18 @@ class FastDataFrame(object):
         columns = (columns,) if isinstance(columns, (int, str)) else columns
         return tuple(columns)
 
+    def get_plan(self):
+        """Return the rows of this frame as a plan for frames derived from it.
+        """
+        rows = self.rows
+        if isinstance(rows, RowPlan):
+            return rows
+        plan = ScanPlan(rows)
+        if not isinstance(rows, (list, set, tuple)):
+            # all frames derived from this one share a single scan of a one-shot iterator:
+            self.rows = plan
+        return plan
+
     def get_rows(self):
         """Materialize the current set of rows as a list if necessary
         and return the result.
@@ -81,7 +225,7 @@ class FastDataFrame(object):
         """Rename some or all columns according to the map in 'colmap'.
         """
         newcols = tuple(colmap.get(c, c) for c in self.columns)
-        df = inplace and self or FastDataFrame(newcols, self.rows)
+        df = self if inplace else FastDataFrame(newcols, self.rows)
         df.columns = newcols
         return df
 
@@ -92,28 +236,21 @@ class FastDataFrame(object):
         """
         atomic_singletons = isinstance(columns, (int, str))
         icols = self._get_column_indices(columns)
-        if len(icols) > 1 or atomic_singletons:
-            return FastDataFrame(itemgetter(*icols)(self.columns), map(lambda r: itemgetter(*icols)(r), self.rows))
-        else:
-            # ensure single-item tuple, itemgetter converts to atom in this case:
-            col = icols[0]
-            return FastDataFrame(itemgetter(*icols)(self.columns), map(lambda r: (r[col],), self.rows))
+        newcols = tuple(self.columns[i] for i in icols)
+        return FastDataFrame(newcols, ProjectPlan(self.get_plan(), icols, newcols, atomic=atomic_singletons))
 
     def drop_duplicates(self, inplace=False):
         """Remove all duplicate rows.  Preserve order of first appearance.
         """
-        rows = list(OrderedDict.fromkeys(self.rows))
-        if inplace:
-            self.rows = rows
-            return self
-        else:
-            return FastDataFrame(self.columns, rows)
+        df = self if inplace else FastDataFrame(self.columns, None)
+        df.rows = DropDuplicatesPlan(self.get_plan())
+        return df
 
     def drop_nulls(self, inplace=False):
         """Remove all rows that have at least one None value.
         """
-        df = inplace and self or FastDataFrame(self.columns, None)
-        df.rows = filter(lambda r: None not in r, self.rows)
+        df = self if inplace else FastDataFrame(self.columns, None)
+        df.rows = DropNullsPlan(self.get_plan())
         return df
 
     def coerce_type(self, column, type, inplace=False):
@@ -134,10 +271,12 @@ class FastDataFrame(object):
                 raise KGTKException('unioned frames need to have the same number of columns')
             norm_dfs.append(df)
         if len(norm_dfs) == 1:
-            return inplace and self or self.copy()
+            return self if inplace else self.copy()
         else:
-            df = inplace and self or FastDataFrame(columns, None)
-            df.rows = itertools.chain(*norm_dfs)
+            # plain frames contribute their plans, so they are fused into the concatenation:
+            inputs = [df.get_plan() if type(df) is FastDataFrame else ScanPlan(df) for df in norm_dfs]
+            df = self if inplace else FastDataFrame(columns, None)
+            df.rows = ConcatPlan(inputs)
             return df
         
     def union(self, *dfs, inplace=False):
@@ -153,6 +292,11 @@ class FastDataFrame(object):
         self.rows = list(self.rows)
         return self.rows
 
+    def explain(self):
+        """Return a printable description of the plan that computes the rows of this frame.
+        """
+        return '\n'.join(self.get_plan().explain()) + '\n'
+
     def to_string(self):
         """Return a printable string representation of this frame.
         """
@@ -161,21 +305,21 @@ class FastDataFrame(object):
                                quoting=csv.QUOTE_NONE, quotechar=None,
                                lineterminator='\n', escapechar=None)
         csvwriter.writerow(self.columns)
-        csvwriter.writerows(self.rows)
+        csvwriter.writerows(self)
         return out.getvalue()
 
     def to_records_dict(self):
         """Return a list of rows each represented as a dict of column/value pairs.
         """
         columns = self.columns
-        return [{k: v for k, v in zip(columns, r)} for r in self.rows]
+        return [{k: v for k, v in zip(columns, r)} for r in self]
 
     def to_value_dict(self):
         """Convert a single-valued values data frame into a corresponding JSON dict.
         Assumes 'self' is a binary key/value frame where each key has exactly 1 value.
         Keys are assumed to be in column 0 and values in column 1.
         """
-        return {k: v for k, v in self.rows}
+        return {k: v for k, v in self}
 
     def to_values_dict(self):
         """Convert a multi-valued 'values_df' data frame into a corresponding JSON dict.
@@ -183,6 +327,209 @@ class FastDataFrame(object):
         Keys are assumed to be in column 0 and values in column 1.
         """
         result = {}
-        for k, v in self.rows:
+        for k, v in self:
             result.setdefault(k, []).append(v)
         return result
+
+
+
+class DictionaryColumn(object):
+    """
+    Column of a 'ColumnarDataFrame'.  Holds the column's values as an object array,
+    its dictionary encoding as an array of integer codes into an array of distinct
+    values (code -1 stands for None), or both.  Each form is computed from the
+    other when it is first needed, so columns that are only passed through are
+    never encoded, and columns that are encoded are only decoded for the rows that
+    get exported.
+    """
+
+    __slots__ = ('values', 'codes', 'dictionary')
+
+    def __init__(self, values=None, codes=None, dictionary=None):
+        self.values = values
+        self.codes = codes
+        self.dictionary = dictionary  # distinct values followed by None, so code -1 decodes to None
+
+    def __len__(self):
+        return len(self.values) if self.values is not None else len(self.codes)
+
+    def get_values(self):
+        if self.values is None:
+            self.values = self.dictionary.take(self.codes)
+        return self.values
+
+    def get_codes(self):
+        if self.codes is None:
+            codes, uniques = pd.factorize(self.values)
+            self.codes = codes
+            self.dictionary = np.append(uniques.astype(object), None)
+        return self.codes
+
+    def get_null_mask(self):
+        if self.codes is not None:
+            return self.codes < 0
+        return np.equal(self.values, None)
+
+    def take(self, indices):
+        """Return a new column with the rows at 'indices' (an index or boolean mask array).
+        """
+        if self.codes is not None:
+            return DictionaryColumn(codes=self.codes[indices], dictionary=self.dictionary)
+        return DictionaryColumn(values=self.values[indices])
+
+    @staticmethod
+    def concat(columns):
+        """Return a new column with the rows of all 'columns'.  Encoded columns are
+        concatenated as codes, mapping each column's codes onto one merged dictionary.
+        """
+        if all(column.codes is not None for column in columns):
+            # the distinct values of all dictionaries without their trailing None:
+            values = np.concatenate([column.dictionary[:-1] for column in columns])
+            merged_codes, uniques = pd.factorize(values)
+            codes = []
+            start = 0
+            for column in columns:
+                size = len(column.dictionary) - 1
+                # append -1 to the code map, so null codes stay null:
+                code_map = np.append(merged_codes[start:start + size], -1)
+                codes.append(code_map.take(column.codes))
+                start += size
+            return DictionaryColumn(codes=np.concatenate(codes), dictionary=np.append(uniques.astype(object), None))
+        return DictionaryColumn(values=np.concatenate([column.get_values() for column in columns]))
+
+
+class ColumnarDataFrame(FastDataFrame):
+    """
+    Columnar variant of 'FastDataFrame' with the same API, backed by NumPy arrays.
+    Each column is a 'DictionaryColumn' that is dictionary-encoded into integer codes
+    on demand.  'project' selects columns without copying, 'drop_nulls' and
+    'drop_duplicates' compute the surviving rows from the codes with vectorized
+    operations and gather each column once, and rows are only decoded into tuples
+    when the frame is iterated.
+    """
+
+    def __init__(self, columns, rows, atomic=False):
+        """Create a dataframe with header 'columns' and data 'rows' like 'FastDataFrame'.
+        If 'atomic', rows are single values instead of tuples of one column.
+        """
+        self.columns = self.get_columns(columns)
+        self.atomic = atomic
+        if rows is None:
+            self.data = None
+            return
+        # listify an iterator over 'rows', since list() would ask a frame for its length
+        # first, which materializes and thereby exhausts a frame over a one-shot iterator:
+        rows = rows if isinstance(rows, list) else list(iter(rows))
+        if atomic:
+            values = np.empty(len(rows), dtype=object)
+            values[:] = rows
+            self.data = [DictionaryColumn(values=values)]
+        else:
+            # fill an empty object array, so values that are sequences are not unpacked:
+            table = np.empty((len(rows), len(self.columns)), dtype=object)
+            if rows:
+                table[:] = rows
+            self.data = [DictionaryColumn(values=table[:, i]) for i in range(len(self.columns))]
+
+    @classmethod
+    def from_columns(cls, columns, data, atomic=False):
+        df = cls(columns, None, atomic=atomic)
+        df.data = data
+        return df
+
+    def __iter__(self):
+        values = [column.get_values().tolist() for column in self.data]
+        if self.atomic:
+            return iter(values[0])
+        return zip(*values)
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    @property
+    def rows(self):
+        # rows for code that accesses them directly, they are decoded on every access:
+        return self.to_list()
+
+    def copy(self):
+        # columns are never modified, so the copy can share them:
+        return ColumnarDataFrame.from_columns(self.columns, list(self.data), atomic=self.atomic)
+
+    def get_plan(self):
+        return ScanPlan(self)
+
+    def get_rows(self):
+        return self.to_list()
+
+    def rename(self, colmap, inplace=False):
+        df = self if inplace else self.copy()
+        df.columns = tuple(colmap.get(c, c) for c in self.columns)
+        return df
+
+    def project(self, columns):
+        atomic_singletons = isinstance(columns, (int, str))
+        icols = self._get_column_indices(columns)
+        return ColumnarDataFrame.from_columns(tuple(self.columns[i] for i in icols), [self.data[i] for i in icols],
+                                              atomic=atomic_singletons)
+
+    def take(self, indices, inplace=False):
+        """Keep the rows at 'indices' (an index or boolean mask array).
+        """
+        data = [column.take(indices) for column in self.data]
+        if inplace:
+            self.data = data
+            return self
+        return ColumnarDataFrame.from_columns(self.columns, data, atomic=self.atomic)
+
+    def drop_nulls(self, inplace=False):
+        nulls = np.logical_or.reduce([column.get_null_mask() for column in self.data])
+        if not nulls.any():
+            return self if inplace else self.copy()
+        return self.take(~nulls, inplace=inplace)
+
+    def drop_duplicates(self, inplace=False):
+        if len(self) == 0:
+            return self if inplace else self.copy()
+        codes = [column.get_codes() for column in self.data]
+        sizes = [len(column.dictionary) for column in self.data]
+        if np.prod(np.array(sizes, dtype=float)) < 2 ** 62:
+            # one mixed-radix key per row over the codes shifted to be non-negative:
+            key = codes[0] + 1
+            for column_codes, size in zip(codes[1:], sizes[1:]):
+                key = key * size + (column_codes + 1)
+            _, first = np.unique(key, return_index=True)
+        else:
+            _, first = np.unique(np.stack(codes, axis=1), axis=0, return_index=True)
+        if len(first) == len(self):
+            return self if inplace else self.copy()
+        # keep the first occurrence of each row in its original order:
+        return self.take(np.sort(first), inplace=inplace)
+
+    def concat(self, *dfs, inplace=False):
+        columns = self.columns
+        norm_dfs = [self]
+        for df in dfs:
+            if df is None:
+                continue
+            if len(columns) != len(df.columns):
+                raise KGTKException('unioned frames need to have the same number of columns')
+            if not isinstance(df, ColumnarDataFrame):
+                df = ColumnarDataFrame(df.columns, df.get_rows(), atomic=self.atomic)
+            norm_dfs.append(df)
+        if len(norm_dfs) == 1:
+            return self if inplace else self.copy()
+        data = [DictionaryColumn.concat([df.data[i] for df in norm_dfs]) for i in range(len(columns))]
+        if inplace:
+            self.data = data
+            return self
+        return ColumnarDataFrame.from_columns(columns, data, atomic=self.atomic)
+
+    def to_list(self):
+        return list(self)
+
+    def explain(self):
+        encoded = sum(1 for column in self.data if column.codes is not None)
+        return 'Columnar %d rows x %d columns, %d encoded\n' % (len(self), len(self.data), encoded)
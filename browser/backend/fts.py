@@ -0,0 +1,233 @@
+"""
+Pagerank-ordered full-text label index for top-k label search.
+
+The graph cache's standard FTS index returns every label matching a query,
+so the label search queries have to compute 'score*prank' for all hits and
+sort them before applying their LIMIT, which is slow for common tokens such
+as "john".  This index is an FTS5 table whose rowids follow descending
+pagerank order, so FTS5 produces matches highest pagerank first.  A search
+consumes that stream into a bounded top-k heap and stops as soon as no
+remaining match can enter the heap, making its cost proportional to k rather
+than to the number of hits.
+
+The tokenizer and the prefix index lengths of the index are configurable at
+build time.  There is no FTS5 rank setting, since matches are always consumed
+in rowid (pagerank) order.  The index is optimized (merged into a single
+b-tree per term) after loading, and its configuration is recorded with the
+build info, so the server can check at startup that the index it finds was
+built the way it is configured.
+"""
+
+import heapq
+import json
+import re
+import sys
+import time
+
+import browser.backend.buildinfo as buildinfo
+from browser.backend.text import split_lqstring, fold_text, tokenize
+
+
+FTS_BUILD_NAME = 'label-fts'
+FTS_TABLE = 'rb_label_fts'
+
+# Unicode tokenizer that folds diacritics, including those of composed characters:
+DEFAULT_TOKENIZER = 'unicode61 remove_diacritics 2'
+# Lengths of the token prefixes indexed for fast prefix queries:
+DEFAULT_PREFIX = '2 3 4'
+
+# Number of matches fetched and filtered at a time while streaming:
+DEFAULT_FETCH_SIZE = 64
+# Number of labels inserted per batch while building:
+DEFAULT_BATCH_SIZE = 100000
+
+# Upper bound of 'match_score', used to stop streaming early:
+MAX_MATCH_SCORE = 1.0
+
+NON_WORD_REGEX = re.compile(r'[\W_]+', re.UNICODE)
+PREFIX_REGEX = re.compile(r'^\s*[1-9][0-9]*(\s+[1-9][0-9]*)*\s*$')
+
+
+def normalize_text(text):
+    return NON_WORD_REGEX.sub(' ', fold_text(text)).strip()
+
+
+def match_score(query_norm, label_norm):
+    """Return how well a label covers the query, in (0, MAX_MATCH_SCORE].  A label
+    that equals the query scores highest; longer labels score proportionally less.
+    """
+    if not label_norm:
+        return 0.0
+    return min(MAX_MATCH_SCORE, len(query_norm) / max(len(label_norm), 1))
+
+
+def get_build_config(source_table, label, tokenizer=DEFAULT_TOKENIZER, prefix=DEFAULT_PREFIX):
+    """Return the configuration dict recorded for an index built with these settings.
+    """
+    return {
+        'source': source_table,
+        'label': label,
+        'tokenize': tokenizer,
+        'prefix': ' '.join(prefix.split()),
+        'order': 'pagerank',
+    }
+
+
+def quote_option(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def get_match_expression(text):
+    """Translate search 'text' into an FTS5 MATCH expression that requires all of
+    its tokens, with the last one matched as a prefix.  Returns None if 'text' has
+    no searchable tokens.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    terms = ['"%s"' % token for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class LabelFtsIndex(object):
+    """
+    Pagerank-ordered FTS5 label index stored in the graph cache managed by 'store'.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def exists(self):
+        return self.store.has_table(FTS_TABLE)
+
+    def get_build_info(self):
+        return buildinfo.get_build_info(self.store, FTS_BUILD_NAME)
+
+    def check_config(self, tokenizer=DEFAULT_TOKENIZER, prefix=DEFAULT_PREFIX):
+        """Return a list of messages describing how the recorded configuration of this
+        index differs from the given one, which is empty if they agree.
+        """
+        info = self.get_build_info()
+        if info is None:
+            return ['label FTS index %s was not built by kgtk browser build-fts' % FTS_TABLE]
+        recorded = info['config']
+        expected = get_build_config(recorded.get('source'), recorded.get('label'),
+                                    tokenizer=tokenizer, prefix=prefix)
+        messages = []
+        for key in ('tokenize', 'prefix'):
+            if recorded.get(key) != expected[key]:
+                messages.append('label FTS index was built with %s=%s, but %s is configured'
+                                % (key, json.dumps(recorded.get(key)), json.dumps(expected[key])))
+        return messages
+
+    ### Building:
+
+    def build(self, source_table, label='label', tokenizer=DEFAULT_TOKENIZER, prefix=DEFAULT_PREFIX,
+              batch_size=DEFAULT_BATCH_SIZE, log=sys.stderr):
+        """Build the index from the 'label' edges of the l_d_pgr_ud-style 'source_table'
+        which provides pagerank and description columns, using the FTS5 'tokenizer' and
+        the list of 'prefix' lengths to index.  Optimize the index when done and return
+        the recorded build info.
+        """
+        if not PREFIX_REGEX.match(prefix):
+            raise ValueError('FTS prefix has to be a list of positive integers: %s' % repr(prefix))
+        store = self.store
+        start = time.time()
+        store.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        store.execute(f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+                      f'text, node1 UNINDEXED, label UNINDEXED, lang UNINDEXED, '
+                      f'pagerank UNINDEXED, description UNINDEXED, '
+                      f'tokenize={quote_option(tokenizer)}, prefix={quote_option(" ".join(prefix.split()))})')
+        labels = store.execute(f'SELECT node1, node2, CAST("node1;pagerank" AS REAL) AS prank, "node1;description" '
+                               f'FROM {source_table} WHERE label=? ORDER BY prank DESC, node1', (label,))
+        rowid = 0
+        while True:
+            rows = labels.fetchmany(batch_size)
+            if not rows:
+                break
+            batch = []
+            for node1, node_label, pagerank, description in rows:
+                text, lang = split_lqstring(node_label)
+                # rowids encode pagerank order, highest first:
+                rowid += 1
+                batch.append((rowid, text, node1, node_label, lang, pagerank or 0.0, description))
+            store.executemany(f'INSERT INTO {FTS_TABLE} (rowid, text, node1, label, lang, pagerank, description) '
+                              f'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            if log:
+                print('Indexed %d labels in %.1f secs' % (rowid, time.time() - start), file=log, flush=True)
+        store.commit()
+        if log:
+            print('Optimizing label FTS index', file=log, flush=True)
+        store.execute(f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES (?)', ('optimize',))
+        store.commit()
+
+        config = get_build_config(source_table, label, tokenizer=tokenizer, prefix=prefix)
+        info = buildinfo.record_build(store, FTS_BUILD_NAME, config, [FTS_TABLE])
+        if log:
+            print('Built label FTS index over %d labels in %.1f secs, %s on disk'
+                  % (rowid, time.time() - start, buildinfo.format_size(info['size'])), file=log, flush=True)
+        return info
+
+    ### Searching:
+
+    def search(self, text, limit=20, lang='any', node_filter=None, fetch_size=DEFAULT_FETCH_SIZE):
+        """Return up to 'limit' (node1, node_label, score, prank, description) rows for labels
+        matching all tokens of 'text' (the last one as a prefix), ordered by descending
+        'score*prank' where 'score' is the 'match_score' of the label.  Each node is returned
+        once, with its best-scoring label.  Only labels in language 'lang' qualify.  If
+        'node_filter' is given, it is called with lists of candidate nodes and has to return
+        the subset of nodes to keep.
+
+        Unlike the Kypher text search, which scores labels with the FTS 'matchscore' (BM25),
+        'score' is the fraction of the label covered by the query.  BM25 depends on term
+        statistics of the whole match set, so it has no upper bound we could stop the
+        pagerank-ordered stream with.
+        """
+        match = get_match_expression(text)
+        if match is None or limit <= 0:
+            return []
+        query_norm = normalize_text(text)
+        # min-heap of the best 'limit' rows keyed on (score*prank, -rowid), one per node:
+        heap = []
+        node_entries = {}
+        cursor = self.store.execute(f"SELECT rowid, node1, label, pagerank, description, text FROM {FTS_TABLE} "
+                                    f"WHERE {FTS_TABLE} MATCH ? AND (?='any' OR lang=?) ORDER BY rowid",
+                                    (match, lang, lang))
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                keep = None
+                if node_filter is not None:
+                    keep = node_filter([row[1] for row in rows])
+                for rowid, node1, node_label, prank, description, label_text in rows:
+                    prank = prank or 0.0
+                    if len(heap) >= limit and prank * MAX_MATCH_SCORE <= heap[0][0][0]:
+                        # pagerank only decreases from here on, so no later match can make the cut:
+                        return self.heap_to_results(heap)
+                    if keep is not None and node1 not in keep:
+                        continue
+                    score = match_score(query_norm, normalize_text(label_text))
+                    entry = ((score * prank, -rowid), (node1, node_label, score, prank, description))
+                    current = node_entries.get(node1)
+                    if current is not None:
+                        if entry[0] > current[0]:
+                            # a better label of a node in the heap replaces its row:
+                            heap[heap.index(current)] = entry
+                            heapq.heapify(heap)
+                            node_entries[node1] = entry
+                    elif len(heap) < limit:
+                        heapq.heappush(heap, entry)
+                        node_entries[node1] = entry
+                    elif entry[0] > heap[0][0]:
+                        del node_entries[heapq.heapreplace(heap, entry)[1][0]]
+                        node_entries[node1] = entry
+        finally:
+            cursor.close()
+        return self.heap_to_results(heap)
+
+    @staticmethod
+    def heap_to_results(heap):
+        return [row for _, row in sorted(heap, reverse=True)]
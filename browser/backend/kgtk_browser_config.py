@@ -151,6 +151,60 @@ MATCH_LABEL_INSTANCE_OF = None
 # number of parallel kypher api objects
 KYPHER_OBJECTS_NUM = 5
 
+# Trigram label index (built with 'kgtk browser build-trigram-index'):
+MATCH_LABEL_TRIGRAMS = False
+TRIGRAM_MIN_SIMILARITY = 0.3
+TRIGRAM_MAX_CANDIDATES = 2000
+TRIGRAM_MAX_POSTINGS = 250000
+
+# Embedded full-text search served at /kb/search (built with 'kgtk browser build-search-index'):
+SEARCH_SIZE = 20
+SEARCH_MAX_EXPANSIONS = 50
+SEARCH_MAX_CANDIDATES = 1000
+
+# Fetch at most VALUELIST_MAX_LEN values per property in the item edge query.
+# Capped value lists show the first values by node2 instead of a random sample:
+CAP_VALUELISTS_IN_QUERY = False
+
+# Maximum number of query strings per /kb/query/batch request:
+QUERY_BATCH_MAX_SIZE = 10000
+
+# Superseded /kb/query requests (clients sending 'client' and 'seq' parameters):
+QUERY_SEQUENCER_SLOTS = 4096
+QUERY_SUPERSEDED_POLL_INTERVAL = 0.05
+
+# Bounds of the per-worker lookup caches (stats at /kb/cache_stats):
+LOOKUP_CACHE_MAX_ENTRIES = 100000
+QUALIFIER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# UI languages whose language name tables are loaded at startup (the tables
+# of other languages are loaded by each worker on first use):
+LANGUAGE_NAMES_PRELOAD = ['en']
+
+# Precomputed /kb/xitem and /kb/ritem pages of the top items (built with
+# 'kgtk browser materialize'), served for requests with the default limits:
+MATERIALIZED_STORE = None
+
+# Build the node data frames of /kb/item and /kb/get_node as NumPy-backed
+# dictionary-encoded columnar frames.  They deduplicate faster, but convert rows
+# on input and output, which costs about as much and needs more peak memory
+# (compare with benchmarks/fastdf_node_data.py before enabling this):
+COLUMNAR_DATA_FRAMES = False
+
+# Pagerank-ordered label FTS index (built with 'kgtk browser build-fts'), the
+# server warns at startup if the index was built with different settings:
+LABEL_FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+LABEL_FTS_PREFIX = '2 3 4'
+
+# Class membership bitmaps for is_class/instance_of search filters (built with
+# 'kgtk browser build-class-bitmaps'), searches for classes with fewer than
+# CLASS_FILTER_MIN_CLASS_SIZE members or whose restriction keeps too few of
+# CLASS_FILTER_MAX_FETCH candidates join the class in SQL instead:
+CLASS_BITMAP_CACHE_SIZE = 256
+CLASS_FILTER_OVERFETCH = 10
+CLASS_FILTER_MAX_FETCH = 10000
+CLASS_FILTER_MIN_CLASS_SIZE = 10000
+
 # Data server limits
 VALUELIST_MAX_LEN: int = 100
 PROPERTY_VALUES_COUNT_LIMIT: int = 10
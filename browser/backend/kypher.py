@@ -3,11 +3,19 @@ Kypher backend support for the KGTK browser and visualizer.
 """
 
 import io
+import json
 from functools import lru_cache
 import itertools
 
-from browser.backend.fastdf import FastDataFrame
+from browser.backend.fastdf import FastDataFrame, ColumnarDataFrame
 import browser.backend.format as fmt
+import browser.backend.trigram as trigram
+import browser.backend.search as search
+import browser.backend.classbitmaps as classbitmaps
+import browser.backend.fts as fts
+import browser.backend.display as display
+import browser.backend.sortkeys as sortkeys
+from browser.backend.rows import ItemEdgeFactory, QualifierEdgeFactory, make_item_edges, make_qualifier_edges
 
 
 # TO DO:
@@ -31,10 +39,47 @@ class BrowserBackend(object):
 
         # use triple format used by visualizer by default:
         self.formatter = formatter or fmt.JsonTripleFormat()
+        self.reset_store_state()
+
+    def reset_store_state(self):
+        """Forget all index objects and prepared query state tied to the current graph cache connection.
+        """
+        self.trigram_index = None
+        self.search_indexes = {}
+        self.class_bitmaps = None
+        self.label_fts = None
+        self.display_edge_tables = {}
+        self.display_qualifier_tables = {}
+        self.sort_keys = None
+        self.batch_lookups_prepared = False
+        self.capped_edge_queries_prepared = False
+        self.edge_id_qualifier_queries_prepared = False
+        self.node_labels_batch_prepared = False
+
+    def close_sql_store(self):
+        """Close the connection to the graph cache, so the next query opens a new one.
+        Call this before forking worker processes, since a SQLite connection must not
+        be carried across a 'fork' and used by several processes.  Query definitions
+        and graph inputs are kept, compiled queries and result caches are cleared.
+        """
+        kapi = self.api.kapi
+        with self.get_lock():
+            if kapi.sql_store is not None:
+                kapi.sql_store.close()
+                kapi.sql_store = None
+            # queries hold on to the store they were compiled for and recompile once the
+            # API timestamp changes:
+            kapi.clear_caches()
+        self.reset_store_state()
 
     def set_app_config(self, app):
         # import app config on top of api object config:
-        for key, value in app.config.items():
+        self.import_config(app.config)
+
+    def import_config(self, config):
+        """Import all key/value pairs of the 'config' mapping on top of the api object config.
+        """
+        for key, value in config.items():
             self.api.kapi.set_config(key, value)
 
     def get_config(self, key, dflt=None):
@@ -60,17 +105,131 @@ class BrowserBackend(object):
     def __exit__(self, *_exc):
         self.api.kapi.__exit__()
 
+    def interrupt(self):
+        """Abort any query currently executing on this backend's graph cache connection.
+        The interrupted query raises an 'sqlite3.OperationalError' in its calling thread.
+        """
+        store = self.api.kapi.sql_store
+        if store is not None and store.conn is not None:
+            store.conn.interrupt()
+
+    def get_sql_store(self):
+        """Return the SQL store object of the graph cache.
+        """
+        return self.api.kapi.get_sql_store()
+
+    def get_graph_table(self, name):
+        """Return the graph cache table holding the data of 'name', which may be an API
+        input name such as 'edges' or a graph cache alias such as 'l_d_pgr_ud'.  Return
+        None if there is no such graph in the cache.
+        """
+        if self.api.kapi.get_input_info(name) is not None:
+            name = self.api.kapi.get_input(name)
+        info = self.get_sql_store().get_file_info(name)
+        return info is not None and info.graph or None
+
+    SQL_CHUNK_SIZE = 500
+
+    def filter_class_nodes(self, nodes, is_class: bool = False, instance_of: str = None):
+        """Return the subset of 'nodes' that are subclasses (if 'is_class') or instances or
+        subclasses of 'instance_of' (if given), analogous to the class restrictions of the
+        label search queries.  Uses the precomputed class bitmaps if they are available.
+        """
+        bitmaps = self.get_class_bitmaps()
+        if bitmaps is not None:
+            return bitmaps.filter_nodes(nodes, is_class=is_class, instance_of=instance_of)
+        if instance_of is not None:
+            table = self.get_graph_table('p31279star')
+            condition = 'label=? AND node2=? AND node1!=node2'
+            params = [self.get_config('KG_P31P279STAR_LABEL', 'P31P279star'), instance_of]
+        elif is_class:
+            table = self.get_graph_table(self.get_config('KG_EDGES_GRAPH', 'claims'))
+            condition = 'label=?'
+            params = [self.get_config('KG_SUBCLASS_LABEL', 'P279')]
+        else:
+            return set(nodes)
+        store = self.get_sql_store()
+        result = set()
+        nodes = list(nodes)
+        for i in range(0, len(nodes), self.SQL_CHUNK_SIZE):
+            chunk = nodes[i:i + self.SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            query = f'SELECT DISTINCT node1 FROM {table} WHERE {condition} AND node1 IN ({marks})'
+            result.update(row[0] for row in store.execute(query, params + chunk))
+        return result
+
+    def get_class_bitmaps(self):
+        """Return the class membership bitmaps of the graph cache, or None if they have not been built.
+        """
+        if self.class_bitmaps is None:
+            self.class_bitmaps = classbitmaps.ClassBitmaps.load(
+                self.get_sql_store(),
+                cache_size=self.get_config('CLASS_BITMAP_CACHE_SIZE', classbitmaps.DEFAULT_CACHE_SIZE))
+        return self.class_bitmaps
+
+    def use_class_bitmaps(self, is_class: bool, instance_of: str, fmt) -> bool:
+        """Return True if a class-restricted search should filter the candidates of the
+        unrestricted search with the class bitmaps instead of joining in SQL.
+        """
+        return (is_class or instance_of is not None) and fmt is None and self.get_class_bitmaps() is not None
+
+    CLASS_FILTER_OVERFETCH = 10
+    CLASS_FILTER_MAX_FETCH = 10000
+    CLASS_FILTER_MIN_CLASS_SIZE = 10000
+
+    def filter_class_results(self, run_query, run_restricted_query, limit: int,
+                             is_class: bool = False, instance_of: str = None):
+        """Call 'run_query(fetch_limit)' to run an unrestricted search that returns an iterator
+        over its result rows and keep the rows whose node (in the first column) passes the
+        class restriction.  The candidates are streamed from that single query and filtered
+        in batches until 'limit' rows survive or no more candidates are available.
+        If the class has fewer than CLASS_FILTER_MIN_CLASS_SIZE members, or fewer than 'limit'
+        rows survive CLASS_FILTER_MAX_FETCH candidates, the restriction is too selective for
+        filtering and 'run_restricted_query()' runs the search with the class restriction
+        joined in SQL instead.
+        """
+        bitmaps = self.get_class_bitmaps()
+        if bitmaps is None:
+            return run_restricted_query()
+        min_size = self.get_config('CLASS_FILTER_MIN_CLASS_SIZE', self.CLASS_FILTER_MIN_CLASS_SIZE)
+        if len(bitmaps.get_class_bitmap(is_class=is_class, instance_of=instance_of) or ()) < min_size:
+            return run_restricted_query()
+        overfetch = self.get_config('CLASS_FILTER_OVERFETCH', self.CLASS_FILTER_OVERFETCH)
+        max_fetch = self.get_config('CLASS_FILTER_MAX_FETCH', self.CLASS_FILTER_MAX_FETCH)
+        batch_size = min(limit * overfetch, max_fetch)
+        results = run_query(max_fetch)
+        filtered = []
+        fetched = 0
+        try:
+            while fetched < max_fetch:
+                batch = list(itertools.islice(results, min(batch_size, max_fetch - fetched)))
+                fetched += len(batch)
+                keep = bitmaps.filter_nodes([row[0] for row in batch], is_class=is_class, instance_of=instance_of)
+                filtered.extend(row for row in batch if row[0] in keep)
+                if len(filtered) >= limit or fetched < max_fetch and len(batch) < batch_size:
+                    return filtered[:limit]
+        finally:
+            results.close()
+        return run_restricted_query()
+
     ### Query wrappers:
 
     FORMAT_FAST_DF = 'fdf'
 
+    def make_data_frame(self, columns, rows):
+        """Return a fast dataframe with 'columns' and 'rows', columnar if so configured.
+        """
+        if self.get_config('COLUMNAR_DATA_FRAMES', False):
+            return ColumnarDataFrame(columns, rows)
+        return FastDataFrame(columns, rows)
+
     def execute_query(self, query, fmt=None, **kwds):
         """Query execution wrapper that handles the special fast dataframe format.
         """
         qfmt = fmt == self.FORMAT_FAST_DF and 'list' or fmt
         result = query.execute(fmt=qfmt, **kwds)
         if fmt == self.FORMAT_FAST_DF:
-            result = FastDataFrame(query.get_result_header(), result)
+            result = self.make_data_frame(query.get_result_header(), result)
         return result
 
     def get_node_labels(self, node, lang=None, fmt=None):
@@ -79,6 +238,34 @@ class BrowserBackend(object):
         query = self.api.NODE_LABELS_QUERY()
         return self.execute_query(query, NODE=node, LANG=self.get_lang(lang), fmt=fmt)
 
+    def prepare_node_labels_batch(self):
+        """Run the single-node label query once, so the graph cache has created the
+        indexes and loaded the user functions that 'get_nodes_labels' relies on.
+        """
+        if not self.node_labels_batch_prepared:
+            self.execute_query(self.api.NODE_LABELS_QUERY(), NODE='', LANG=self.get_lang(None))
+            self.node_labels_batch_prepared = True
+
+    def get_nodes_labels(self, nodes, lang=None):
+        """Batched version of 'get_node_labels'.  Return the distinct (node1, node_label)
+        rows of all 'nodes' in the specified language, looking them up in chunks with
+        one IN query each.
+        """
+        self.prepare_node_labels_batch()
+        table = self.get_graph_table('labels')
+        store = self.get_sql_store()
+        label = self.get_config('KG_LABELS_LABEL', 'label')
+        lang = self.get_lang(lang)
+        nodes = list(nodes)
+        rows = []
+        for i in range(0, len(nodes), self.SQL_CHUNK_SIZE):
+            chunk = nodes[i:i + self.SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            query = (f'SELECT DISTINCT node1, node2 FROM {table} WHERE node1 IN ({marks}) AND label=? '
+                     f"AND (?='any' OR kgtk_lqstring_lang(node2)=?)")
+            rows.extend(store.execute(query, chunk + [label, lang, lang]))
+        return rows
+
     def get_node_aliases(self, node, lang=None, fmt=None):
         """Retrieve all aliases for 'node'.
         """
@@ -187,9 +374,9 @@ class BrowserBackend(object):
             df.drop_duplicates(inplace=True)
             columns = (fmt.NODE1_COLUMN, fmt.LABEL_COLUMN)
             if len(df) == 0:
-                return FastDataFrame(columns, [])
+                return self.make_data_frame(columns, [])
             labels = [self.get_node_labels(label, lang=lang, fmt='list') for label in df]
-            return FastDataFrame(columns, itertools.chain(*labels))
+            return self.make_data_frame(columns, itertools.chain(*labels))
         return None
 
     def collect_edge_node_labels(self, edges_df, inverse=False):
@@ -347,6 +534,11 @@ class BrowserBackend(object):
         # Raise the case of the label to implement a case-insensitive search.
         node = node.upper()
 
+        if self.use_class_bitmaps(is_class, instance_of, fmt):
+            results = self.execute_query(self.api.MATCH_ITEMS_EXACTLY_QUERY(), NODE=node)
+            keep = self.filter_class_nodes([row[0] for row in results], is_class=is_class, instance_of=instance_of)
+            return [row for row in results if row[0] in keep]
+
         if instance_of is not None:
             query = self.api.MATCH_ITEMS_EXACTLY_SUBCLASSSTAR_QUERY()
             return self.execute_query(query, NODE=node, CLASS=instance_of, fmt=fmt)
@@ -381,15 +573,99 @@ class BrowserBackend(object):
 
         search_label = f"'{safe_label}'@{_lang}".upper()
 
-        if instance_of is not None:
-            query = self.api.MATCH_UPPER_LABELS_EXACTLY_SUBCLASSSTAR_QUERY()
-            return self.execute_query(query, LABEL=search_label, LIMIT=limit, CLASS=instance_of, fmt=fmt)
-        else:
-            if is_class:
-                query = self.api.MATCH_UPPER_LABELS_EXACTLY_SUBCLASS_QUERY()
+        def run_restricted_query():
+            if instance_of is not None:
+                query = self.api.MATCH_UPPER_LABELS_EXACTLY_SUBCLASSSTAR_QUERY()
+                return self.execute_query(query, LABEL=search_label, LIMIT=limit, CLASS=instance_of, fmt=fmt)
             else:
-                query = self.api.MATCH_UPPER_LABELS_EXACTLY_QUERY()
-            return self.execute_query(query, LABEL=search_label, LIMIT=limit, fmt=fmt)
+                if is_class:
+                    query = self.api.MATCH_UPPER_LABELS_EXACTLY_SUBCLASS_QUERY()
+                else:
+                    query = self.api.MATCH_UPPER_LABELS_EXACTLY_QUERY()
+                return self.execute_query(query, LABEL=search_label, LIMIT=limit, fmt=fmt)
+
+        if self.use_class_bitmaps(is_class, instance_of, fmt):
+            query = self.api.MATCH_UPPER_LABELS_EXACTLY_QUERY()
+            return self.filter_class_results(
+                lambda fetch: self.execute_query(query, LABEL=search_label, LIMIT=fetch, fmt='iter'),
+                run_restricted_query, limit, is_class=is_class, instance_of=instance_of)
+        return run_restricted_query()
+
+    def prepare_batch_lookups(self):
+        """Run the single-node exact item and label queries once, so the graph cache
+        has created the indexes that the batched lookups below rely on.
+        """
+        if not self.batch_lookups_prepared:
+            self.execute_query(self.api.MATCH_ITEMS_EXACTLY_QUERY(), NODE='')
+            self.execute_query(self.api.MATCH_UPPER_LABELS_EXACTLY_QUERY(), LABEL='', LIMIT=1)
+            self.batch_lookups_prepared = True
+
+    def batch_lookup(self, column, keys, columns):
+        """Return all 'columns' of label edges in the 'l_d_pgr_ud' graph whose 'column'
+        is one of 'keys', with 'column' prepended to each row.  Looks up 'keys' in
+        chunks with one IN query each instead of one query per key.
+        """
+        self.prepare_batch_lookups()
+        table = self.get_graph_table('l_d_pgr_ud')
+        store = self.get_sql_store()
+        label = self.get_config('KG_LABELS_LABEL', 'label')
+        keys = list(keys)
+        rows = []
+        for i in range(0, len(keys), self.SQL_CHUNK_SIZE):
+            chunk = keys[i:i + self.SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            query = f'SELECT DISTINCT {column}, {columns} FROM {table} WHERE label=? AND {column} IN ({marks})'
+            rows.extend(store.execute(query, [label] + chunk))
+        return rows
+
+    def filter_batch_results(self, results, is_class: bool = False, instance_of: str = None):
+        """Destructively restrict the result row lists in the dict 'results' to nodes that
+        satisfy the class restriction given by 'is_class' and 'instance_of'.
+        """
+        if is_class or instance_of is not None:
+            nodes = {row[0] for rows in results.values() for row in rows}
+            keep = self.filter_class_nodes(nodes, is_class=is_class, instance_of=instance_of)
+            for key, rows in results.items():
+                results[key] = [row for row in rows if row[0] in keep]
+        return results
+
+    def rb_get_nodes_labels(self, nodes, is_class: bool = False, instance_of: str = None):
+        """Batched version of 'rb_get_node_labels'.  Return a dict that maps each of
+        'nodes' to its list of (node1, node_label, description) rows.
+        """
+        keys = {node: node.upper() for node in nodes}
+        rows_by_key = {key: [] for key in keys.values()}
+        for key, *row in self.batch_lookup('node1', rows_by_key.keys(), 'node2, "node1;description"'):
+            rows_by_key[key].append(tuple(row))
+        for key, rows in rows_by_key.items():
+            rows_by_key[key] = [(key,) + row for row in rows]
+        self.filter_batch_results(rows_by_key, is_class=is_class, instance_of=instance_of)
+        return {node: rows_by_key[key] for node, key in keys.items()}
+
+    def search_labels_exactly_batch(self,
+                                    labels,
+                                    limit: int = 20,
+                                    lang=None,
+                                    is_class: bool = False,
+                                    instance_of: str = None):
+        """Batched version of 'search_labels_exactly'.  Return a dict that maps each of
+        'labels' to at most 'limit' (node1, node_label, score, prank, description) rows
+        for nodes with that exact label (ignoring case), highest pagerank first.
+        """
+        _lang = self.get_lang(lang)
+        keys = {}
+        for label in labels:
+            safe_label: str = label.translate({ord(i): None for i in '*[?'})
+            keys[label] = f"'{safe_label}'@{_lang}".upper()
+        rows_by_key = {key: [] for key in keys.values()}
+        columns = 'node1, node2, -1.0, CAST("node1;pagerank" AS REAL), "node1;description"'
+        for key, *row in self.batch_lookup('"node2;upper"', rows_by_key.keys(), columns):
+            rows_by_key[key].append(tuple(row))
+        for rows in rows_by_key.values():
+            # same order as the 'score*prank' order of the single-label query, where score is -1:
+            rows.sort(key=lambda row: -(row[3] or 0.0))
+        self.filter_batch_results(rows_by_key, is_class=is_class, instance_of=instance_of)
+        return {label: rows_by_key[key][:limit] for label, key in keys.items()}
 
     @lru_cache(maxsize=LRU_CACHE_SIZE)
     def search_labels_textlike(self,
@@ -408,20 +684,29 @@ class BrowserBackend(object):
         # Protect against glob metacharacters in `label` (`*`, `[...]`, `?`]
         safe_label: str = label.translate({ord(i): None for i in '*[?'})
 
-        if instance_of is not None:
-            query = self.api.MATCH_LABELS_TEXTLIKE_SUBCLASSSTAR_QUERY()
-            return self.execute_query(query,
-                                      LABEL=safe_label,
-                                      LANG=self.get_lang(lang),
-                                      LIMIT=limit,
-                                      fmt=fmt,
-                                      CLASS=instance_of)
-        else:
-            if is_class:
-                query = self.api.MATCH_LABELS_TEXTLIKE_SUBCLASS_QUERY()
+        def run_restricted_query():
+            if instance_of is not None:
+                query = self.api.MATCH_LABELS_TEXTLIKE_SUBCLASSSTAR_QUERY()
+                return self.execute_query(query,
+                                          LABEL=safe_label,
+                                          LANG=self.get_lang(lang),
+                                          LIMIT=limit,
+                                          fmt=fmt,
+                                          CLASS=instance_of)
             else:
-                query = self.api.MATCH_LABELS_TEXTLIKE_QUERY()
-            return self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+                if is_class:
+                    query = self.api.MATCH_LABELS_TEXTLIKE_SUBCLASS_QUERY()
+                else:
+                    query = self.api.MATCH_LABELS_TEXTLIKE_QUERY()
+                return self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+
+        if self.use_class_bitmaps(is_class, instance_of, fmt):
+            query = self.api.MATCH_LABELS_TEXTLIKE_QUERY()
+            return self.filter_class_results(
+                lambda fetch: self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=fetch,
+                                                 fmt='iter'),
+                run_restricted_query, limit, is_class=is_class, instance_of=instance_of)
+        return run_restricted_query()
 
     @lru_cache(maxsize=LRU_CACHE_SIZE)
     def search_labels(self,
@@ -436,37 +721,318 @@ class BrowserBackend(object):
         This search method supports rb_get_kb_query(), which generates a list of
         candidate nodes. The label is searched for a complete match, which
         may or may not be case-insensitive.  The search must be fast.
+
+        If the pagerank-ordered label FTS index has been built, matches are
+        streamed from it in pagerank order into a top-k heap, so the cost of
+        the search is proportional to 'limit' rather than to the number of hits.
+        Its matches are ranked by label coverage instead of BM25 times pagerank
+        (see 'LabelFtsIndex.search').  Class-restricted searches only use the
+        index if the class bitmaps are loaded, since filtering its matches with
+        SQL membership queries is slower than joining the class in SQL.
         """
 
+        index = self.get_label_fts()
+        restricted = is_class or instance_of is not None
+        if index is not None and fmt is None and (not restricted or self.get_class_bitmaps() is not None):
+            return index.search(label,
+                                limit=limit,
+                                lang=self.get_lang(lang),
+                                node_filter=self.class_node_filter(is_class=is_class, instance_of=instance_of))
+
         # Protect against glob metacharacters in `label` (`*`, `[...]`, `?`]
         safe_label: str = label.translate({ord(i): None for i in '*[?'})
 
-        if instance_of is not None:
-            query = self.api.MATCH_LABELS_TEXTSEARCH_SUBCLASSSTAR_QUERY()
-            return self.execute_query(query,
-                                      LABEL=safe_label,
-                                      LANG=self.get_lang(lang),
-                                      CLASS=instance_of,
-                                      LIMIT=limit,
-                                      fmt=fmt)
-        else:
-            if is_class:
-                query = self.api.MATCH_LABELS_TEXTSEARCH_SUBCLASS_QUERY()
+        def run_restricted_query():
+            if instance_of is not None:
+                query = self.api.MATCH_LABELS_TEXTSEARCH_SUBCLASSSTAR_QUERY()
+                return self.execute_query(query,
+                                          LABEL=safe_label,
+                                          LANG=self.get_lang(lang),
+                                          CLASS=instance_of,
+                                          LIMIT=limit,
+                                          fmt=fmt)
             else:
-                query = self.api.MATCH_LABELS_TEXTSEARCH_QUERY()
-            return self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+                if is_class:
+                    query = self.api.MATCH_LABELS_TEXTSEARCH_SUBCLASS_QUERY()
+                else:
+                    query = self.api.MATCH_LABELS_TEXTSEARCH_QUERY()
+                return self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+
+        if self.use_class_bitmaps(is_class, instance_of, fmt):
+            query = self.api.MATCH_LABELS_TEXTSEARCH_QUERY()
+            return self.filter_class_results(
+                lambda fetch: self.execute_query(query, LABEL=safe_label, LANG=self.get_lang(lang), LIMIT=fetch,
+                                                 fmt='iter'),
+                run_restricted_query, limit, is_class=is_class, instance_of=instance_of)
+        return run_restricted_query()
+
+    def get_label_fts(self):
+        """Return the pagerank-ordered label FTS index of the graph cache, or None if it has not been built.
+        """
+        if self.label_fts is None:
+            index = fts.LabelFtsIndex(self.get_sql_store())
+            if not index.exists():
+                return None
+            self.label_fts = index
+        return self.label_fts
+
+    def check_label_fts(self):
+        """Return a list of messages describing how the recorded build configuration of
+        the label FTS index differs from the configured LABEL_FTS_TOKENIZER and LABEL_FTS_PREFIX.
+        The list is empty if they agree or there is no index.
+        """
+        index = self.get_label_fts()
+        if index is None:
+            return []
+        return index.check_config(tokenizer=self.get_config('LABEL_FTS_TOKENIZER', fts.DEFAULT_TOKENIZER),
+                                  prefix=self.get_config('LABEL_FTS_PREFIX', fts.DEFAULT_PREFIX))
+
+    def class_node_filter(self, is_class: bool = False, instance_of: str = None):
+        """Return a node filter function for the class restriction given by 'is_class'
+        and 'instance_of' as used by the search indexes, or None if there is no restriction.
+        """
+        if is_class or instance_of is not None:
+            return lambda nodes: self.filter_class_nodes(nodes, is_class=is_class, instance_of=instance_of)
+        return None
+
+    def get_trigram_index(self):
+        """Return the trigram label index of the graph cache, or None if it has not been built.
+        """
+        if self.trigram_index is None:
+            index = trigram.TrigramIndex(self.get_sql_store())
+            if not index.exists():
+                return None
+            self.trigram_index = index
+        return self.trigram_index
+
+    @lru_cache(maxsize=LRU_CACHE_SIZE)
+    def search_labels_trigrams(self,
+                               label: str,
+                               limit: int = 20,
+                               lang=None,
+                               is_class: bool = False,
+                               instance_of: str = None,
+                               fmt=None):
+        """Retrieve nodes and labels for all nodes with labels similar to 'label'.
+
+        This search method uses the trigram label index, which tolerates misspellings
+        and matches substrings anywhere in a label.  Results are ranked by trigram
+        word similarity times pagerank and have the same columns as 'search_labels()'.
+        Returns an empty list if the index has not been built.
+        """
+        index = self.get_trigram_index()
+        if index is None:
+            return []
+        node_filter = self.class_node_filter(is_class=is_class, instance_of=instance_of)
+        return index.search(label,
+                            limit=limit,
+                            lang=self.get_lang(lang),
+                            min_similarity=self.get_config('TRIGRAM_MIN_SIMILARITY', trigram.DEFAULT_MIN_SIMILARITY),
+                            max_candidates=self.get_config('TRIGRAM_MAX_CANDIDATES', trigram.DEFAULT_MAX_CANDIDATES),
+                            max_postings=self.get_config('TRIGRAM_MAX_POSTINGS', trigram.DEFAULT_MAX_POSTINGS),
+                            node_filter=node_filter)
+
+    def get_search_index(self, lang):
+        """Return the full-text search index for 'lang', or None if it has not been built.
+        """
+        index = self.search_indexes.get(lang)
+        if index is None:
+            index = search.SearchIndex.load(self.get_sql_store(), lang)
+            if index is None:
+                return None
+            self.search_indexes[lang] = index
+        return index
+
+    @lru_cache(maxsize=LRU_CACHE_SIZE)
+    def search_text(self,
+                    text: str,
+                    size: int = 20,
+                    lang=None,
+                    prefix: bool = True,
+                    is_class: bool = False,
+                    instance_of: str = None):
+        """Retrieve search results for 'text' from the BM25 full-text index over labels,
+        aliases and descriptions, using the result format of the KGTK search API.
+
+        If 'prefix' the last word of 'text' is also matched as a prefix, which is what
+        search-as-you-type clients need.  Returns None if there is no index for 'lang'.
+        """
+        index = self.get_search_index(self.get_lang(lang))
+        if index is None:
+            return None
+        node_filter = self.class_node_filter(is_class=is_class, instance_of=instance_of)
+        return index.search(text,
+                            size=size,
+                            prefix=prefix,
+                            max_expansions=self.get_config('SEARCH_MAX_EXPANSIONS', search.DEFAULT_MAX_EXPANSIONS),
+                            max_postings=self.get_config('SEARCH_MAX_POSTINGS', search.DEFAULT_MAX_POSTINGS),
+                            max_candidates=self.get_config('SEARCH_MAX_CANDIDATES', search.DEFAULT_MAX_CANDIDATES),
+                            node_filter=node_filter)
+
+    def load_display_table(self, tables, table_class, lang):
+        """Return the display table of 'table_class' for 'lang' cached in 'tables', or None if
+        it has not been built or is out of date with respect to the graphs it was built from.
+        """
+        table = tables.get(lang)
+        if table is None:
+            if lang == self.LANGUAGE_ANY:
+                return None
+            table = table_class(self.get_sql_store(), lang)
+            if not table.exists():
+                return None
+            if table.check_build():
+                # remember a stale table as False, so it is not checked again:
+                table = False
+            tables[lang] = table
+        return table or None
+
+    def get_display_edge_table(self, lang):
+        """Return the display edge table for 'lang', or None if it has not been built or is stale.
+        """
+        return self.load_display_table(self.display_edge_tables, display.DisplayEdgeTable, lang)
+
+    def get_display_qualifier_table(self, lang):
+        """Return the display qualifier table for 'lang', or None if it has not been built or is stale.
+        """
+        return self.load_display_table(self.display_qualifier_tables, display.DisplayQualifierTable, lang)
+
+    def check_display_tables(self, lang=None):
+        """Return a list of messages describing why the display tables built for 'lang'
+        can't be used, which is empty if they are current or have not been built.
+        """
+        messages = []
+        for table_class in (display.DisplayEdgeTable, display.DisplayQualifierTable):
+            table = table_class(self.get_sql_store(), self.get_lang(lang))
+            if table.exists():
+                messages.extend(table.check_build())
+        return messages
 
     def rb_get_node_edges(self, node, lang=None, images=False, fanouts=False, fmt=None, limit: int = 10000,
-                          lc_properties: str = None):
-        """Retrieve all edges that have 'node' as their node1.
+                          lc_properties: str = None, max_values_per_property: int = 0, uncapped_properties=()):
+        """Retrieve all edges that have 'node' as their node1.  If 'max_values_per_property'
+        is positive, only retrieve that many edges for each property other than the
+        'uncapped_properties' and external identifiers (see 'rb_get_node_edges_capped').
+        Edges are read from the display edge table of 'lang' if it has been built.
         """
+        display_table = self.get_display_edge_table(self.get_lang(lang)) if fmt is None else None
+        if display_table is not None:
+            properties = lc_properties.split() if lc_properties else None
+            cursor = display_table.get_edges(node, limit, properties=properties,
+                                             max_values_per_property=max_values_per_property,
+                                             uncapped_properties=uncapped_properties)
+            cursor.row_factory = ItemEdgeFactory()
+            return cursor.fetchall()
+        if max_values_per_property > 0 and fmt is None:
+            return self.rb_get_node_edges_capped(node,
+                                                 max_values_per_property,
+                                                 lang=lang,
+                                                 limit=limit,
+                                                 lc_properties=lc_properties,
+                                                 uncapped_properties=uncapped_properties)
         if lc_properties is not None and lc_properties != "":
             query = self.api.RB_NODE_EDGES_CONDITIONAL_QUERY()
-            return self.execute_query(query, NODE=node, PROPS=lc_properties, LANG=self.get_lang(lang), LIMIT=limit,
-                                      fmt=fmt)
+            results = self.execute_query(query, NODE=node, PROPS=lc_properties, LANG=self.get_lang(lang), LIMIT=limit,
+                                         fmt=fmt)
         else:
             query = self.api.RB_NODE_EDGES_QUERY()
-            return self.execute_query(query, NODE=node, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+            results = self.execute_query(query, NODE=node, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+        return make_item_edges(results) if fmt is None else results
+
+    def prepare_capped_edge_queries(self):
+        """Run the Kypher edge query once, so the graph cache has created the indexes
+        and loaded the user functions that the capped edge query relies on.
+        """
+        if not self.capped_edge_queries_prepared:
+            self.execute_query(self.api.RB_NODE_EDGES_QUERY(), NODE='', LANG=self.get_lang(None), LIMIT=1)
+            self.capped_edge_queries_prepared = True
+
+    def rb_get_node_edges_capped(self, node, max_values_per_property: int, lang=None, limit: int = 10000,
+                                 lc_properties: str = None, uncapped_properties=()):
+        """Variant of 'rb_get_node_edges' that returns the same rows, but at most the
+        first 'max_values_per_property' edges (in 'node2' order) of each property.
+        Edges are ranked per property with ROW_NUMBER() before the label and datatype
+        joins, so capped values are never joined or returned.  Properties in
+        'uncapped_properties' and properties with the 'external-id' datatype keep all of
+        their edges, since they are not downsampled for display.  Like the Kypher query,
+        whose description clause reuses the edge variable 'r' and therefore never
+        matches, this returns no target descriptions.
+        """
+        self.prepare_capped_edge_queries()
+        edges = self.get_graph_table('edges')
+        labels = self.get_graph_table('labels')
+        datatypes = self.get_graph_table('datatypes')
+        label_label = self.get_config('KG_LABELS_LABEL', 'label')
+        datatype_label = self.get_config('KG_DATATYPES_LABEL', 'datatype')
+        lang = self.get_lang(lang)
+
+        params = [node]
+        property_filter = ''
+        if lc_properties is not None and lc_properties != "":
+            property_filter = 'AND label IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(lc_properties.split()))
+        params.extend([max_values_per_property, json.dumps(list(uncapped_properties)), datatype_label, 'external-id'])
+        params.extend([label_label, lang, lang, label_label, lang, lang, datatype_label])
+        params.append(limit)
+        query = f"""
+            WITH ranked AS (
+                SELECT id, node1, label, node2, ROW_NUMBER() OVER (PARTITION BY label ORDER BY node2, id) AS rank
+                FROM {edges} WHERE node1=? {property_filter}),
+            capped AS (
+                SELECT id, node1, label, node2 FROM ranked
+                WHERE rank<=?
+                OR label IN (SELECT value FROM json_each(?))
+                OR EXISTS (SELECT 1 FROM {datatypes} d WHERE d.node1=ranked.label AND d.label=? AND d.node2=?))
+            SELECT e.id, e.node1, e.label, e.node2, ll.node2, e.node2, n2l.node2, NULL, dt.node2
+            FROM capped e
+            LEFT JOIN {labels} ll
+                ON ll.node1=e.label AND ll.label=? AND (?='any' OR kgtk_lqstring_lang(ll.node2)=?)
+            LEFT JOIN {labels} n2l
+                ON n2l.node1=e.node2 AND n2l.label=? AND (?='any' OR kgtk_lqstring_lang(n2l.node2)=?)
+            LEFT JOIN {datatypes} dt
+                ON dt.node1=e.label AND dt.label=?
+            ORDER BY e.label, e.node2, e.id, ll.node2, n2l.node2
+            LIMIT ?"""
+        cursor = self.get_sql_store().execute(query, params)
+        cursor.row_factory = ItemEdgeFactory()
+        return cursor.fetchall()
+
+    def get_sort_keys(self):
+        """Return the quantity and time sort keys of the graph cache, or None if they have not been built.
+        """
+        if self.sort_keys is None:
+            self.sort_keys = sortkeys.SortKeys.load(self.get_sql_store())
+        return self.sort_keys
+
+    def rb_get_node_edges_by_id(self, id_list, lang=None):
+        """Retrieve the edges with the IDs in ID_LIST in that order, with the same columns
+        as 'rb_get_node_edges' (and, like it, without target descriptions).
+        """
+        self.prepare_capped_edge_queries()
+        edges = self.get_graph_table('edges')
+        labels = self.get_graph_table('labels')
+        datatypes = self.get_graph_table('datatypes')
+        label_label = self.get_config('KG_LABELS_LABEL', 'label')
+        datatype_label = self.get_config('KG_DATATYPES_LABEL', 'datatype')
+        lang = self.get_lang(lang)
+
+        params = [label_label, lang, lang, label_label, lang, lang, datatype_label]
+        params.append(json.dumps(list(id_list)))
+        query = f"""
+            SELECT e.id, e.node1, e.label, e.node2, ll.node2, e.node2, n2l.node2, NULL, dt.node2
+            FROM {edges} e
+            LEFT JOIN {labels} ll
+                ON ll.node1=e.label AND ll.label=? AND (?='any' OR kgtk_lqstring_lang(ll.node2)=?)
+            LEFT JOIN {labels} n2l
+                ON n2l.node1=e.node2 AND n2l.label=? AND (?='any' OR kgtk_lqstring_lang(n2l.node2)=?)
+            LEFT JOIN {datatypes} dt
+                ON dt.node1=e.label AND dt.label=?
+            WHERE e.id IN (SELECT value FROM json_each(?))"""
+        cursor = self.get_sql_store().execute(query, params)
+        cursor.row_factory = ItemEdgeFactory()
+        edges_by_id = dict()
+        for edge in cursor:
+            edges_by_id.setdefault(edge.edge_id, edge)
+        return [edges_by_id[edge_id] for edge_id in id_list if edge_id in edges_by_id]
 
     def rb_get_node_one_property_with_qualifiers_edges(self,
                                                        node,
@@ -478,9 +1044,23 @@ class BrowserBackend(object):
                                                        sort_order: str = 'asc',
                                                        sort_by: str = 'qn2',
                                                        is_sort_by_quantity: bool = False,
+                                                       sort_datatype: str = None,
                                                        fmt=None):
-        """Retrieve all edges that have 'node' as their node1 for property=property with qualifiers
+        """Retrieve all edges that have 'node' as their node1 for property=property with qualifiers.
+        If the values sorted by are quantities or times ('sort_datatype') and their sort keys have
+        been built, the page of edges is read in order from the sort key index, unless it has no
+        keys for this page.
         """
+        sort_keys = self.get_sort_keys() if fmt is None and sort_datatype in sortkeys.SORTABLE_DATATYPES else None
+        if sort_keys is not None and sort_by in ('n2', 'qn2'):
+            qualifier = qualifier_property if sort_by == 'qn2' else None
+            if qualifier is None or sort_keys.has_qualifier_keys(property, qualifier):
+                edge_ids = sort_keys.get_page(node, property, skip, limit, qualifier=qualifier,
+                                              descending=sort_order.lower() == 'desc')
+                # without keyed rows for this page, e.g., if the property's datatype was not
+                # sortable when the keys were built, the query below computes the page instead:
+                if edge_ids:
+                    return self.rb_get_node_edges_by_id(edge_ids, lang=lang)
 
         query = self.api.RB_NODE_EDGES_ONE_PROPERTY_WITH_QUALIFIERS_QUERY(node,
                                                                           property,
@@ -491,7 +1071,8 @@ class BrowserBackend(object):
                                                                           qualifier_property,
                                                                           sort_by,
                                                                           is_sort_by_quantity)
-        return self.execute_query(query, fmt=fmt)
+        results = self.execute_query(query, fmt=fmt)
+        return make_item_edges(results) if fmt is None else results
 
     def rb_get_node_one_property_related_edges(self, node, property: str, limit: int, skip: int, lang=None, fmt=None):
         """Retrieve all edges that have 'node' as their node1 for property=property
@@ -511,25 +1092,100 @@ class BrowserBackend(object):
     def rb_get_node_edge_qualifiers(self, node, lang=None, images=False, fanouts=False, fmt=None, limit: int = 10000):
         """Retrieve all edge qualifiers for edges that have 'node' as their node1.
         """
+        display_table = self.get_display_qualifier_table(self.get_lang(lang)) if fmt is None else None
+        if display_table is not None:
+            cursor = display_table.get_node_qualifiers(node, limit)
+            cursor.row_factory = QualifierEdgeFactory()
+            return cursor.fetchall()
         query = self.api.RB_NODE_EDGE_QUALIFIERS_QUERY()
-        return self.execute_query(query, NODE=node, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+        results = self.execute_query(query, NODE=node, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+        return make_qualifier_edges(results) if fmt is None else results
 
     def rb_get_node_edge_qualifiers_by_edge_id(self, edge_id, lang=None, images=False, fanouts=False, fmt=None,
                                                limit: int = 10000):
         """Retrieve all edge qualifiers for the edge with edge ID edge_id..
         """
+        if fmt is None and self.get_display_qualifier_table(self.get_lang(lang)) is not None:
+            return self.rb_get_display_qualifiers([edge_id], lang=lang, limit=limit)
         query = self.api.RB_NODE_EDGE_QUALIFIERS_BY_EDGE_ID_QUERY()
-        return self.execute_query(query, EDGEID=edge_id, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+        results = self.execute_query(query, EDGEID=edge_id, LANG=self.get_lang(lang), LIMIT=limit, fmt=fmt)
+        return make_qualifier_edges(results) if fmt is None else results
 
     def rb_get_node_edge_qualifiers_in(self, id_list, lang=None, images=False, fanouts=False, fmt=None,
                                        limit: int = 10000):
         """Retrieve all edge qualifiers for edges that have their id in ID_LIST.
         """
+        if fmt is None and self.get_display_qualifier_table(self.get_lang(lang)) is not None:
+            return self.rb_get_display_qualifiers(id_list, lang=lang, limit=limit)
         query = self.api.GET_RB_NODE_EDGE_QUALIFIERS_IN_QUERY()
         props = ' '.join([x for x in id_list])
         results = self.execute_query(query, LIMIT=limit, LANG=self.get_lang(lang), PROPS=props, fmt=fmt)
         # query.clear()  # Since we don't plan to re-issue this query, release its resources.
-        return results
+        return make_qualifier_edges(results) if fmt is None else results
+
+    QUALIFIED_EDGE_IDS_TABLE = 'rb_qualified_edge_ids'
+
+    def prepare_edge_id_qualifier_queries(self):
+        """Run the Kypher qualifier query by edge ID once, so the graph cache has created
+        the indexes and loaded the user functions that the temp table join relies on.
+        """
+        if not self.edge_id_qualifier_queries_prepared:
+            self.execute_query(self.api.RB_NODE_EDGE_QUALIFIERS_BY_EDGE_ID_QUERY(),
+                               EDGEID='', LANG=self.get_lang(None), LIMIT=1)
+            self.edge_id_qualifier_queries_prepared = True
+
+    def rb_get_node_edge_qualifiers_joined(self, id_list, lang=None, limit: int = 10000):
+        """Retrieve all edge qualifiers for edges that have their id in ID_LIST and
+        return the same rows as 'rb_get_node_edge_qualifiers_in'.  The IDs are loaded
+        into a temporary table of the SQL connection and joined against the qualifiers
+        on its primary key, which scales to long ID lists where binding them as a
+        'kgtk_values' list would generate every ID in Python inside the query.  Like
+        the Kypher query, whose description clause reuses the edge variable 'r' and
+        therefore never matches, this returns no qualifier value descriptions.
+        """
+        if self.get_display_qualifier_table(self.get_lang(lang)) is not None:
+            return self.rb_get_display_qualifiers(id_list, lang=lang, limit=limit)
+        self.prepare_edge_id_qualifier_queries()
+        edges = self.get_graph_table('edges')
+        qualifiers = self.get_graph_table('qualifiers')
+        labels = self.get_graph_table('labels')
+        label_label = self.get_config('KG_LABELS_LABEL', 'label')
+        lang = self.get_lang(lang)
+
+        # temp tables are private to the connection, so concurrent workers don't see each
+        # other's IDs; we go to the connection directly, since a read-only store ignores writes:
+        ids_table = 'temp.' + self.QUALIFIED_EDGE_IDS_TABLE
+        conn = self.get_sql_store().get_conn()
+        conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {self.QUALIFIED_EDGE_IDS_TABLE} (id TEXT PRIMARY KEY)')
+        conn.execute(f'DELETE FROM {ids_table}')
+        conn.executemany(f'INSERT OR IGNORE INTO {ids_table} VALUES (?)', ((edge_id,) for edge_id in id_list))
+        conn.commit()
+
+        params = [label_label, lang, lang, label_label, lang, lang, limit]
+        query = f"""
+            SELECT e.id, e.node1, q.id, q.label, q.node2, qll.node2, qn2l.node2, NULL
+            FROM {ids_table} t
+            JOIN {edges} e ON e.id=t.id
+            JOIN {qualifiers} q ON q.node1=t.id
+            LEFT JOIN {labels} qll
+                ON qll.node1=q.label AND qll.label=? AND (?='any' OR kgtk_lqstring_lang(qll.node2)=?)
+            LEFT JOIN {labels} qn2l
+                ON qn2l.node1=q.node2 AND qn2l.label=? AND (?='any' OR kgtk_lqstring_lang(qn2l.node2)=?)
+            ORDER BY e.id, q.label, q.node2, q.id, qll.node2, qn2l.node2
+            LIMIT ?"""
+        cursor = conn.execute(query, params)
+        cursor.row_factory = QualifierEdgeFactory()
+        return cursor.fetchall()
+
+    def rb_get_display_qualifiers(self, id_list, lang=None, limit: int = 10000):
+        """Retrieve all edge qualifiers for edges that have their id in ID_LIST from the
+        display qualifier table of 'lang', which has to exist.  Returns the same rows as
+        'rb_get_node_edge_qualifiers_in' with a primary key range scan per edge ID.
+        """
+        display_table = self.get_display_qualifier_table(self.get_lang(lang))
+        cursor = display_table.get_qualifiers(id_list, limit)
+        cursor.row_factory = QualifierEdgeFactory()
+        return cursor.fetchall()
 
     def rb_get_image_formatter(self, node, lang=None, fmt=None):
         """Retrieve the first matching image formatter.
@@ -549,6 +1205,12 @@ class BrowserBackend(object):
         query = self.api.RB_LANGUAGE_LABELS_QUERY()
         return self.execute_query(query, CODE=code, LANG=self.get_lang(lang), fmt=fmt)
 
+    def rb_get_all_language_labels(self, lang=None, fmt=None):
+        """Retrieve the language names of all language codes.
+        """
+        query = self.api.RB_ALL_LANGUAGE_LABELS_QUERY()
+        return self.execute_query(query, LANG=self.get_lang(lang), fmt=fmt)
+
     def get_classviz_edge_results(self, node, fmt=FORMAT_FAST_DF):
 
         node = node.upper()
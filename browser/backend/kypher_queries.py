@@ -660,6 +660,24 @@ class KypherAPIObject(object):
             order='n1, n1label'
         )
 
+    def RB_ALL_LANGUAGE_LABELS_QUERY(self):
+        return self.kapi.get_query(
+            doc="""
+                   Create the Kypher query used by 'BrowserBackend.rb_get_all_language_labels()'.
+                   Retrieve the language names of all language codes at once, using the same
+                   P424 edges and P31 validation as 'RB_LANGUAGE_LABELS_QUERY'.
+                   Parameter 'LANG' controls the language for retrieved labels.
+                   Return the language code 'node2', the language `node1` and 'node1_label'.
+                   """,
+            inputs=('edges', 'labels'),
+            match='$edges: (isa)<-[:P31]-(n1)-[:P424]->(n2)',
+            where='isa in ["Q34770", "Q1288568", "Q33742"]',
+            opt='$labels: (n1)-[:`%s`]->(n1label)' % KG_LABELS_LABEL,
+            owhere='$LANG="any" or kgtk_lqstring_lang(n1label)=$LANG',
+            ret='n2 as node2, n1 as node1, n1label as node1_label',
+            order='n2, n1, n1label'
+        )
+
     def GET_CLASS_VIZ_EDGE_QUERY(self):
         match_clause = f'(class)-[{{label: property, graph: n1, edge_type: edge_type}}]->(superclass)'
         return self.kapi.get_query(
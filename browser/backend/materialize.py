@@ -0,0 +1,230 @@
+"""
+Offline materialization of rendered item pages.
+
+Most traffic goes to a small head of items, yet every cold request for one of
+them recomputes the whole item rendering pipeline.  'kgtk browser materialize'
+renders the '/kb/xitem' and '/kb/ritem' responses of the top items ahead of
+time across a process pool and stores them as gzip-compressed JSON in a
+separate SQLite key/value file, keyed by endpoint, item, language and the
+rendering limits.  The server looks up requests with default limits in that
+store before rendering them.  The job commits as it goes and skips pages that
+are already in the store, so an interrupted run can simply be restarted.
+"""
+
+import gzip
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+PAGES_TABLE = 'rb_materialized_pages'
+META_TABLE = 'rb_materialized_meta'
+
+# Endpoints whose responses can be materialized:
+XITEM_ENDPOINT = 'xitem'
+RITEM_ENDPOINT = 'ritem'
+ENDPOINTS = (XITEM_ENDPOINT, RITEM_ENDPOINT)
+
+DEFAULT_COUNT = 10000
+# Number of pages written per transaction:
+DEFAULT_COMMIT_SIZE = 100
+# Seconds between progress reports:
+DEFAULT_REPORT_INTERVAL = 30.0
+
+
+def make_key(endpoint, item, lang, limits):
+    """Return the store key of the 'endpoint' response for 'item' in language 'lang'
+    rendered with the dict of 'limits'.
+    """
+    return '%s|%s|%s|%s' % (endpoint, item, lang, json.dumps(limits, sort_keys=True))
+
+
+def compress_response(response):
+    return gzip.compress(json.dumps(response).encode('utf-8'))
+
+
+def decompress_response(data):
+    return gzip.decompress(data)
+
+
+class MaterializedStore(object):
+    """
+    SQLite key/value file of gzip-compressed JSON responses.  A read-only store
+    can be shared by the threads of the server process.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self.conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {PAGES_TABLE} '
+                              '(key TEXT PRIMARY KEY, endpoint TEXT, item TEXT, lang TEXT, data BLOB, built REAL)')
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {META_TABLE} (name TEXT PRIMARY KEY, value TEXT)')
+            self.conn.commit()
+        self.lock = threading.Lock()
+
+    def get_compressed(self, key):
+        """Return the gzip-compressed JSON response stored under 'key', or None.
+        """
+        with self.lock:
+            row = self.conn.execute(f'SELECT data FROM {PAGES_TABLE} WHERE key=?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, key):
+        """Return the JSON response stored under 'key' as bytes, or None.
+        """
+        data = self.get_compressed(key)
+        return decompress_response(data) if data is not None else None
+
+    def get_keys(self):
+        with self.lock:
+            return {key for (key,) in self.conn.execute(f'SELECT key FROM {PAGES_TABLE}')}
+
+    def put(self, key, endpoint, item, lang, data):
+        """Store the gzip-compressed JSON response 'data' under 'key'.  Call 'commit' to persist.
+        """
+        with self.lock:
+            self.conn.execute(f'INSERT OR REPLACE INTO {PAGES_TABLE} VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, endpoint, item, lang, data, time.time()))
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute(f'DELETE FROM {PAGES_TABLE}')
+            self.conn.commit()
+
+    def get_meta(self, name):
+        with self.lock:
+            row = self.conn.execute(f'SELECT value FROM {META_TABLE} WHERE name=?', (name,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_meta(self, name, value):
+        with self.lock:
+            self.conn.execute(f'INSERT OR REPLACE INTO {META_TABLE} VALUES (?, ?)', (name, json.dumps(value)))
+            self.conn.commit()
+
+    def get_size(self):
+        """Return the number of pages and the total bytes of their compressed data.
+        """
+        with self.lock:
+            count, size = self.conn.execute(f'SELECT COUNT(*), SUM(LENGTH(data)) FROM {PAGES_TABLE}').fetchone()
+        return count, size or 0
+
+    def close(self):
+        self.conn.close()
+
+
+def get_graph_signature(backend, graph_id, graph_cache):
+    """Return the identity of the graph that pages are materialized from.  Besides its
+    ID and cache file name, this includes the size and import time of every graph of
+    'backend', which change whenever the graph cache is rebuilt.
+    """
+    store = backend.get_sql_store()
+    graphs = {}
+    for name in sorted(backend.api.kapi.get_all_inputs()):
+        table = backend.get_graph_table(name)
+        info = store.get_graph_info(table) if table is not None else None
+        if info is not None:
+            graphs[name] = [str(info.size), str(info.acctime)]
+    return {'graph_id': graph_id, 'graph_cache': os.path.basename(graph_cache or ''), 'graphs': graphs}
+
+
+def open_store(path, backend, graph_id, graph_cache, log=sys.stderr):
+    """Return a read-only store at 'path' for serving, or None if there is none or it
+    was materialized from a different graph than the one of 'backend' (see
+    'get_graph_signature').
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    graph_signature = get_graph_signature(backend, graph_id, graph_cache)
+    store = MaterializedStore(path, readonly=True)
+    store_signature = store.get_meta('graph')
+    if store_signature != graph_signature:
+        print('Ignoring materialized pages in %s, they were built for graph %s, not %s'
+              % (path, repr(store_signature), repr(graph_signature)), file=log, flush=True)
+        store.close()
+        return None
+    return store
+
+
+def get_top_items(backend, count, table):
+    """Return the 'count' nodes with the highest pagerank in the label search 'table'.
+    """
+    query = (f'SELECT node1 FROM {table} GROUP BY node1 '
+             f'ORDER BY MAX(CAST("node1;pagerank" AS REAL)) DESC LIMIT ?')
+    return [node for (node,) in backend.get_sql_store().execute(query, (count,))]
+
+
+def read_items_file(path, count=None):
+    """Return the first 'count' items listed one per line in 'path', for example the
+    most requested items extracted from the access logs.
+    """
+    items = []
+    with open(path) as inp:
+        for line in inp:
+            item = line.strip()
+            if item and not item.startswith('#'):
+                items.append(item)
+                if count is not None and len(items) >= count:
+                    break
+    return items
+
+
+def materialize(store, tasks, render_page, processes=None, commit_size=DEFAULT_COMMIT_SIZE,
+                report_interval=DEFAULT_REPORT_INTERVAL, log=sys.stderr):
+    """Render and store the pages of all (key, endpoint, item, lang) 'tasks' whose key
+    is not in 'store' yet.  'render_page(endpoint, item, lang)' has to return the
+    gzip-compressed JSON response and runs in a pool of 'processes' forked workers
+    (all CPUs by default), which inherit the caller's loaded backend.  The caller has
+    to close the backend's graph cache connection before, so each worker opens its
+    own.  Return the number of pages rendered.
+    """
+    done = store.get_keys()
+    todo = [task for task in tasks if task[0] not in done]
+    if log:
+        print('Materializing %d pages, %d of %d already done' % (len(todo), len(tasks) - len(todo), len(tasks)),
+              file=log, flush=True)
+    start = last_report = time.time()
+    rendered = failed = 0
+    with multiprocessing.Pool(processes) as pool:
+        for key, endpoint, item, lang, data in pool.imap_unordered(_render_task,
+                                                                   [(render_page,) + task for task in todo]):
+            if data is None:
+                failed += 1
+                continue
+            store.put(key, endpoint, item, lang, data)
+            rendered += 1
+            if rendered % commit_size == 0:
+                store.commit()
+            now = time.time()
+            if log and now - last_report >= report_interval:
+                last_report = now
+                print('Materialized %d/%d pages, %.1f pages/sec' % (rendered, len(todo), rendered / (now - start)),
+                      file=log, flush=True)
+    store.commit()
+    if log:
+        elapsed = time.time() - start
+        count, size = store.get_size()
+        print('Materialized %d pages in %.1f secs (%.1f pages/sec, %d failed), store has %d pages in %.1f MB'
+              % (rendered, elapsed, rendered / max(elapsed, 1e-9), failed, count, size / 2 ** 20),
+              file=log, flush=True)
+    return rendered
+
+
+def _render_task(task):
+    render_page, key, endpoint, item, lang = task
+    try:
+        return key, endpoint, item, lang, render_page(endpoint, item, lang)
+    except Exception as e:
+        print('Failed to materialize %s %s: %s' % (endpoint, item, e), file=sys.stderr, flush=True)
+        return key, endpoint, item, lang, None
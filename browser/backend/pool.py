@@ -0,0 +1,113 @@
+"""
+Pool of browser backends for running several queries of one request concurrently.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from browser.backend.kypher import BrowserBackend
+
+
+class BackendTask(object):
+    """
+    Handle for a query function submitted to a 'BrowserBackendPool'.  Wraps the
+    underlying future and remembers which backend (if any) is currently running
+    the function, so the task can be interrupted while its query is executing.
+    """
+
+    def __init__(self, pool, fn, args, kwds):
+        self.pool = pool
+        self.fn = fn
+        self.args = args
+        self.kwds = kwds
+        self.backend = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.future = None
+
+    def run(self):
+        with self.lock:
+            if self.cancelled:
+                return None
+            self.backend = self.pool.get_thread_backend()
+        try:
+            return self.fn(self.backend, *self.args, **self.kwds)
+        finally:
+            with self.lock:
+                self.backend = None
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        """Cancel this task if it is still queued, or interrupt its query if it is running.
+        Return True if the task was cancelled before or while running.
+        """
+        with self.lock:
+            if self.future.done():
+                return False
+            self.cancelled = True
+            if self.future.cancel():
+                return True
+            if self.backend is not None:
+                self.backend.interrupt()
+            return True
+
+
+class BrowserBackendPool(object):
+    """
+    Fixed-size pool of worker threads, each with its own 'BrowserBackend' whose Kypher
+    API object has its own connection to the graph cache.  A backend is created by and
+    only ever used on its worker thread, so its SQLite connection never crosses threads
+    and never serves two queries at once.  Query functions submitted to the pool run on
+    the worker threads (SQLite releases the GIL while a statement executes) and can be
+    cancelled or interrupted individually.
+
+    Pools hold open DB connections, so they must be created in the process that
+    uses them and never be inherited across a fork.
+    """
+
+    def __init__(self, api_factory, size, app=None):
+        """Create a pool of 'size' worker threads whose backends use API objects
+        produced by calling 'api_factory'.  If 'app' is given, import its configuration
+        into each backend.
+        """
+        self.size = max(1, int(size))
+        self.api_factory = api_factory
+        self.app = app
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='backend-pool',
+                                           initializer=self.init_thread_backend)
+
+    def __len__(self):
+        return self.size
+
+    def init_thread_backend(self):
+        """Create the backend of the current worker thread.
+        """
+        backend = BrowserBackend(api=self.api_factory())
+        if self.app is not None:
+            backend.set_app_config(self.app)
+        self.local.backend = backend
+
+    def get_thread_backend(self):
+        """Return the backend of the current worker thread.
+        """
+        return self.local.backend
+
+    def submit(self, fn, *args, **kwds):
+        """Run 'fn(backend, *args, **kwds)' on the backend of the next idle worker and return
+        a 'BackendTask' handle for the pending result.
+        """
+        task = BackendTask(self, fn, args, kwds)
+        task.future = self.executor.submit(task.run)
+        return task
+
+    def cancel(self, tasks):
+        """Cancel or interrupt all not yet completed 'tasks'.  Return the number of
+        tasks that were affected.
+        """
+        return sum(1 for task in tasks if task is not None and task.cancel())
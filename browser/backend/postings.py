@@ -0,0 +1,70 @@
+"""
+Compact posting list encoding for the browser's embedded search indexes.
+
+A posting list is an ascending sequence of integer document IDs.  We store
+it as the sequence of gaps between consecutive IDs (delta encoding) in a
+32-bit array which is then zlib-compressed.  Since gaps are mostly small,
+the compressed blob is typically only one or two bytes per posting, and
+decoding happens entirely inside C-implemented library code.
+"""
+
+import itertools
+import zlib
+from array import array
+
+
+POSTING_TYPECODE = 'I'
+COMPRESSION_LEVEL = 6
+
+
+def encode_postings(ids):
+    """Encode the ascending sequence of document 'ids' into a bytes blob.
+    """
+    deltas = array(POSTING_TYPECODE)
+    last = 0
+    for doc_id in ids:
+        deltas.append(doc_id - last)
+        last = doc_id
+    return zlib.compress(deltas.tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_postings(blob, limit=None):
+    """Decode a 'blob' produced by 'encode_postings' into a list of document IDs.
+    If 'limit' is given, only decode the first 'limit' IDs.
+    """
+    if not blob:
+        return []
+    deltas = array(POSTING_TYPECODE)
+    deltas.frombytes(zlib.decompress(blob))
+    if limit is not None and limit < len(deltas):
+        return list(itertools.accumulate(itertools.islice(deltas, limit)))
+    return list(itertools.accumulate(deltas))
+
+
+def merge_postings(blobs):
+    """Concatenate the encoded posting lists 'blobs' whose ID ranges are ascending
+    and disjoint (such as lists built from consecutive document batches) into a
+    single encoded list.
+    """
+    return encode_postings(itertools.chain.from_iterable(decode_postings(blob) for blob in blobs))
+
+
+WEIGHT_TYPECODE = 'f'
+
+
+def encode_weights(weights):
+    """Encode a sequence of float 'weights' parallel to a posting list into a bytes blob.
+    """
+    return zlib.compress(array(WEIGHT_TYPECODE, weights).tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_weights(blob, limit=None):
+    """Decode a 'blob' produced by 'encode_weights' into an array of floats.
+    If 'limit' is given, only decode the first 'limit' weights.
+    """
+    weights = array(WEIGHT_TYPECODE)
+    if blob:
+        weights.frombytes(zlib.decompress(blob))
+    if limit is not None and limit < len(weights):
+        del weights[limit:]
+    return weights
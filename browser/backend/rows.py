@@ -0,0 +1,85 @@
+"""
+Compact row types for the item edges and qualifier edges that are rendered.
+
+Rows are produced once from the query results and then flow unchanged through
+sorting, downsampling and rendering.  'NamedTuple' rows declare empty
+'__slots__', so each row is a plain tuple with no per-instance dict: smaller
+than the lists we used to copy the cursor rows into, immutable, and still
+indexable and unpackable like the query rows, while render stages can use the
+field names.  Row factories additionally share the strings that repeat across
+the rows of a query result.
+"""
+
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+
+class ItemEdge(NamedTuple):
+    """An item edge as returned by 'RB_NODE_EDGES_QUERY' and its variants.
+    """
+    edge_id: str
+    node1: str
+    relationship: str
+    node2: str
+    relationship_label: Optional[str]
+    target_node: str
+    target_label: Optional[str]
+    target_description: Optional[str]
+    wikidatatype: Optional[str]
+
+
+class QualifierEdge(NamedTuple):
+    """A qualifier edge as returned by 'RB_NODE_EDGE_QUALIFIERS_QUERY' and its variants.
+    """
+    edge_id: str
+    node1: str
+    qual_edge_id: str
+    qual_relationship: str
+    qual_node2: str
+    qual_relationship_label: Optional[str]
+    qual_node2_label: Optional[str]
+    qual_node2_description: Optional[str]
+
+
+class ItemEdgeFactory(object):
+    """
+    SQLite cursor 'row_factory' that produces 'ItemEdge' rows.  The cursor returns a
+    new string object for every cell, so the values that repeat across the edges of
+    an item (node1, relationship, relationship label and datatype) are shared
+    between rows, and 'target_node' shares the 'node2' string it duplicates.
+    """
+
+    def __init__(self):
+        self.shared = dict()
+
+    def __call__(self, cursor, row) -> ItemEdge:
+        share = self.shared.setdefault
+        node2 = row[3]
+        target_node = row[5]
+        return ItemEdge(row[0], share(row[1], row[1]), share(row[2], row[2]), node2, share(row[4], row[4]),
+                        node2 if target_node == node2 else target_node, row[6], row[7], share(row[8], row[8]))
+
+
+class QualifierEdgeFactory(object):
+    """
+    SQLite cursor 'row_factory' that produces 'QualifierEdge' rows, sharing the values
+    that repeat across the qualifiers of an item (node1, qualifier relationship and
+    its label) between rows.
+    """
+
+    def __init__(self):
+        self.shared = dict()
+
+    def __call__(self, cursor, row) -> QualifierEdge:
+        share = self.shared.setdefault
+        return QualifierEdge(row[0], share(row[1], row[1]), row[2], share(row[3], row[3]), row[4],
+                             share(row[5], row[5]), row[6], row[7])
+
+
+def make_item_edges(rows: Iterable[Sequence[str]]) -> List[ItemEdge]:
+    factory: ItemEdgeFactory = ItemEdgeFactory()
+    return [factory(None, row) for row in rows]
+
+
+def make_qualifier_edges(rows: Iterable[Sequence[str]]) -> List[QualifierEdge]:
+    factory: QualifierEdgeFactory = QualifierEdgeFactory()
+    return [factory(None, row) for row in rows]
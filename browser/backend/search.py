@@ -0,0 +1,325 @@
+"""
+Embedded BM25 full-text search over node labels, aliases and descriptions.
+
+The index is built from the graph cache with 'kgtk browser build-search-index'
+and stored back into it, one index per language.  Every node with text in the
+indexed language is one document, its fields weighted by 'FIELD_BOOSTS'.
+Document IDs follow descending pagerank order, and each term maps to a
+delta-encoded posting list plus a parallel list of precomputed BM25 term
+weights, so a query only needs to look up its terms and sum 'idf * weight'
+per document.  The last query token is treated as a prefix, which supports
+search-as-you-type the way the Elasticsearch 'ngram' search does.
+"""
+
+import heapq
+import itertools
+import json
+import math
+import re
+import sys
+import time
+from array import array
+from collections import Counter
+
+from kgtk.kgtkformat import KgtkFormat
+
+import browser.backend.buildinfo as buildinfo
+from browser.backend.postings import encode_postings, decode_postings, encode_weights, decode_weights
+from browser.backend.text import split_lqstring, tokenize
+
+
+SEARCH_BUILD_NAME = 'search-index'
+
+# Indexed fields and their BM25F-style weights:
+FIELDS = ('label', 'alias', 'description')
+FIELD_BOOSTS = {'label': 3.0, 'alias': 2.0, 'description': 1.0}
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+# The last query token is expanded to at most this many indexed terms, most frequent first:
+DEFAULT_MAX_EXPANSIONS = 50
+# Prefixes shorter than this are matched exactly:
+MIN_PREFIX_LENGTH = 2
+# Maximum number of postings decoded per term, longer lists are cut off at
+# the lowest-pagerank end:
+DEFAULT_MAX_POSTINGS = 500000
+# Maximum number of scored documents considered for the result:
+DEFAULT_MAX_CANDIDATES = 1000
+# Number of documents indexed in memory before their postings are flushed to disk:
+DEFAULT_BATCH_SIZE = 500000
+
+# Maximum number of SQL parameters we use per statement:
+SQL_CHUNK_SIZE = 500
+
+
+def get_build_name(lang):
+    return '%s-%s' % (SEARCH_BUILD_NAME, lang)
+
+
+def get_table_names(lang):
+    """Return the (docs, terms) table names of the search index for 'lang'.
+    """
+    suffix = re.sub(r'\W', '_', lang)
+    return 'rb_search_docs_' + suffix, 'rb_search_terms_' + suffix
+
+
+def unstringify(value):
+    """Return the display text of KGTK string 'value', tolerating malformed values.
+    """
+    try:
+        return KgtkFormat.unstringify(value)
+    except (ValueError, SyntaxError):
+        return split_lqstring(value)[0]
+
+
+class SearchIndex(object):
+    """
+    BM25 search index for language 'lang' stored in the graph cache managed by 'store'.
+    """
+
+    def __init__(self, store, lang, info=None):
+        self.store = store
+        self.lang = lang
+        self.docs_table, self.terms_table = get_table_names(lang)
+        self.info = info
+
+    @classmethod
+    def load(cls, store, lang):
+        """Return the search index for 'lang' in 'store', or None if it has not been built.
+        """
+        info = buildinfo.get_build_info(store, get_build_name(lang))
+        if info is None or not all(store.has_table(table) for table in info['tables']):
+            return None
+        return cls(store, lang, info=info)
+
+    ### Building:
+
+    def build(self,
+              sources,
+              pagerank_table=None,
+              k1=DEFAULT_K1,
+              b=DEFAULT_B,
+              batch_size=DEFAULT_BATCH_SIZE,
+              log=sys.stderr):
+        """Build the index from 'sources' which maps each of 'FIELDS' to a (table, label)
+        pair naming the graph table and edge label providing that field's text.  If
+        'pagerank_table' names an l_d_pgr_ud-style table, use its pagerank column to
+        order documents, which makes higher-ranked nodes win ties and survive posting
+        list cutoffs.  Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        for table in (self.docs_table, self.terms_table):
+            store.execute(f'DROP TABLE IF EXISTS {table}')
+        store.execute('DROP TABLE IF EXISTS temp.rb_search_source')
+        store.execute('DROP TABLE IF EXISTS temp.rb_search_pagerank')
+        store.execute('DROP TABLE IF EXISTS temp.rb_search_staging')
+
+        # collect the text of all fields in our language into one table:
+        store.execute('CREATE TEMP TABLE rb_search_source (node1 TEXT, field INTEGER, text TEXT)')
+        for field_idx, field in enumerate(FIELDS):
+            if field not in sources:
+                continue
+            table, label = sources[field]
+            store.execute(f'INSERT INTO temp.rb_search_source SELECT node1, ?, node2 FROM {table} '
+                          f'WHERE label=? AND node2 LIKE ?', (field_idx, label, "%'@" + self.lang))
+        store.execute('CREATE TEMP TABLE rb_search_pagerank (node1 TEXT PRIMARY KEY, pagerank REAL)')
+        if pagerank_table is not None:
+            store.execute(f'INSERT INTO temp.rb_search_pagerank '
+                          f'SELECT node1, MAX(CAST("node1;pagerank" AS REAL)) FROM {pagerank_table} GROUP BY node1')
+        if log:
+            print('Collected search text in %.1f secs' % (time.time() - start), file=log, flush=True)
+
+        store.execute(f'CREATE TABLE {self.docs_table} '
+                      '(id INTEGER PRIMARY KEY, node1 TEXT, pagerank REAL, label TEXT, alias TEXT, description TEXT)')
+        store.execute('CREATE TEMP TABLE rb_search_staging '
+                      '(term TEXT, batch INTEGER, df INTEGER, postings BLOB, tfs BLOB)')
+        texts = store.execute('SELECT s.node1, s.field, s.text, COALESCE(p.pagerank, 0.0) AS prank '
+                              'FROM temp.rb_search_source s LEFT JOIN temp.rb_search_pagerank p ON p.node1=s.node1 '
+                              'ORDER BY prank DESC, s.node1')
+        docs_by_node = itertools.groupby(texts, key=lambda row: row[0])
+        boosts = [FIELD_BOOSTS[field] for field in FIELDS]
+        doc_lengths = array('f')
+        doc_id = 0
+        for batch in itertools.count():
+            docs = []
+            postings = {}
+            for node1, rows in itertools.islice(docs_by_node, batch_size):
+                doc_id += 1
+                fields = [[] for _ in FIELDS]
+                tfs = Counter()
+                prank = 0.0
+                for _, field_idx, text, prank in rows:
+                    text = unstringify(text)
+                    fields[field_idx].append(text)
+                    for token in tokenize(text):
+                        tfs[token] += boosts[field_idx]
+                docs.append((doc_id, node1, prank, *(json.dumps(values) for values in fields)))
+                doc_lengths.append(sum(tfs.values()))
+                for term, tf in tfs.items():
+                    entry = postings.get(term)
+                    if entry is None:
+                        entry = postings[term] = (array('I'), array('f'))
+                    entry[0].append(doc_id)
+                    entry[1].append(tf)
+            if not docs:
+                break
+            store.executemany(f'INSERT INTO {self.docs_table} VALUES (?, ?, ?, ?, ?, ?)', docs)
+            store.executemany('INSERT INTO temp.rb_search_staging VALUES (?, ?, ?, ?, ?)',
+                              ((term, batch, len(ids), encode_postings(ids), encode_weights(tfs))
+                               for term, (ids, tfs) in postings.items()))
+            if log:
+                print('Indexed %d documents in %.1f secs' % (doc_id, time.time() - start), file=log, flush=True)
+
+        # now that we know the average document length, turn term frequencies into BM25 weights:
+        avgdl = sum(doc_lengths) / max(1, len(doc_lengths))
+        store.execute(f'CREATE TABLE {self.terms_table} '
+                      '(term TEXT PRIMARY KEY, df INTEGER, postings BLOB, weights BLOB) WITHOUT ROWID')
+        staged = store.execute('SELECT term, df, postings, tfs FROM temp.rb_search_staging ORDER BY term, batch')
+        num_terms = 0
+        for term, rows in itertools.groupby(staged, key=lambda row: row[0]):
+            ids = []
+            weights = []
+            df = 0
+            for _, batch_df, batch_postings, batch_tfs in rows:
+                df += batch_df
+                batch_ids = decode_postings(batch_postings)
+                for doc, tf in zip(batch_ids, decode_weights(batch_tfs)):
+                    norm = k1 * (1.0 - b + b * doc_lengths[doc - 1] / avgdl)
+                    weights.append(tf * (k1 + 1.0) / (tf + norm))
+                ids.extend(batch_ids)
+            store.execute(f'INSERT INTO {self.terms_table} VALUES (?, ?, ?, ?)',
+                          (term, df, encode_postings(ids), encode_weights(weights)))
+            num_terms += 1
+        for table in ('rb_search_staging', 'rb_search_source', 'rb_search_pagerank'):
+            store.execute(f'DROP TABLE temp.{table}')
+        store.commit()
+
+        config = {
+            'lang': self.lang,
+            'sources': {field: list(source) for field, source in sources.items()},
+            'pagerank': pagerank_table,
+            'boosts': FIELD_BOOSTS,
+            'k1': k1,
+            'b': b,
+            'num_docs': doc_id,
+            'avgdl': avgdl,
+        }
+        self.info = buildinfo.record_build(store, get_build_name(self.lang), config,
+                                           [self.docs_table, self.terms_table])
+        if log:
+            print('Built %s search index over %d documents and %d terms in %.1f secs, %s on disk'
+                  % (self.lang, doc_id, num_terms, time.time() - start, buildinfo.format_size(self.info['size'])),
+                  file=log, flush=True)
+        return self.info
+
+    ### Searching:
+
+    def get_terms(self, terms):
+        """Return (term, df, postings, weights) rows for all of 'terms' in the index.
+        """
+        terms = list(terms)
+        rows = []
+        for i in range(0, len(terms), SQL_CHUNK_SIZE):
+            chunk = terms[i:i + SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            rows.extend(self.store.execute(
+                f'SELECT term, df, postings, weights FROM {self.terms_table} WHERE term IN ({marks})', chunk))
+        return rows
+
+    def expand_prefix(self, prefix, max_expansions):
+        """Return up to 'max_expansions' indexed terms starting with 'prefix', most frequent first.
+        """
+        query = (f'SELECT term FROM {self.terms_table} WHERE term >= ? AND term < ? '
+                 f'ORDER BY df DESC LIMIT ?')
+        return [row[0] for row in self.store.execute(query, (prefix, prefix + '\U0010ffff', max_expansions))]
+
+    def score_terms(self, terms, max_postings):
+        """Return a dict mapping documents to their best BM25 score for any of 'terms'.
+        """
+        num_docs = self.info['config']['num_docs']
+        scores = {}
+        for term, df, postings, weights in self.get_terms(terms):
+            idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            for doc, weight in zip(decode_postings(postings, limit=max_postings),
+                                   decode_weights(weights, limit=max_postings)):
+                score = idf * weight
+                if score > scores.get(doc, 0.0):
+                    scores[doc] = score
+        return scores
+
+    def get_docs(self, doc_ids):
+        """Return a dict mapping each of 'doc_ids' to its (node1, pagerank, label, alias, description) row.
+        """
+        docs = {}
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), SQL_CHUNK_SIZE):
+            chunk = doc_ids[i:i + SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            for row in self.store.execute(
+                    f'SELECT id, node1, pagerank, label, alias, description FROM {self.docs_table} '
+                    f'WHERE id IN ({marks})', chunk):
+                docs[row[0]] = row[1:]
+        return docs
+
+    def search(self,
+               text,
+               size=20,
+               prefix=True,
+               max_expansions=DEFAULT_MAX_EXPANSIONS,
+               max_postings=DEFAULT_MAX_POSTINGS,
+               max_candidates=DEFAULT_MAX_CANDIDATES,
+               node_filter=None):
+        """Return up to 'size' search results for 'text' ordered by descending BM25 score,
+        each a dict with the keys used by the KGTK search API ('qnode', 'score', 'label',
+        'alias', 'description' and 'pagerank').  Documents have to match all query tokens,
+        unless no document does in which case any token may match.  If 'prefix', the last
+        token also matches indexed terms it is a prefix of.  If 'node_filter' is given, it
+        is called with lists of candidate nodes and has to return the subset to keep.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        groups = [[token] for token in tokens[:-1]]
+        last = tokens[-1]
+        if prefix and len(last) >= MIN_PREFIX_LENGTH:
+            groups.append(self.expand_prefix(last, max_expansions) or [last])
+        else:
+            groups.append([last])
+
+        group_scores = sorted((self.score_terms(group, max_postings) for group in groups), key=len)
+        # conjunctive match first, starting from the most selective group:
+        scores = {doc: score for doc, score in group_scores[0].items()
+                  if all(doc in other for other in group_scores[1:])}
+        for doc in scores:
+            scores[doc] += sum(other[doc] for other in group_scores[1:])
+        if not scores and len(group_scores) > 1:
+            for other in group_scores:
+                for doc, score in other.items():
+                    scores[doc] = scores.get(doc, 0.0) + score
+
+        # ties go to the higher pagerank, which is the lower document ID:
+        ranked = heapq.nsmallest(max_candidates, scores.items(), key=lambda item: (-item[1], item[0]))
+        results = []
+        for i in range(0, len(ranked), max(size, 1)):
+            page = ranked[i:i + max(size, 1)]
+            docs = self.get_docs([doc for doc, _ in page])
+            keep = None
+            if node_filter is not None:
+                keep = node_filter([doc[0] for doc in docs.values()])
+            for doc, score in page:
+                node1, pagerank, label, alias, description = docs[doc]
+                if keep is not None and node1 not in keep:
+                    continue
+                results.append({
+                    'qnode': node1,
+                    'score': score,
+                    'label': json.loads(label),
+                    'alias': json.loads(alias),
+                    'description': json.loads(description),
+                    'pagerank': pagerank,
+                })
+                if len(results) >= size:
+                    return results
+        return results
@@ -0,0 +1,64 @@
+"""
+Track the latest request sequence number per client token across processes.
+
+Search-as-you-type clients send a token identifying their search box and an
+increasing sequence number with each '/kb/query' request.  Once a request with
+a higher sequence number has arrived for a token, all earlier requests of that
+token are superseded and can be abandoned.  The sequence numbers live in a
+fixed-size shared memory table of (token hash, sequence number) slots, so they
+are visible to all worker processes forked after the table was created.  Tokens
+that hash to the same slot simply evict each other, which can only cause a
+missed cancellation, never a wrong one.
+"""
+
+import hashlib
+import multiprocessing
+
+
+# Number of (token hash, sequence number) slots:
+DEFAULT_NUM_SLOTS = 4096
+
+
+def hash_token(token):
+    """Return a stable signed 64-bit hash of 'token' (Python's 'hash' is salted per process).
+    """
+    digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class RequestSequencer(object):
+    """
+    Shared table of the latest sequence number seen per client token.  Has to be
+    created before the worker processes that check it are forked.
+    """
+
+    def __init__(self, num_slots=DEFAULT_NUM_SLOTS):
+        self.num_slots = max(1, int(num_slots))
+        # slot i occupies entries 2*i (token hash) and 2*i+1 (sequence number):
+        self.slots = multiprocessing.Array('q', 2 * self.num_slots)
+
+    def get_slot(self, token_hash):
+        return 2 * (token_hash % self.num_slots)
+
+    def advance(self, token, seq):
+        """Record that request 'seq' of 'token' has arrived.  Return False if a request
+        with a higher sequence number has already been seen, that is, if 'seq' is
+        superseded on arrival.
+        """
+        token_hash = hash_token(token)
+        slot = self.get_slot(token_hash)
+        with self.slots.get_lock():
+            if self.slots[slot] == token_hash and self.slots[slot + 1] > seq:
+                return False
+            self.slots[slot] = token_hash
+            self.slots[slot + 1] = seq
+            return True
+
+    def is_superseded(self, token, seq):
+        """Return True if a request with a higher sequence number than 'seq' has arrived for 'token'.
+        """
+        token_hash = hash_token(token)
+        slot = self.get_slot(token_hash)
+        # single reads of aligned 64-bit values, a stale answer only delays cancellation:
+        slots = self.slots.get_obj()
+        return slots[slot] == token_hash and slots[slot + 1] > seq
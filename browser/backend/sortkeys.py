@@ -0,0 +1,168 @@
+"""
+Numeric sort keys for paging through quantity and time values in '/kb/property'.
+
+Paged property views order the values of a property by their node2 or by the
+node2 of a sort qualifier.  Quantities are ordered by casting their string to
+a float and times by their string, so no index can satisfy the ORDER BY and
+every page sorts all values of the property, and times with negative years or
+different precisions sort wrong.  This build step computes a numeric sort key
+for the quantity and time values of claims, and for the quantity and time sort
+qualifiers named by the property sort metadata, and stores them in tables
+indexed on (node1, label, sortkey).  A page of values is then read from the
+index in order, with no sort, and only the edges of that page are joined with
+their labels.
+"""
+
+import re
+import sys
+import time
+
+import browser.backend.buildinfo as buildinfo
+
+
+SORTKEYS_BUILD_NAME = 'sortkeys'
+CLAIM_SORTKEYS_TABLE = 'rb_claim_sortkeys'
+QUALIFIER_SORTKEYS_TABLE = 'rb_qualifier_sortkeys'
+
+SORTABLE_DATATYPES = ('quantity', 'time')
+
+SORT_KEY_FUNCTION = 'rb_sort_key'
+
+QUANTITY_REGEX = re.compile(r'^[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?')
+TIME_REGEX = re.compile(r'^\^([+-]?[0-9]+)(?:-([0-9]{2})(?:-([0-9]{2})(?:T([0-9]{2}):([0-9]{2})(?::([0-9]{2}))?)?)?)?')
+
+
+def quantity_sort_key(value):
+    """Return the magnitude of the KGTK quantity 'value' as a float, or None.
+    """
+    match = QUANTITY_REGEX.match(value)
+    return float(match.group(0)) if match else None
+
+
+def time_sort_key(value):
+    """Return a float that orders the KGTK date and time 'value' chronologically, or None.
+    Missing month, day and time fields count as 0.  This key is also used to sort the
+    time values rendered by the browser, so built and rendered orders agree.
+    """
+    match = TIME_REGEX.match(value)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(part or 0) for part in match.groups())
+    return ((((year * 100 + month) * 100 + day) * 100 + hour) * 100 + minute) * 100.0 + second
+
+
+def value_sort_key(value):
+    """Return the numeric sort key of a KGTK quantity or date and time 'value', or None.
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    if value.startswith('^'):
+        return time_sort_key(value)
+    return quantity_sort_key(value)
+
+
+class SortKeys(object):
+    """
+    Claim and qualifier sort key tables stored in the graph cache managed by 'store'.
+    """
+
+    def __init__(self, store, info=None):
+        self.store = store
+        self.info = info
+        self.qualifier_sorts = set()
+        if info is not None:
+            self.qualifier_sorts = {tuple(sort) for sort in info['config']['qualifier_sorts']}
+
+    @classmethod
+    def load(cls, store):
+        """Return the sort keys in 'store', or None if they have not been built.
+        """
+        info = buildinfo.get_build_info(store, SORTKEYS_BUILD_NAME)
+        if info is None or not all(store.has_table(table) for table in info['tables']):
+            return None
+        return cls(store, info=info)
+
+    ### Building:
+
+    def build(self, edges_table, qualifiers_table, datatypes_table, datatype='datatype', qualifier_sorts=(),
+              log=sys.stderr):
+        """Build sort keys for all claims in 'edges_table' of properties whose 'datatype' in
+        'datatypes_table' is sortable, and for each (property, qualifier) pair in 'qualifier_sorts'
+        a key for every claim of the property from its qualifiers in 'qualifiers_table'.  Claims
+        without a parsable value get a NULL key.  Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        store.get_conn().create_function(SORT_KEY_FUNCTION, 1, value_sort_key, deterministic=True)
+        for table in (CLAIM_SORTKEYS_TABLE, QUALIFIER_SORTKEYS_TABLE):
+            store.execute(f'DROP TABLE IF EXISTS {table}')
+        store.execute(f'CREATE TABLE {CLAIM_SORTKEYS_TABLE} (node1 TEXT, label TEXT, sortkey REAL, id TEXT)')
+        store.execute(f'CREATE TABLE {QUALIFIER_SORTKEYS_TABLE} '
+                      f'(node1 TEXT, label TEXT, qualifier TEXT, sortkey REAL, id TEXT)')
+
+        marks = ','.join('?' * len(SORTABLE_DATATYPES))
+        store.execute(f"""
+            INSERT INTO {CLAIM_SORTKEYS_TABLE}
+            SELECT e.node1, e.label, {SORT_KEY_FUNCTION}(e.node2), e.id FROM {edges_table} e
+            WHERE e.label IN (SELECT node1 FROM {datatypes_table} WHERE label=? AND node2 IN ({marks}))""",
+                      (datatype, *SORTABLE_DATATYPES))
+        (num_claims,) = store.execute(f'SELECT COUNT(*) FROM {CLAIM_SORTKEYS_TABLE}').fetchone()
+        if log:
+            print('Computed %d claim sort keys in %.1f secs' % (num_claims, time.time() - start), file=log, flush=True)
+
+        qualifier_sorts = sorted({(prop, qualifier) for prop, qualifier in qualifier_sorts})
+        for prop, qualifier in qualifier_sorts:
+            # the first qualifier value of a claim determines its position, like the DISTINCT in the query:
+            store.execute(f"""
+                INSERT INTO {QUALIFIER_SORTKEYS_TABLE}
+                SELECT e.node1, e.label, ?,
+                    (SELECT MIN({SORT_KEY_FUNCTION}(q.node2)) FROM {qualifiers_table} q WHERE q.node1=e.id AND q.label=?),
+                    e.id
+                FROM {edges_table} e WHERE e.label=?""",
+                          (qualifier, qualifier, prop))
+        (num_qualified,) = store.execute(f'SELECT COUNT(*) FROM {QUALIFIER_SORTKEYS_TABLE}').fetchone()
+        if log:
+            print('Computed %d qualifier sort keys for %d sort qualifiers in %.1f secs'
+                  % (num_qualified, len(qualifier_sorts), time.time() - start), file=log, flush=True)
+
+        store.execute(f'CREATE INDEX {CLAIM_SORTKEYS_TABLE}_idx ON {CLAIM_SORTKEYS_TABLE} (node1, label, sortkey, id)')
+        store.execute(f'CREATE INDEX {QUALIFIER_SORTKEYS_TABLE}_idx ON {QUALIFIER_SORTKEYS_TABLE} '
+                      f'(node1, label, qualifier, sortkey, id)')
+        store.commit()
+
+        config = {
+            'edges': edges_table,
+            'qualifiers': qualifiers_table,
+            'datatypes': datatypes_table,
+            'datatypes_sorted': list(SORTABLE_DATATYPES),
+            'qualifier_sorts': [list(sort) for sort in qualifier_sorts],
+        }
+        self.info = buildinfo.record_build(store, SORTKEYS_BUILD_NAME, config,
+                                           [CLAIM_SORTKEYS_TABLE, QUALIFIER_SORTKEYS_TABLE])
+        self.qualifier_sorts = set(qualifier_sorts)
+        if log:
+            print('Built sort keys for %d claims and %d qualified claims in %.1f secs, %s on disk'
+                  % (num_claims, num_qualified, time.time() - start, buildinfo.format_size(self.info['size'])),
+                  file=log, flush=True)
+        return self.info
+
+    ### Paging:
+
+    def has_qualifier_keys(self, prop, qualifier):
+        return (prop, qualifier) in self.qualifier_sorts
+
+    def get_page(self, node, prop, skip, limit, qualifier=None, descending=False):
+        """Return the IDs of the claims 'skip' to 'skip+limit' of property 'prop' of 'node'
+        ordered by their value, or by the value of their 'qualifier' if given.  Claims
+        without a sort key come first in ascending and last in descending order.
+        """
+        direction = 'DESC' if descending else 'ASC'
+        if qualifier is None:
+            query = (f'SELECT id FROM {CLAIM_SORTKEYS_TABLE} WHERE node1=? AND label=? '
+                     f'ORDER BY sortkey {direction}, id {direction} LIMIT ? OFFSET ?')
+            params = (node, prop, limit, skip)
+        else:
+            query = (f'SELECT id FROM {QUALIFIER_SORTKEYS_TABLE} WHERE node1=? AND label=? AND qualifier=? '
+                     f'ORDER BY sortkey {direction}, id {direction} LIMIT ? OFFSET ?')
+            params = (node, prop, qualifier, limit, skip)
+        return [edge_id for (edge_id,) in self.store.execute(query, params)]
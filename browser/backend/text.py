@@ -0,0 +1,40 @@
+"""
+Text normalization support for the browser's embedded search indexes.
+"""
+
+import re
+import unicodedata
+
+
+TOKEN_REGEX = re.compile(r'\w+', re.UNICODE)
+
+
+def split_lqstring(value):
+    """Split a KGTK string or language-qualified string 'value' into its text and
+    language parts and return them as a tuple.  The language is None for plain
+    strings.  Escapes are not interpreted, which is good enough for indexing.
+    """
+    if value is None:
+        return '', None
+    if value.startswith("'"):
+        sep = value.rfind("'@")
+        if sep > 0:
+            return value[1:sep], value[sep + 2:]
+        return value.strip("'"), None
+    if value.startswith('"') and value.endswith('"') and len(value) >= 2:
+        return value[1:-1], None
+    return value, None
+
+
+def fold_text(text):
+    """Return a case- and diacritic-folded version of 'text' so that, e.g.,
+    'Gödel' and 'godel' normalize to the same string.
+    """
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Return the list of folded word tokens of 'text'.
+    """
+    return TOKEN_REGEX.findall(fold_text(text))
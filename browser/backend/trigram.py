@@ -0,0 +1,272 @@
+"""
+Trigram index over node labels for typo-tolerant, substring label search.
+
+Labels are normalized (case and diacritic folding, punctuation removal) and
+broken into padded character trigrams per word, in the style of PostgreSQL's
+pg_trgm.  Each label becomes a document whose ID reflects its node's pagerank
+order (ID 1 is the highest-ranked label), and every trigram maps to the
+delta-encoded posting list of documents containing it.  Both live in the graph
+cache next to the graph tables they were built from.
+
+A search decodes only the rarest posting lists a sufficiently similar label must
+share with the query, verifies the resulting candidates against their stored
+normalized labels, and ranks them by word similarity times pagerank.  Like
+pg_trgm's 'word_similarity', this compares the query with the best-matching run
+of words in a label rather than with the whole label, so a short query such as
+'united' still matches 'President of the United States'.
+"""
+
+import heapq
+import itertools
+import math
+import re
+import sys
+import time
+from array import array
+from collections import Counter
+
+import browser.backend.buildinfo as buildinfo
+from browser.backend.postings import encode_postings, decode_postings, merge_postings
+from browser.backend.text import split_lqstring, fold_text
+
+
+TRIGRAM_BUILD_NAME = 'trigram-index'
+TRIGRAM_DOCS_TABLE = 'rb_trigram_docs'
+TRIGRAM_POSTINGS_TABLE = 'rb_trigram_postings'
+TRIGRAM_STAGING_TABLE = 'rb_trigram_staging'
+
+# Searches only consider labels whose word similarity to the query is at least this:
+DEFAULT_MIN_SIMILARITY = 0.3
+# Maximum number of candidate labels verified per search:
+DEFAULT_MAX_CANDIDATES = 2000
+# Maximum number of postings decoded per trigram, longer lists are cut off at
+# the lowest-pagerank end:
+DEFAULT_MAX_POSTINGS = 250000
+# Number of labels indexed in memory before their postings are flushed to disk:
+DEFAULT_BATCH_SIZE = 1000000
+
+# Maximum number of SQL parameters we use per statement:
+SQL_CHUNK_SIZE = 500
+
+NON_WORD_REGEX = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize_label(text):
+    """Return the normalized form of label 'text' used for trigram extraction.
+    """
+    return NON_WORD_REGEX.sub(' ', fold_text(text)).strip()
+
+
+def label_trigrams(norm):
+    """Return the set of trigrams of the normalized label 'norm'.  Each word is
+    padded with two blanks in front and one at the end, so short words and word
+    starts get trigrams of their own.
+    """
+    grams = set()
+    for word in norm.split():
+        padded = '  ' + word + ' '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def trigram_similarity(grams1, grams2):
+    """Return the Jaccard similarity of the trigram sets 'grams1' and 'grams2'.
+    """
+    if not grams1 or not grams2:
+        return 0.0
+    shared = len(grams1 & grams2)
+    return shared / (len(grams1) + len(grams2) - shared)
+
+
+def word_similarity(query_grams, norm):
+    """Return the greatest trigram similarity between 'query_grams' and the trigrams
+    of any run of consecutive words in the normalized label 'norm'.
+    """
+    words = [label_trigrams(word) for word in norm.split()]
+    best = 0.0
+    for i in range(len(words)):
+        window = set()
+        for j in range(i, len(words)):
+            window |= words[j]
+            best = max(best, trigram_similarity(query_grams, window))
+            if query_grams <= window:
+                # longer runs only add trigrams the query doesn't have:
+                break
+    return best
+
+
+class TrigramIndex(object):
+    """
+    Trigram label index stored in the graph cache managed by 'store'.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def exists(self):
+        return self.store.has_table(TRIGRAM_DOCS_TABLE) and self.store.has_table(TRIGRAM_POSTINGS_TABLE)
+
+    ### Building:
+
+    def build(self, source_table, label='label', languages=None, batch_size=DEFAULT_BATCH_SIZE, log=sys.stderr):
+        """Build the index from the labels in the l_d_pgr_ud-style 'source_table' which
+        provides 'label' edges with pagerank and description columns.  If 'languages'
+        is given, only index labels in one of those languages.  Postings are collected
+        in memory for 'batch_size' labels at a time, then merged on disk at the end.
+        Return the recorded build info.
+        """
+        store = self.store
+        start = time.time()
+        for table in (TRIGRAM_DOCS_TABLE, TRIGRAM_POSTINGS_TABLE, TRIGRAM_STAGING_TABLE):
+            store.execute(f'DROP TABLE IF EXISTS {table}')
+        store.execute(f'CREATE TABLE {TRIGRAM_DOCS_TABLE} '
+                      '(id INTEGER PRIMARY KEY, node1 TEXT, label TEXT, lang TEXT, norm TEXT, '
+                      'pagerank REAL, description TEXT)')
+        store.execute(f'CREATE TABLE {TRIGRAM_STAGING_TABLE} (trigram TEXT, batch INTEGER, df INTEGER, postings BLOB)')
+        languages = set(languages) if languages else None
+
+        labels = store.execute(f'SELECT node1, node2, "node1;pagerank", "node1;description" FROM {source_table} '
+                               f'WHERE label=? ORDER BY CAST("node1;pagerank" AS REAL) DESC', (label,))
+        doc_id = 0
+        for batch in itertools.count():
+            docs = []
+            postings = {}
+            num_read = 0
+            for node1, node_label, pagerank, description in itertools.islice(labels, batch_size):
+                num_read += 1
+                text, lang = split_lqstring(node_label)
+                if languages is not None and lang not in languages:
+                    continue
+                norm = normalize_label(text)
+                grams = label_trigrams(norm)
+                if not grams:
+                    continue
+                doc_id += 1
+                docs.append((doc_id, node1, node_label, lang, norm, float(pagerank or 0.0), description))
+                for gram in grams:
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array('I')
+                    ids.append(doc_id)
+            if num_read == 0:
+                break
+            store.executemany(f'INSERT INTO {TRIGRAM_DOCS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)', docs)
+            store.executemany(f'INSERT INTO {TRIGRAM_STAGING_TABLE} VALUES (?, ?, ?, ?)',
+                              ((gram, batch, len(ids), encode_postings(ids)) for gram, ids in postings.items()))
+            if log:
+                print('Indexed %d labels in %.1f secs' % (doc_id, time.time() - start), file=log, flush=True)
+
+        store.execute(f'CREATE TABLE {TRIGRAM_POSTINGS_TABLE} '
+                      '(trigram TEXT PRIMARY KEY, df INTEGER, postings BLOB) WITHOUT ROWID')
+        staged = store.execute(f'SELECT trigram, df, postings FROM {TRIGRAM_STAGING_TABLE} ORDER BY trigram, batch')
+        num_grams = 0
+        for gram, rows in itertools.groupby(staged, key=lambda row: row[0]):
+            rows = list(rows)
+            blob = rows[0][2] if len(rows) == 1 else merge_postings([row[2] for row in rows])
+            store.execute(f'INSERT INTO {TRIGRAM_POSTINGS_TABLE} VALUES (?, ?, ?)',
+                          (gram, sum(row[1] for row in rows), blob))
+            num_grams += 1
+        store.execute(f'DROP TABLE {TRIGRAM_STAGING_TABLE}')
+        store.commit()
+
+        config = {
+            'source': source_table,
+            'label': label,
+            'languages': sorted(languages) if languages else None,
+            'ngram': 3,
+            'normalization': 'casefold,nfkd-strip-marks,non-word-to-space',
+        }
+        info = buildinfo.record_build(store, TRIGRAM_BUILD_NAME, config, [TRIGRAM_DOCS_TABLE, TRIGRAM_POSTINGS_TABLE])
+        if log:
+            print('Built trigram index over %d labels and %d trigrams in %.1f secs, %s on disk'
+                  % (doc_id, num_grams, time.time() - start, buildinfo.format_size(info['size'])),
+                  file=log, flush=True)
+        return info
+
+    ### Searching:
+
+    def get_postings(self, grams):
+        """Return a dict mapping each of 'grams' present in the index to its (df, postings) tuple.
+        """
+        postings = {}
+        grams = list(grams)
+        for i in range(0, len(grams), SQL_CHUNK_SIZE):
+            chunk = grams[i:i + SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            for gram, df, blob in self.store.execute(
+                    f'SELECT trigram, df, postings FROM {TRIGRAM_POSTINGS_TABLE} WHERE trigram IN ({marks})', chunk):
+                postings[gram] = (df, blob)
+        return postings
+
+    def get_docs(self, doc_ids, lang='any'):
+        """Generate (id, node1, label, norm, pagerank, description) rows for the documents
+        in 'doc_ids' whose label is in language 'lang' (all of them if 'lang' is 'any').
+        """
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), SQL_CHUNK_SIZE):
+            chunk = doc_ids[i:i + SQL_CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            yield from self.store.execute(
+                f'SELECT id, node1, label, norm, pagerank, description FROM {TRIGRAM_DOCS_TABLE} '
+                f"WHERE id IN ({marks}) AND (?='any' OR lang=?)", chunk + [lang, lang])
+
+    def get_candidates(self, hits, lang='any', max_candidates=DEFAULT_MAX_CANDIDATES):
+        """Return the document rows of up to 'max_candidates' documents in 'hits' (a doc ID
+        to hit count mapping) whose label is in language 'lang'.  Documents with the most
+        hits come first, ties go to the higher pagerank (lower ID).  The language filter
+        applies before the cap, so labels in other languages don't use up candidates.
+        """
+        order = [(-count, doc_id) for doc_id, count in hits.items()]
+        heapq.heapify(order)
+        candidates = []
+        while order and len(candidates) < max_candidates:
+            chunk = [heapq.heappop(order)[1] for _ in range(min(SQL_CHUNK_SIZE, len(order)))]
+            docs = {row[0]: row for row in self.get_docs(chunk, lang)}
+            candidates.extend(docs[doc_id] for doc_id in chunk if doc_id in docs)
+        return candidates[:max_candidates]
+
+    def search(self,
+               text,
+               limit=20,
+               lang='any',
+               min_similarity=DEFAULT_MIN_SIMILARITY,
+               max_candidates=DEFAULT_MAX_CANDIDATES,
+               max_postings=DEFAULT_MAX_POSTINGS,
+               node_filter=None):
+        """Return up to 'limit' (node1, node_label, score, prank, description) rows for
+        labels similar to 'text', where 'score' is the word similarity and 'prank' the
+        node's pagerank, ordered by descending 'score*prank'.  Only labels in language
+        'lang' with a similarity of at least 'min_similarity' qualify.  If 'node_filter'
+        is given, it is called with the list of qualifying nodes and has to return the
+        subset of nodes to keep.
+        """
+        query_grams = label_trigrams(normalize_label(text))
+        if not query_grams:
+            return []
+        postings = self.get_postings(query_grams)
+        # A label with word similarity 's' to the query has a run of words sharing at
+        # least 's*n' trigrams with the query (their union has at least the 'n' query
+        # trigrams), so the label shares at least 'required' of them.  By pigeonhole it
+        # occurs in at least one of any 'n-required+1' posting lists; we only decode the
+        # rarest ones and count hits in those:
+        n = len(query_grams)
+        required = max(1, math.ceil(min_similarity * n))
+        rarest = sorted(query_grams, key=lambda gram: postings.get(gram, (0, None))[0])[:n - required + 1]
+        hits = Counter()
+        for gram in rarest:
+            if gram in postings:
+                hits.update(decode_postings(postings[gram][1], limit=max_postings))
+        best = {}
+        for doc_id, node1, node_label, norm, pagerank, description in self.get_candidates(hits, lang, max_candidates):
+            score = word_similarity(query_grams, norm)
+            if score < min_similarity:
+                continue
+            prank = pagerank or 0.0
+            row = (node1, node_label, score, prank, description)
+            if node1 not in best or (score * prank, score) > (best[node1][2] * best[node1][3], best[node1][2]):
+                best[node1] = row
+        if node_filter is not None and best:
+            keep = node_filter(list(best.keys()))
+            best = {node: row for node, row in best.items() if node in keep}
+        return heapq.nlargest(limit, best.values(), key=lambda row: (row[2] * row[3], row[2]))
@@ -0,0 +1,57 @@
+"""
+Fast, memoized classification and parsing of KGTK values for rendering.
+
+Constructing a 'KgtkValue' and calling 'classify()' for every edge and
+qualifier value is expensive, yet most values are symbols such as Q-nodes,
+strings or language-qualified strings whose type is decided by their first
+character.  'classify_value' short-circuits on that character and only falls
+back on a full 'KgtkValue' classification for numbers, quantities, dates,
+coordinates and other rare cases.  Parsed 'KgtkValue' objects are memoized in
+a bounded LRU cache, so values that are rendered repeatedly (e.g., the same
+date or quantity across many items) are only parsed once.
+"""
+
+from functools import lru_cache
+
+from kgtk.kgtkformat import KgtkFormat
+from kgtk.value.kgtkvalue import KgtkValue
+
+
+# Number of parsed values kept in memory:
+VALUE_CACHE_SIZE = 50000
+
+# Leading characters of values that need a full classification (numbers and
+# quantities, dates and times, location coordinates and extensions):
+FULL_CLASSIFICATION_CHARS = frozenset('0123456789+-.^@!')
+
+
+@lru_cache(maxsize=VALUE_CACHE_SIZE)
+def get_kgtk_value(value: str) -> KgtkValue:
+    """Return a shared 'KgtkValue' for 'value'.  Callers may parse its fields
+    (which are then cached with it) but must not modify it otherwise.
+    """
+    return KgtkValue(value)
+
+
+def classify_value(value: str) -> KgtkFormat.DataType:
+    """Return the KGTK data type of 'value', the same as 'KgtkValue(value).classify()'.
+    """
+    if len(value) == 0:
+        return KgtkFormat.DataType.EMPTY
+    if KgtkFormat.LIST_SEPARATOR not in value:
+        first = value[0]
+        if first == '"':
+            return KgtkFormat.DataType.STRING
+        if first == "'":
+            return KgtkFormat.DataType.LANGUAGE_QUALIFIED_STRING
+        if (first not in FULL_CLASSIFICATION_CHARS and
+                value != KgtkFormat.TRUE_SYMBOL and value != KgtkFormat.FALSE_SYMBOL):
+            return KgtkFormat.DataType.SYMBOL
+    # lists, booleans and values that need to be parsed to be classified:
+    return get_kgtk_value(value).classify()
+
+
+def get_cache_info():
+    """Return the hit/miss statistics of the parsed value cache.
+    """
+    return get_kgtk_value.cache_info()
@@ -1,6 +1,7 @@
 """
 Kypher backend support for the KGTK browser.
 """
+import concurrent.futures
 import multiprocessing
 from pathlib import Path
 import shutil
@@ -17,11 +18,14 @@ import pandas as pd
 import random
 import sys
 import traceback
-from typing import Tuple, Set, List, MutableMapping, Optional, Mapping, Dict
+import types
+from typing import Callable, Tuple, Set, List, MutableMapping, Optional, Mapping, Dict, Iterable
 
 import flask
 from operator import itemgetter
 import browser.backend.kypher as kybe
+import browser.backend.materialize as materialize
+import browser.backend.sortkeys as sortkeys
 import tempfile
 
 from kgtk.kgtkformat import KgtkFormat
@@ -29,6 +33,12 @@ from kgtk.value.kgtkvalue import KgtkValue, KgtkValueFields
 from kgtk.visualize.visualize_api import KgtkVisualize
 
 from browser.backend.kypher_queries import KypherAPIObject
+from browser.backend.pool import BackendTask, BrowserBackendPool
+from browser.backend.sequencer import RequestSequencer
+from browser.backend.values import classify_value, get_kgtk_value, get_cache_info
+from browser.backend.edgesort import sort_edges
+from browser.backend.cache import BoundedCache, get_cache_stats, hash_key
+from browser.backend.rows import ItemEdge, QualifierEdge
 import re
 import logging
 import time
@@ -57,8 +67,13 @@ import time
 # http://ckg07.isi.edu:1234/kb/Q42
 DEFAULT_SERVICE_PREFIX = '/kgtk/browser/backend/'
 DEFAULT_LANGUAGE = 'en'
-ID_SEARCH_THRESHOLD: int = -1  # force the code to not use IN queries for fetching qualifiers
-ID_SEARCH_USING_IN: bool = True
+# Rough costs (in microseconds) of fetching the qualifiers of a list of edge
+# IDs by binding the IDs as a 'kgtk_values' list (generated row by row in
+# Python inside the query) or by loading them into a temp table first (fixed
+# setup plus a cheap insert per ID, then a primary key join):
+QUALIFIER_FETCH_VALUES_COST_PER_ID: float = 5.0
+QUALIFIER_FETCH_TEMP_TABLE_SETUP_COST: float = 250.0
+QUALIFIER_FETCH_TEMP_TABLE_COST_PER_ID: float = 1.0
 
 DEFAULT_MATCH_ITEM_EXACTLY: bool = True
 DEFAULT_MATCH_ITEM_PREFIXES: bool = True
@@ -70,6 +85,17 @@ DEFAULT_MATCH_LABEL_PREFIXES: bool = True
 DEFAULT_MATCH_LABEL_PREFIXES_LIMIT: int = 20
 DEFAULT_MATCH_LABEL_IGNORE_CASE: bool = True
 DEFAULT_MATCH_LABEL_TEXT_LIKE: bool = False
+DEFAULT_MATCH_LABEL_TRIGRAMS: bool = False
+DEFAULT_SEARCH_SIZE: int = 20
+DEFAULT_QUERY_SEQUENCER_SLOTS: int = 4096
+DEFAULT_QUERY_BATCH_MAX_SIZE: int = 10000
+DEFAULT_CAP_VALUELISTS_IN_QUERY: bool = False
+DEFAULT_QUERY_SUPERSEDED_POLL_INTERVAL: float = 0.05
+DEFAULT_LOOKUP_CACHE_MAX_ENTRIES: int = 100000
+DEFAULT_QUALIFIER_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+DEFAULT_LANGUAGE_NAMES_PRELOAD: List[str] = [DEFAULT_LANGUAGE]
+DEFAULT_MATERIALIZED_STORE: Optional[str] = None
+DEFAULT_COLUMNAR_DATA_FRAMES: bool = False
 
 DEFAULT_PROPLIST_MAX_LEN: int = 2000
 DEFAULT_VALUELIST_MAX_LEN: int = 20
@@ -114,7 +140,19 @@ app.config['MATCH_LABEL_PREFIXES_LIMIT'] = app.config.get('MATCH_LABEL_PREFIXES_
                                                           DEFAULT_MATCH_LABEL_PREFIXES_LIMIT)
 app.config['MATCH_LABEL_IGNORE_CASE'] = app.config.get('MATCH_LABEL_IGNORE_CASE', DEFAULT_MATCH_LABEL_IGNORE_CASE)
 app.config['MATCH_LABEL_TEXT_LIKE'] = app.config.get('MATCH_LABEL_TEXT_LIKE', DEFAULT_MATCH_LABEL_TEXT_LIKE)
+app.config['MATCH_LABEL_TRIGRAMS'] = app.config.get('MATCH_LABEL_TRIGRAMS', DEFAULT_MATCH_LABEL_TRIGRAMS)
+app.config['SEARCH_SIZE'] = app.config.get('SEARCH_SIZE', DEFAULT_SEARCH_SIZE)
+app.config['CAP_VALUELISTS_IN_QUERY'] = app.config.get('CAP_VALUELISTS_IN_QUERY', DEFAULT_CAP_VALUELISTS_IN_QUERY)
+app.config['QUERY_BATCH_MAX_SIZE'] = app.config.get('QUERY_BATCH_MAX_SIZE', DEFAULT_QUERY_BATCH_MAX_SIZE)
+app.config['QUERY_SEQUENCER_SLOTS'] = app.config.get('QUERY_SEQUENCER_SLOTS', DEFAULT_QUERY_SEQUENCER_SLOTS)
+app.config['QUERY_SUPERSEDED_POLL_INTERVAL'] = app.config.get('QUERY_SUPERSEDED_POLL_INTERVAL',
+                                                              DEFAULT_QUERY_SUPERSEDED_POLL_INTERVAL)
 app.config['MATCH_LABEL_IS_CLASS'] = app.config.get('MATCH_LABEL_IS_CLASS')
+app.config['LOOKUP_CACHE_MAX_ENTRIES'] = app.config.get('LOOKUP_CACHE_MAX_ENTRIES', DEFAULT_LOOKUP_CACHE_MAX_ENTRIES)
+app.config['QUALIFIER_CACHE_MAX_BYTES'] = app.config.get('QUALIFIER_CACHE_MAX_BYTES', DEFAULT_QUALIFIER_CACHE_MAX_BYTES)
+app.config['LANGUAGE_NAMES_PRELOAD'] = app.config.get('LANGUAGE_NAMES_PRELOAD', DEFAULT_LANGUAGE_NAMES_PRELOAD)
+app.config['MATERIALIZED_STORE'] = app.config.get('MATERIALIZED_STORE', DEFAULT_MATERIALIZED_STORE)
+app.config['COLUMNAR_DATA_FRAMES'] = app.config.get('COLUMNAR_DATA_FRAMES', DEFAULT_COLUMNAR_DATA_FRAMES)
 app.config['MATCH_LABEL_INSTANCE_OF'] = app.config.get('MATCH_LABEL_INSTANCE_OF')
 
 app.config['PROPLIST_MAX_LEN'] = app.config.get('PROPLIST_MAX_LEN', DEFAULT_PROPLIST_MAX_LEN)
@@ -138,6 +176,9 @@ WIKIDATA_URL_LABEL = app.config['KG_WIKIPEDIA_URL_LABEL']
 wikidata_languages = app.config['WIKIDATA_LANGUAGES']
 url_formatter_templates = app.config['KGTK_URL_FORMATTER_TEMPLATES']
 
+# Latest /kb/query sequence number per client token, shared with the forked query workers:
+query_sequencer: RequestSequencer = RequestSequencer(app.config['QUERY_SEQUENCER_SLOTS'])
+
 # List the properties in the order that you want them to appear.  All unlisted
 # properties will appear after these.
 rb_property_priority_list: List[str] = [
@@ -170,6 +211,10 @@ k_api = KypherAPIObject()
 backend = kybe.BrowserBackend(api=k_api)
 backend.set_app_config(app)
 
+# Precomputed item pages (built with 'kgtk browser materialize'), or None:
+materialized_store: Optional[materialize.MaterializedStore] = materialize.open_store(
+    app.config['MATERIALIZED_STORE'], backend, app.config.get('GRAPH_ID'), app.config.get('GRAPH_CACHE'))
+
 
 @app.route('/kb/info', methods=['GET'])
 def get_info():
@@ -187,6 +232,31 @@ def get_info():
     return flask.jsonify(info), 200
 
 
+@app.route('/kb/cache_stats', methods=['GET'])
+def get_cache_stats_info():
+    """
+    Returns the hit/miss/size statistics of the lookup caches of one worker process
+    """
+    try:
+        return flask.jsonify(p.apply(cache_stats_helper)), 200
+    except Exception as e:
+        print('ERROR: ' + str(e))
+        traceback.print_exc()
+        flask.abort(HTTPStatus.INTERNAL_SERVER_ERROR.value)
+
+
+def cache_stats_helper():
+    value_cache_info = get_cache_info()
+    return {
+        'pid': multiprocessing.current_process().pid,
+        'caches': get_cache_stats(),
+        'values': {'entries': value_cache_info.currsize,
+                   'max_entries': value_cache_info.maxsize,
+                   'hits': value_cache_info.hits,
+                   'misses': value_cache_info.misses},
+    }
+
+
 @app.route('/browser', methods=['GET'])
 @app.route('/browser/<string:node>', methods=['GET'])
 def rb_get_kb(node=None):
@@ -403,6 +473,84 @@ def rb_sort_query_results(results: List[List[str]]) -> List[List[str]]:
     return sorted_results
 
 
+@app.route('/kb/search', methods=['GET'])
+def rb_get_kb_search():
+    """This API provides full-text search over item labels, aliases and
+    descriptions using the embedded BM25 search index built by
+    'kgtk browser build-search-index', so no external search service is
+    needed.  It accepts the parameters of the KGTK search API used by the
+    frontend and returns results in the same shape.
+
+    Parameter Usage
+    ========= ==================================================================================
+    q         The search string.
+
+    language  The language of the search index to use.  The default is DEFAULT_LANGUAGE.
+
+    type      "ngram" (the default) also matches the last word of the search string as a prefix,
+              "exact" matches complete words only.
+
+    size      The maximum number of results to return.  The default is 20.
+
+    is_class  When true, only return items that are classes.
+
+    instance_of Only return items that are instances or subclasses of this class.
+
+    The result returned is:
+
+    [
+        {
+            "qnode": "QNODE",
+            "score": SCORE,
+            "label": ["LABEL", ...],
+            "alias": ["ALIAS", ...],
+            "description": ["DESCRIPTION", ...],
+            "pagerank": PAGERANK
+        },
+        ...
+    ]
+    """
+    args = flask.request.args
+    q = args.get('q', '')
+
+    verbose: bool = args.get("verbose", default=app.config['VERBOSE'], type=rb_is_true)
+    lang: str = args.get("language", app.config['DEFAULT_LANGUAGE'])
+    prefix: bool = args.get("type", "ngram") != "exact"
+    size: int = args.get("size", type=int, default=app.config['SEARCH_SIZE'])
+    is_class: bool = args.get("is_class", type=rb_is_true, default=app.config['MATCH_LABEL_IS_CLASS'])
+    instance_of: str = args.get("instance_of", type=str, default=app.config['MATCH_LABEL_INSTANCE_OF'])
+
+    if verbose:
+        print("rb_get_kb_search: " + q)
+
+    try:
+        response_data = p.apply(search_helper, args=(q, lang, prefix, size, is_class, instance_of, verbose,))
+    except Exception as e:
+        print('ERROR: ' + str(e))
+        flask.abort(HTTPStatus.INTERNAL_SERVER_ERROR.value)
+
+    if response_data is None:
+        flask.abort(HTTPStatus.SERVICE_UNAVAILABLE.value,
+                    "No search index for language '%s', run 'kgtk browser build-search-index'" % lang)
+    return flask.jsonify(response_data), 200
+
+
+def search_helper(q: str,
+                  lang: str,
+                  prefix: bool,
+                  size: int,
+                  is_class: bool,
+                  instance_of: str,
+                  verbose: bool):
+    if verbose:
+        start = time.time()
+    results = backend.search_text(q, size=size, lang=lang, prefix=prefix, is_class=is_class, instance_of=instance_of)
+    if verbose:
+        print("Got %s search results in %.3f secs" % (results is None and "no" or len(results), time.time() - start),
+              file=sys.stderr, flush=True)
+    return results
+
+
 @app.route('/kb/query', methods=['GET'])
 def rb_get_kb_query():
     """This API is used to generate lists of items (Qnodes od Pnodes) that
@@ -456,6 +604,21 @@ def rb_get_kb_query():
                             to both exact-length label searches and label prefix searches.
                             The default is True.
 
+    match_label_trigrams This controls whether or not to return typo-tolerant label matches
+                         from the trigram label index built by 'kgtk browser build-trigram-index'.
+                         Matches may occur anywhere in a label and are ranked by similarity
+                         times pagerank.
+                         The default is False.
+
+    client    An optional token identifying the client's search box, e.g., a random
+              string generated once per page.  Used together with "seq".
+
+    seq       An optional sequence number that the client increases with every query
+              it sends for "client".  Once a query with a higher "seq" has arrived,
+              earlier queries of the same client are superseded: they are dropped if
+              still queued, or their running SQLite queries are interrupted, and they
+              return no matches with "superseded": true in the response.
+
     The result returned is:
 
     [
@@ -507,10 +670,23 @@ def rb_get_kb_query():
 
     match_label_text_like: bool = args.get("match_label_text_like", type=rb_is_true,
                                            default=app.config["MATCH_LABEL_TEXT_LIKE"])
+    match_label_trigrams: bool = args.get("match_label_trigrams", type=rb_is_true,
+                                          default=app.config["MATCH_LABEL_TRIGRAMS"])
 
     is_class: bool = args.get("is_class", type=rb_is_true, default=app.config['MATCH_LABEL_IS_CLASS'])
     instance_of: str = args.get("instance_of", type=str, default=app.config['MATCH_LABEL_INSTANCE_OF'])
 
+    client: Optional[str] = args.get("client", type=str, default=None)
+    seq: Optional[int] = args.get("seq", type=int, default=None)
+    if client is None or seq is None:
+        client = None
+        seq = None
+    elif not query_sequencer.advance(client, seq):
+        # A newer query from this client got here first:
+        if verbose:
+            print("rb_get_kb_query: query %d of %s superseded on arrival" % (seq, repr(client)))
+        return flask.jsonify({"matches": [], "superseded": True}), 200
+
     try:
         response_data = p.apply(query_helper, args=(q,
                                                     lang,
@@ -520,15 +696,71 @@ def rb_get_kb_query():
                                                     match_label_prefixes,
                                                     match_label_prefixes_limit,
                                                     match_label_text_like,
+                                                    match_label_trigrams,
                                                     is_class,
                                                     instance_of,
-                                                    verbose,))
+                                                    verbose,
+                                                    client,
+                                                    seq,))
         return flask.jsonify(response_data), 200
     except Exception as e:
         print('ERROR: ' + str(e))
         flask.abort(HTTPStatus.INTERNAL_SERVER_ERROR.value)
 
 
+def rb_search_results_to_matches(results,
+                                 description_index: int,
+                                 items_seen: Set[str],
+                                 matches: List[MutableMapping[str, str]]):
+    """Append one match per previously unseen item in 'results' to 'matches'.
+    Item and label are expected in the first two columns of each result row,
+    the item description in column 'description_index'.
+    """
+    for result in results:
+        item = result[0]
+        if item in items_seen:
+            continue
+        items_seen.add(item)
+        label = KgtkFormat.unstringify(result[1])
+        description = result[description_index]
+        description = KgtkFormat.unstringify(description) if description is not None and description.strip() != "" else ""
+        matches.append(
+            {
+                "ref": item,
+                "text": item,
+                "description": label,
+                "ref_description": description
+            }
+        )
+
+
+search_backend_pool: Optional[BrowserBackendPool] = None
+
+
+def get_search_backend_pool() -> BrowserBackendPool:
+    """Return this process' pool of search backends.  The pool is created on first
+    use so that graph cache connections are never inherited across forked workers.
+    """
+    global search_backend_pool
+    if search_backend_pool is None:
+        search_backend_pool = BrowserBackendPool(KypherAPIObject, app.config['KYPHER_OBJECTS_NUM'], app=app)
+    return search_backend_pool
+
+
+def wait_for_search(task: BackendTask, superseded: Optional[Callable[[], bool]], poll_interval: float):
+    """Wait for 'task' and return its result.  If 'superseded' is given, poll it
+    every 'poll_interval' seconds while waiting and return None once it is true.
+    """
+    if superseded is None:
+        return task.result()
+    while not superseded():
+        try:
+            return task.result(timeout=poll_interval)
+        except concurrent.futures.TimeoutError:
+            pass
+    return None
+
+
 def query_helper(q: str,
                  lang: str,
                  match_item_exactly: bool,
@@ -537,9 +769,19 @@ def query_helper(q: str,
                  match_label_prefixes: bool,
                  match_label_prefixes_limit: int,
                  match_label_text_like: bool,
+                 match_label_trigrams: bool,
                  is_class: bool,
                  instance_of: str,
-                 verbose: bool):
+                 verbose: bool,
+                 client: Optional[str] = None,
+                 seq: Optional[int] = None):
+    superseded: Optional[Callable[[], bool]] = None
+    if client is not None:
+        superseded = lambda: query_sequencer.is_superseded(client, seq)
+        if superseded():
+            # A newer query from this client arrived while this one was queued:
+            return {"matches": [], "superseded": True}
+
     matches = []
     # We keep track of the matches we've seen and produce only one match per node.
     items_seen: Set[str] = set()
@@ -547,9 +789,10 @@ def query_helper(q: str,
     # match category may be disabled by a parameter.
     #
     # 1) exact length match on the node name
-    # 2) exact length match on the label
-    # 3) prefix match (startswith) on the node name
-    # 4) prefix match on the label
+    # 2) prefix match (FTS textmatch) on the label
+    # 3) typo-tolerant match on the label using the trigram index
+    # 4) %like% match on the label, only used if 2) found nothing
+    # 5) exact length match on the label
     #
     # node name matches are always case-insensitive, because we know that
     # node names in the database are upper-case, and we raise the case
@@ -557,151 +800,113 @@ def query_helper(q: str,
     #
     # Label matches may be case-sensitive or case-insensitive,
     # according to "match_label_ignore_case".
-    if re.match(item_regex, q) and match_item_exactly:
+    #
+    # All enabled searches are issued concurrently on the search backend
+    # pool, and their results are merged in the order above.  Once the
+    # higher-priority searches have produced 'match_label_prefixes_limit'
+    # matches, the lower-priority searches still queued or running are
+    # cancelled.  If the query comes with a client token and sequence
+    # number, all of its searches are cancelled as soon as a newer query
+    # from the same client arrives.
+    strategies: List[Tuple[str, Callable, int]] = list()
 
+    if re.match(item_regex, q) and match_item_exactly:
         # We don't explicitly limit the number of results from this
         # query.  Should we?  The underlying code imposes a default
         # limit, currently 1000.
-        if verbose:
-            print("Searching for item %s" % repr(q), file=sys.stderr, flush=True)
-        # Look for an exact match for the node name:
+        strategies.append(('item',
+                           lambda b: b.rb_get_node_labels(q, is_class=is_class, instance_of=instance_of),
+                           2))
 
-        results = backend.rb_get_node_labels(q, is_class=is_class, instance_of=instance_of)
-
-        if verbose:
-            print("Got %d matches" % len(results), file=sys.stderr, flush=True)
-        for result in results:
-            item = result[0]
-            if item in items_seen:
-                continue
-            items_seen.add(item)
-            label = KgtkFormat.unstringify(result[1])
-            description = KgtkFormat.unstringify(result[2]) if result[2].strip() != "" else ""
-            matches.append(
-                {
-                    "ref": item,
-                    "text": item,
-                    "description": label,
-                    "ref_description": description
-                }
-            )
-    query_text_like = True
     if match_label_prefixes and len(q) >= 3:
         # Query the labels, looking for a prefix match. The search may
         # be case-sensitive or case-insensitive, according to
         # "match_label_ignore_case".
-        #
-        # Labels are assumed to be encoded as language-qualified
-        # strings in the database.  We want to do a prefix match, so
-        # we stringify to a plain string, replace the leading '"' with
-        # "'", and remove the trailing '"'
-        #
-
-        if verbose:
-            print("Searching for label prefix, textmatch %s (ignore_case=%s)" % (
-                repr(q), repr(match_label_ignore_case)), file=sys.stderr, flush=True)
-
-        results = backend.search_labels(q,
-                                        lang=lang,
-                                        limit=match_label_prefixes_limit,
-                                        is_class=is_class,
-                                        instance_of=instance_of)
-
-        if verbose:
-            print("Got %d matches" % len(results), file=sys.stderr, flush=True)
-        if len(results) > 0:
-
-            query_text_like = False
-            for result in results:
-                item = result[0]
-                if item in items_seen:
-                    continue
-                items_seen.add(item)
-                label = KgtkFormat.unstringify(result[1])
-                description = KgtkFormat.unstringify(result[4]) if result[4].strip() != "" else ""
-                matches.append(
-                    {
-                        "ref": item,
-                        "text": item,
-                        "description": label,
-                        "ref_description": description
-                    }
-                )
-    if match_label_text_like and query_text_like and len(q) >= 3:
+        strategies.append(('prefix',
+                           lambda b: b.search_labels(q,
+                                                     lang=lang,
+                                                     limit=match_label_prefixes_limit,
+                                                     is_class=is_class,
+                                                     instance_of=instance_of),
+                           4))
+
+    if match_label_trigrams and len(q) >= 3:
+        # Query the trigram label index, which tolerates misspellings
+        # and matches anywhere in the label.
+        strategies.append(('trigram',
+                           lambda b: b.search_labels_trigrams(q,
+                                                              lang=lang,
+                                                              limit=match_label_prefixes_limit,
+                                                              is_class=is_class,
+                                                              instance_of=instance_of),
+                           4))
+
+    if match_label_text_like and len(q) >= 3:
         # Query the labels, using the %like% match in sqlite FTS5.
         # split the input string at space and insert % between every token
-
         search_label = f"%{'%'.join(q.split(' '))}%"
-        if verbose:
-            print("Searching for label, textlike %s " % (repr(q)), file=sys.stderr, flush=True)
+        strategies.append(('textlike',
+                           lambda b: b.search_labels_textlike(search_label,
+                                                              lang=lang,
+                                                              limit=match_label_prefixes_limit,
+                                                              is_class=is_class,
+                                                              instance_of=instance_of),
+                           4))
 
-        results = backend.search_labels_textlike(search_label,
-                                                 lang=lang,
-                                                 limit=match_label_prefixes_limit,
-                                                 is_class=is_class,
-                                                 instance_of=instance_of)
-        if verbose:
-            print("Got %d matches" % len(results), file=sys.stderr, flush=True)
-        for result in results:
-            item = result[0]
-            if item in items_seen:
-                continue
-            items_seen.add(item)
-            label = KgtkFormat.unstringify(result[1])
-            description = KgtkFormat.unstringify(result[4]) if result[4].strip() != "" else ""
-            matches.append(
-                {
-                    "ref": item,
-                    "text": item,
-                    "description": label,
-                    "ref_description": description
-                }
-            )
     if match_label_exactly:
         # Query the labels, looking for an exact length match. The
         # search may be case-sensitive or case-insensitive, according
         # to "match_label_ignore_case".
         #
-        # We don't explicitly limit the number of results from this
-        # query.  Should we?  The underlying code imposes a default
-        # limit, currently 1000.
-
-        # The simple approach, using stringify, will not work when
-        # "lang" is "any"!  We will have to do a prefix match
-        # including the initial and final "'" delimiters, but
-        # excluding the "@lang" suffix.
-
         # We will use kgtk_lqstring_text() function to get the text part of the language qualified string,
         # and kgtk_lqstring_lang() to get the language.
-        if verbose:
-            print("Searching for label, exact match %s (ignore_case=%s)" %
-                  (repr(q), repr(match_label_ignore_case)),
-                  file=sys.stderr, flush=True)
-
-        results = backend.search_labels_exactly(q,
-                                                lang=lang,
-                                                limit=match_label_prefixes_limit,
-                                                is_class=is_class,
-                                                instance_of=instance_of)
+        strategies.append(('exact',
+                           lambda b: b.search_labels_exactly(q,
+                                                             lang=lang,
+                                                             limit=match_label_prefixes_limit,
+                                                             is_class=is_class,
+                                                             instance_of=instance_of),
+                           4))
+
+    pool: BrowserBackendPool = get_search_backend_pool()
+    tasks = [pool.submit(search_fn) for _, search_fn, _ in strategies]
+    is_superseded: bool = False
+    try:
+        prefix_matched: bool = False
+        for idx, (name, _, description_index) in enumerate(strategies):
+            if name == 'textlike' and prefix_matched:
+                # The %like% search is only a fallback for an empty prefix search.
+                tasks[idx].cancel()
+                continue
+            if verbose:
+                print("Waiting for %s search for %s (ignore_case=%s)" % (name, repr(q), repr(match_label_ignore_case)),
+                      file=sys.stderr, flush=True)
+            results = wait_for_search(tasks[idx], superseded, app.config['QUERY_SUPERSEDED_POLL_INTERVAL'])
+            if results is None:
+                if verbose:
+                    print("Query %d of %s superseded during %s search" % (seq, repr(client), name),
+                          file=sys.stderr, flush=True)
+                is_superseded = True
+                break
+            if verbose:
+                print("Got %d %s matches" % (len(results), name), file=sys.stderr, flush=True)
+            if name == 'prefix' and len(results) > 0:
+                prefix_matched = True
+            rb_search_results_to_matches(results, description_index, items_seen, matches)
+            if len(matches) >= match_label_prefixes_limit:
+                if verbose:
+                    print("Match limit %d reached after %s search" % (match_label_prefixes_limit, name),
+                          file=sys.stderr, flush=True)
+                break
+    finally:
+        # Drop any lower-priority searches we no longer need:
+        cancelled: int = pool.cancel(tasks)
+        if verbose and cancelled > 0:
+            print("Cancelled %d pending searches" % cancelled, file=sys.stderr, flush=True)
 
-        if verbose:
-            print("Got %d matches" % len(results), file=sys.stderr, flush=True)
+    if is_superseded:
+        return {"matches": [], "superseded": True}
 
-        for result in results:
-            item = result[0]
-            if item in items_seen:
-                continue
-            items_seen.add(item)
-            label = KgtkFormat.unstringify(result[1])
-            description = KgtkFormat.unstringify(result[4]) if result[4].strip() != "" else ""
-            matches.append(
-                {
-                    "ref": item,
-                    "text": item,
-                    "description": label,
-                    "ref_description": description
-                }
-            )
     if verbose:
         print("Got %d matches total" % len(matches), file=sys.stderr, flush=True)
     # Build the final response:
@@ -712,6 +917,132 @@ def query_helper(q: str,
     return response_data
 
 
+def rb_json_bool(value, default: bool) -> bool:
+    """Bool conversion function for options in JSON request bodies, which may
+    be JSON booleans or "true"/"false" strings.
+    """
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return rb_is_true(value)
+    return bool(value)
+
+
+@app.route('/kb/query/batch', methods=['POST'])
+def rb_post_kb_query_batch():
+    """This API looks up many query strings at once, e.g., for entity linking.
+    It expects a JSON object with the list of query strings and options shared
+    by all of them:
+
+    {
+        "q": ["Q42", "Douglas Adams", ...],
+        "lang": "en",
+        "match_item_exactly": true,
+        "match_label_exactly": true,
+        "limit": 20,
+        "is_class": false,
+        "instance_of": "Q5",
+        "verbose": false
+    }
+
+    Only "q" is required, the options default to the same values as for
+    /kb/query.  Exact item matches (for query strings that look like item
+    names) and exact case-insensitive label matches are resolved for all
+    query strings together with set-based queries, so the cost per query
+    string goes down as the batch grows.  At most QUERY_BATCH_MAX_SIZE query
+    strings are accepted per request.
+
+    The result returned lists the matches of each query string in the order
+    of the query strings, in the format of /kb/query:
+
+    {
+        "results": [
+            {
+                "q": "Q42",
+                "matches": [...]
+            },
+            ...
+        ]
+    }
+    """
+    body = flask.request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return flask.jsonify({"error": "expected a JSON object"}), HTTPStatus.BAD_REQUEST.value
+    queries = body.get("q")
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return flask.jsonify({"error": "'q' must be a list of strings"}), HTTPStatus.BAD_REQUEST.value
+    if len(queries) > app.config['QUERY_BATCH_MAX_SIZE']:
+        return flask.jsonify({"error": "at most %d query strings allowed per batch" % app.config['QUERY_BATCH_MAX_SIZE']}), \
+               HTTPStatus.BAD_REQUEST.value
+
+    verbose: bool = rb_json_bool(body.get("verbose"), app.config['VERBOSE'])
+    lang: str = body.get("lang", app.config['DEFAULT_LANGUAGE'])
+    match_item_exactly: bool = rb_json_bool(body.get("match_item_exactly"), app.config['MATCH_ITEM_EXACTLY'])
+    match_label_exactly: bool = rb_json_bool(body.get("match_label_exactly"), app.config['MATCH_LABEL_EXACTLY'])
+    limit: int = body.get("limit", app.config['MATCH_LABEL_PREFIXES_LIMIT'])
+    is_class: bool = rb_json_bool(body.get("is_class"), app.config['MATCH_LABEL_IS_CLASS'])
+    instance_of: Optional[str] = body.get("instance_of", app.config['MATCH_LABEL_INSTANCE_OF'])
+    if not isinstance(limit, int) or (instance_of is not None and not isinstance(instance_of, str)):
+        return flask.jsonify({"error": "invalid 'limit' or 'instance_of'"}), HTTPStatus.BAD_REQUEST.value
+
+    try:
+        response_data = p.apply(query_batch_helper, args=(queries,
+                                                          lang,
+                                                          match_item_exactly,
+                                                          match_label_exactly,
+                                                          limit,
+                                                          is_class,
+                                                          instance_of,
+                                                          verbose,))
+        return flask.jsonify(response_data), 200
+    except Exception as e:
+        print('ERROR: ' + str(e))
+        flask.abort(HTTPStatus.INTERNAL_SERVER_ERROR.value)
+
+
+def query_batch_helper(queries: List[str],
+                       lang: str,
+                       match_item_exactly: bool,
+                       match_label_exactly: bool,
+                       limit: int,
+                       is_class: bool,
+                       instance_of: Optional[str],
+                       verbose: bool):
+    if verbose:
+        start = time.time()
+    unique_queries: List[str] = list(dict.fromkeys(queries))
+
+    item_results: Mapping[str, List] = dict()
+    if match_item_exactly:
+        items: List[str] = [q for q in unique_queries if re.match(item_regex, q)]
+        if len(items) > 0:
+            item_results = backend.rb_get_nodes_labels(items, is_class=is_class, instance_of=instance_of)
+
+    label_results: Mapping[str, List] = dict()
+    if match_label_exactly:
+        label_results = backend.search_labels_exactly_batch(unique_queries,
+                                                            limit=limit,
+                                                            lang=lang,
+                                                            is_class=is_class,
+                                                            instance_of=instance_of)
+
+    # Merge item matches before label matches as /kb/query does:
+    query_matches: MutableMapping[str, List] = dict()
+    for q in unique_queries:
+        matches = []
+        items_seen: Set[str] = set()
+        rb_search_results_to_matches(item_results.get(q, []), 2, items_seen, matches)
+        rb_search_results_to_matches(label_results.get(q, []), 4, items_seen, matches)
+        query_matches[q] = matches[:max(limit, 0)]
+
+    if verbose:
+        print("Looked up %d query strings (%d distinct) in %.3f secs"
+              % (len(queries), len(unique_queries), time.time() - start), file=sys.stderr, flush=True)
+    return {
+        "results": [{"q": q, "matches": query_matches[q]} for q in queries]
+    }
+
+
 def rb_link_to_url(text_value, current_value, lang: str = "en", prop: Optional[str] = None) -> bool:
     if text_value is None:
         return False
@@ -734,7 +1065,8 @@ def rb_unstringify(item: str, default: str = "") -> str:
     return KgtkFormat.unstringify(item) if item is not None and len(item) > 0 else default
 
 
-rb_image_formatter_cache: MutableMapping[str, Optional[str]] = dict()
+rb_image_formatter_cache: BoundedCache = BoundedCache('image_formatters',
+                                                       max_entries=app.config['LOOKUP_CACHE_MAX_ENTRIES'])
 
 
 def get_image_formatter(backend, relationship: str) -> Optional[str]:
@@ -752,7 +1084,36 @@ def get_image_formatter(backend, relationship: str) -> Optional[str]:
     return url_formatter
 
 
-rb_units_node_cache: MutableMapping[str, Optional[str]] = dict()
+rb_units_node_cache: BoundedCache = BoundedCache('units_nodes', max_entries=app.config['LOOKUP_CACHE_MAX_ENTRIES'])
+
+
+def rb_resolve_units_nodes(backend, values: Iterable[Optional[str]], lang: str, verbose: bool = False):
+    """Collect the units nodes of all quantities in 'values' and look up the labels of
+    those not yet in 'rb_units_node_cache' with one batched query, so rendering the
+    quantities doesn't interleave a label query per unseen units node.
+    """
+    units_nodes: Set[str] = set()
+    value: Optional[str]
+    for value in values:
+        if value is not None and classify_value(value) == KgtkFormat.DataType.QUANTITY:
+            kgtk_value: KgtkValue = get_kgtk_value(value)
+            if kgtk_value.do_parse_fields() and kgtk_value.fields.units_node is not None:
+                units_nodes.add(kgtk_value.fields.units_node)
+    missing_nodes: List[str] = [node for node in units_nodes if rb_units_node_cache.get((node, lang)) is None]
+    if len(missing_nodes) == 0:
+        return
+    if verbose:
+        print("Fetching labels of %d units nodes" % len(missing_nodes), file=sys.stderr, flush=True)  # ***
+    units_labels: MutableMapping[str, str] = dict()
+    node: str
+    label: str
+    for node, label in backend.get_nodes_labels(missing_nodes, lang=lang):
+        units_labels.setdefault(node, label)
+    for node in missing_nodes:
+        if node in units_labels:
+            rb_units_node_cache[(node, lang)] = rb_unstringify(units_labels[node])
+        else:
+            rb_units_node_cache[(node, lang)] = node  # Remember the failure, we could not find a label for this node.
 
 
 def rb_format_number_or_quantity(
@@ -799,18 +1160,15 @@ def rb_format_number_or_quantity(
             elif value.fields.units_node is not None:
                 # Here's where it gets fancy:
                 units_node: str = value.fields.units_node
-                if units_node not in rb_units_node_cache:
+                number_units = rb_units_node_cache.get((units_node, lang))
+                if number_units is None:
                     units_node_labels: List[List[str]] = backend.get_node_labels(units_node, lang=lang)
                     if len(units_node_labels) > 0:
                         units_node_label: str = units_node_labels[0][1]
-                        rb_units_node_cache[units_node] = rb_unstringify(units_node_label)
+                        number_units = rb_unstringify(units_node_label)
                     else:
-                        rb_units_node_cache[units_node] = None  # Remember the failure.
-
-                if rb_units_node_cache[units_node] is not None:
-                    number_units = rb_units_node_cache[units_node]
-                else:
-                    number_units = units_node  # We could not find a label for this node when we looked last time.
+                        number_units = units_node  # Remember the failure, we could not find a label for this node.
+                    rb_units_node_cache[(units_node, lang)] = number_units
                 number_ref = units_node
 
             number_value = newnum
@@ -932,7 +1290,54 @@ def rb_format_geo(latlon: str,
     return rm_format_dms(float(ddlatstr), is_lat=True) + ", " + rm_format_dms(float(ddlonstr), is_lat=False)
 
 
-rb_language_name_cache: MutableMapping[str, Optional[str]] = dict()
+# Language code -> language name tables per UI language.  The LANGUAGE_NAMES_PRELOAD
+# tables are loaded once before the workers are forked and shared with them
+# copy-on-write, tables of other UI languages are loaded by each worker on first use:
+rb_language_names: Optional[Mapping[str, Mapping[str, str]]] = None
+
+
+def rb_read_language_names(backend, lang: str) -> Mapping[str, str]:
+    """Return the names of all language codes in UI language 'lang', read with one query.
+    Codes without a name in the graph fall back on their English names from
+    WIKIDATA_LANGUAGES for English.
+    """
+    names: MutableMapping[str, str] = dict()
+    code: str
+    label: Optional[str]
+    for code, _, label in backend.rb_get_all_language_labels(lang=lang):
+        code = rb_unstringify(code)
+        # the first name in node1 order, the same that a lookup by code would find:
+        if code not in names and label is not None and len(label) > 0:
+            names[code] = sys.intern(KgtkFormat.unstringify(label))
+    if lang == 'en':
+        for code, name in wikidata_languages.items():
+            names.setdefault(code, name)
+    return types.MappingProxyType(names)
+
+
+def rb_load_language_names(backend, langs: List[str], verbose: bool = False):
+    """Load the language name tables of each of the UI languages 'langs' that isn't loaded yet.
+    """
+    global rb_language_names  # Since we initialize it here.
+    language_names: MutableMapping[str, Mapping[str, str]] = dict(rb_language_names or {})
+    for lang in langs:
+        if lang in language_names:
+            continue
+        language_names[lang] = rb_read_language_names(backend, lang)
+        if verbose:
+            print("Loaded %d language names for lang %s" % (len(language_names[lang]), repr(lang)),
+                  file=sys.stderr, flush=True)
+    rb_language_names = types.MappingProxyType(language_names)
+
+
+def rb_get_language_names(backend, lang: str) -> Mapping[str, str]:
+    """Return the language name table for UI language 'lang', loading it on first use
+    if it wasn't preloaded.
+    """
+    if rb_language_names is None or lang not in rb_language_names:
+        # Not preloaded at startup, e.g., when run by 'flask run' or for other UI languages:
+        rb_load_language_names(backend, list(app.config['LANGUAGE_NAMES_PRELOAD']) + [lang])
+    return rb_language_names[lang]
 
 
 def rb_get_language_name(backend,
@@ -948,84 +1353,32 @@ def rb_get_language_name(backend,
         if show_code is true, return "<language_name> (<code>)".
         otherwise, return "<language_name>"
     Otherwise, return "<code>".
+
+    Names are looked up in the preloaded language name tables, so this runs no queries.
     """
-    labels: List[List[str]]
+    names: Mapping[str, str] = rb_get_language_names(backend, lang)
     full_code: Optional[str] = None
-    name: str
+    name: Optional[str]
 
     if language_suffix is not None and len(language_suffix) > 0:
         full_code = language + language_suffix
-        if verbose:
-            print("Looking up full language code %s" % repr(full_code), file=sys.stderr, flush=True)
-        if full_code in rb_language_name_cache:
-            name = rb_language_name_cache[full_code]
-            if verbose:
-                print("Found full code %s in cache: %s" % (repr(full_code), repr(name)), file=sys.stderr, flush=True)
-            return name  # show_code alread applied.
-
-        labels = backend.rb_get_language_labels(KgtkFormat.stringify(full_code), lang=lang)
-        if len(labels) > 0 and labels[0][1] is not None and len(labels[0][1]) > 0:
-            name: str = KgtkFormat.unstringify(labels[0][1])
-            if show_code:
-                name += " (" + full_code + ")"
+        name = names.get(full_code)
+        if name is not None:
             if verbose:
-                print("Found full code %s in database: %s" % (repr(full_code), repr(name)), file=sys.stderr, flush=True)
-
-            # Remember the languge name with the optional code.
-            rb_language_name_cache[full_code] = name
-            return name
+                print("Found full code %s: %s" % (repr(full_code), repr(name)), file=sys.stderr, flush=True)
+            return name + " (" + full_code + ")" if show_code else name
 
     short_code: str = language
-    if verbose:
-        print("Looking up short language code %s" % repr(short_code), file=sys.stderr, flush=True)
-    if short_code in rb_language_name_cache:
-        name = rb_language_name_cache[short_code]
+    name = names.get(short_code)
+    if name is not None:
         if verbose:
-            print("Found short code %s in cache: %s" % (repr(short_code), repr(name)), file=sys.stderr, flush=True)
-        if name == short_code:
-            if full_code is not None:
-                rb_language_name_cache[full_code] = full_code
-                return full_code
-            else:
-                return short_code
-
+            print("Found short code %s: %s" % (repr(short_code), repr(name)), file=sys.stderr, flush=True)
         if show_code:
-            if full_code is not None:
-                name += " (" + full_code + ")"
-            else:
-                name += " (" + short_code + ")"
-
-        if full_code is not None:
-            # Speed up the next lookup.
-            rb_language_name_cache[full_code] = name
-
-        return name
-
-    labels = backend.rb_get_language_labels(KgtkFormat.stringify(short_code), lang=lang)
-    if len(labels) > 0 and labels[0][1] is not None and len(labels[0][1]) > 0:
-        name = KgtkFormat.unstringify(labels[0][1])
-        if verbose:
-            print("Found short code %s in cache: %s" % (repr(short_code), repr(name)), file=sys.stderr, flush=True)
-        # Remember the language name without the optional code:
-        rb_language_name_cache[short_code] = name
-
-        if show_code:
-            if full_code is not None:
-                name += " (" + full_code + ")"
-            else:
-                name += " (" + short_code + ")"
-
-        if full_code is not None:
-            # Speed up the next lookup.
-            rb_language_name_cache[full_code] = name
-
+            name += " (" + (full_code if full_code is not None else short_code) + ")"
         return name
 
     # Return the language code, full or short, without stringification.
-    # Remember the lookup failure for speed.
-    rb_language_name_cache[short_code] = short_code
-    if full_code is not None and language_suffix is not None:
-        rb_language_name_cache[full_code] = full_code
+    if full_code is not None:
         if verbose:
             print("language name not found, using full code %s" % repr(full_code), file=sys.stderr, flush=True)
         return full_code
@@ -1035,19 +1388,31 @@ def rb_get_language_name(backend,
         return short_code
 
 
+class RenderedValue(dict):
+    """
+    A rendered value, serialized as a plain dict.  For quantities and times,
+    'sort_value' holds the parsed number or time as a number that sorts like the
+    value, so values can be sorted by their qualifiers without re-parsing the
+    rendered text.  It is not serialized.
+    """
+    __slots__ = ('sort_value',)
+
+    def __init__(self):
+        super().__init__()
+        self.sort_value: Optional[float] = None
+
+
 def rb_build_current_value(
         backend,
         target_node: str,
-        value: KgtkValue,
         rb_type: str,
         target_node_label: Optional[str],
         target_node_description: Optional[str],
         lang: str,
         relationship: str = "",
         wikidatatype: str = ""
-) -> Mapping[str, str]:
-    current_value: MutableMapping[str, any] = dict()
-    datatype: KgtkFormat.DataType = value.classify()
+) -> RenderedValue:
+    current_value: RenderedValue = RenderedValue()
 
     text_value: str
 
@@ -1081,16 +1446,24 @@ def rb_build_current_value(
     elif rb_type == "/w/quantity":
         number_text: str
         number_ref: Optional[str]
-        number_value, number_units, number_ref = rb_format_number_or_quantity(backend, target_node, value, datatype,
+        number_kgtk_value: KgtkValue = get_kgtk_value(target_node)
+        number_value, number_units, number_ref = rb_format_number_or_quantity(backend,
+                                                                              target_node,
+                                                                              number_kgtk_value,
+                                                                              classify_value(target_node),
                                                                               lang)
         current_value["text"] = number_value
+        if number_kgtk_value.do_parse_fields():
+            current_value.sort_value = number_kgtk_value.fields.number
         if number_units is not None:
             current_value["units"] = number_units
         if number_ref is not None:
             current_value["ref"] = number_ref
 
     elif rb_type == "/w/time":
-        current_value["text"] = rb_format_time(target_node, value)
+        time_kgtk_value: KgtkValue = get_kgtk_value(target_node)
+        current_value["text"] = rb_format_time(target_node, time_kgtk_value)
+        current_value.sort_value = sortkeys.time_sort_key(target_node)
 
     elif rb_type == "/w/geo":
         geoloc = target_node[1:]
@@ -1102,8 +1475,8 @@ def rb_build_current_value(
     return current_value
 
 
-def rb_find_type(node2: str, value: KgtkValue) -> str:
-    datatype: KgtkFormat.DataType = value.classify()
+def rb_find_type(node2: str) -> str:
+    datatype: KgtkFormat.DataType = classify_value(node2)
     rb_type: str
 
     if datatype == KgtkFormat.DataType.SYMBOL:
@@ -1145,26 +1518,16 @@ def rb_get_wc_thumb(image: str, width: int = 300):  # image = e.g. from Wikidata
         width) + 'px-' + image
 
 
-def rb_build_gallery(item_edges: List[List[str]],
+def rb_build_gallery(item_edges: List[ItemEdge],
                      item: str,
                      item_labels: List[List[str]]) -> List[Mapping[str, str]]:
     gallery: List[List[str]] = list()
 
-    item_edge: List[str]
+    item_edge: ItemEdge
     for item_edge in item_edges:
-        edge_id: str
-        node1: str
-        relationship: str
-        node2: str
-        relationship_label: Optional[str]
-        target_node: str
-        target_label: Optional[str]
-        target_description: Optional[str]
-        wikidatatype: Optional[str]
-        edge_id, node1, relationship, node2, relationship_label, target_node, target_label, target_description, wikidatatype = item_edge
-
-        if relationship == "P18":
-            value: KgtkValue = KgtkValue(node2)
+        if item_edge.relationship == "P18":
+            node2: str = item_edge.node2
+            value: KgtkValue = get_kgtk_value(node2)
             if value.is_string() or value.is_language_qualified_string():
                 new_image: Mapping[str, str] = {
                     "url": rb_get_wc_thumb(rb_unstringify(node2)),
@@ -1265,73 +1628,45 @@ rb_property_priority_width = 5
 rb_default_property_priority = int("1" + "0".zfill(rb_property_priority_width)) - 1
 
 
-def rb_get_property_priority(relationship: str) -> str:
-    priority: int
-    if rb_property_priority_map is None:
-        priority = rb_default_property_priority
-    else:
-        priority = rb_property_priority_map.get(relationship, rb_default_property_priority)
-    return str(priority).zfill(rb_property_priority_width)
+def rb_sort_item_edges(item_edges: List[List[str]]) -> List[List[str]]:
+    # Sort the item edges by property priority, relationship label and target label:
+    return sort_edges(item_edges,
+                      relationship_idx=2,
+                      relationship_label_idx=4,
+                      target_idx=5,
+                      target_label_idx=6,
+                      priority_map=rb_property_priority_map,
+                      default_priority=rb_default_property_priority)
 
 
-def rb_build_keyed_item_edges(item_edges: List[List[str]]) -> MutableMapping[str, List[str]]:
-    # Sort the item edges
-    keyed_item_edges: MutableMapping[str, List[str]] = dict()
-
-    idx: int
-    item_edge: List[str]
-    for idx, item_edge in enumerate(item_edges):
-        edge_id, node1, relationship, node2, relationship_label, target_node, target_label, target_description, wikidatatype = item_edge
-        if relationship_label is None:
-            relationship_label = relationship
-        if target_label is None:
-            target_label = target_node
-        priority: str = rb_get_property_priority(relationship)
-        item_edge_key: str = f'{priority}|{relationship_label}|{target_label}|{str(idx + 1000000)}'.lower()
-        keyed_item_edges[item_edge_key] = item_edge
-    return keyed_item_edges
-
-
-def rb_build_keyed_related_item_edges(item_edges: List[List[str]]) -> MutableMapping[str, List[str]]:
-    # Sort the item edges
-    keyed_item_edges: MutableMapping[str, List[str]] = dict()
-
-    idx: int
-    item_edge: List[str]
-    for idx, item_edge in enumerate(item_edges):
-        edge_id, node1, relationship, relationship_label, node1_label = item_edge
-        if relationship_label is None:
-            relationship_label = relationship
-
-        priority: str = rb_get_property_priority(relationship)
-        item_edge_key: str = f'{priority}|{relationship_label}|{node1_label}|{str(idx + 1000000)}'.lower()
-        keyed_item_edges[item_edge_key] = item_edge
-    return keyed_item_edges
+def rb_sort_related_item_edges(item_edges: List[List[str]]) -> List[List[str]]:
+    # Sort the related item edges by property priority, relationship label and node1 label:
+    return sort_edges(item_edges,
+                      relationship_idx=2,
+                      relationship_label_idx=3,
+                      target_idx=1,
+                      target_label_idx=4,
+                      priority_map=rb_property_priority_map,
+                      default_priority=rb_default_property_priority)
 
 
 def rb_build_sorted_item_edges(item_edges: List[List[str]], is_related_items=False) -> List[List[str]]:
     # Sort the item edges:
-    sorted_item_edges: List[List[str]] = list()
-
-    keyed_item_edges: MutableMapping[str, List[str]] = rb_build_keyed_item_edges(item_edges)
+    if is_related_items:
+        return rb_sort_related_item_edges(item_edges)
+    return rb_sort_item_edges(item_edges)
 
-    item_edge_key: str
-    for item_edge_key in sorted(keyed_item_edges.keys()):
-        sorted_item_edges.append(keyed_item_edges[item_edge_key])
 
-    return sorted_item_edges
-
-
-def rb_build_item_qualifier_map(item_qualifier_edges: List[List[str]]) -> Mapping[
-    str, List[List[str]]]:
-    item_qual_map: MutableMapping[str, List[List[str]]] = dict()
+def rb_build_item_qualifier_map(item_qualifier_edges: List[QualifierEdge]) -> Mapping[
+    str, List[QualifierEdge]]:
+    item_qual_map: MutableMapping[str, List[QualifierEdge]] = dict()
 
     edge_id: str
 
     # Map the qualifiers onto the edges that they qualify.
-    item_qual_edge: List[str]
+    item_qual_edge: QualifierEdge
     for item_qual_edge in item_qualifier_edges:
-        edge_id = item_qual_edge[0]
+        edge_id = item_qual_edge.edge_id
         if edge_id not in item_qual_map:
             item_qual_map[edge_id] = list()
         item_qual_map[edge_id].append(item_qual_edge)
@@ -1341,13 +1676,13 @@ def rb_build_item_qualifier_map(item_qualifier_edges: List[List[str]]) -> Mappin
     # important that the values be adjacent to each other in the resulting
     # output.
     for edge_id in item_qual_map:
-        keyed_edge_map: MutableMapping[str, List[List[str]]] = dict()
+        keyed_edge_map: MutableMapping[str, List[QualifierEdge]] = dict()
         qual_relationship_key: str
         for item_qual_edge in item_qual_map[edge_id]:
-            qual_relationship: str = item_qual_edge[3]
-            qual_node2: str = item_qual_edge[4]
-            qual_relationship_label: Optional[str] = item_qual_edge[5]
-            qual_node2_label: Optional[str] = item_qual_edge[6]
+            qual_relationship: str = item_qual_edge.qual_relationship
+            qual_node2: str = item_qual_edge.qual_node2
+            qual_relationship_label: Optional[str] = item_qual_edge.qual_relationship_label
+            qual_node2_label: Optional[str] = item_qual_edge.qual_node2_label
 
             priority: str = rb_qualifier_priority_map.get(qual_relationship, 99999)
             prikey: str = str(priority + 100000)
@@ -1361,9 +1696,9 @@ def rb_build_item_qualifier_map(item_qualifier_edges: List[List[str]]) -> Mappin
                 keyed_edge_map[qual_relationship_key] = list()
             keyed_edge_map[qual_relationship_key].append(item_qual_edge)
 
-        sorted_item_qual_edges: List[List[str]] = list()
+        sorted_item_qual_edges: List[QualifierEdge] = list()
         for qual_relationship_key in sorted(keyed_edge_map.keys()):
-            item_qual_edges: List[List[str]] = keyed_edge_map[qual_relationship_key]
+            item_qual_edges: List[QualifierEdge] = keyed_edge_map[qual_relationship_key]
             sorted_item_qual_edges.extend(item_qual_edges)
         item_qual_map[edge_id] = sorted_item_qual_edges
 
@@ -1373,7 +1708,7 @@ def rb_build_item_qualifier_map(item_qualifier_edges: List[List[str]]) -> Mappin
 def rb_render_item_qualifiers(backend,
                               item: str,
                               edge_id: str,
-                              item_qualifier_edges: List[List[str]],
+                              item_qualifier_edges: List[QualifierEdge],
                               qual_proplist_max_len: int,
                               qual_valuelist_max_len: int,
                               lang: str,
@@ -1382,17 +1717,24 @@ def rb_render_item_qualifiers(backend,
     current_qual_relationship: Optional[str] = None
     current_qualifiers: List[MutableMapping[str, any]] = list()
 
+    # Skip duplicates (say, multiple labels or descriptions) and downsample
+    # before rendering, so we never render values that would be dropped:
+    item_qualifier_edges = [item_qual_edge for idx, item_qual_edge in enumerate(item_qualifier_edges)
+                            if idx == 0 or item_qual_edge.qual_edge_id != item_qualifier_edges[idx - 1].qual_edge_id]
+    item_qualifier_edges = downsample_edges(item_qualifier_edges,
+                                            relationship_idx=3,
+                                            proplist_max_len=qual_proplist_max_len,
+                                            valuelist_max_len=qual_valuelist_max_len,
+                                            who=repr(item) + " edge " + repr(edge_id),
+                                            verbose=verbose)
+
     for item_qual_edge in item_qualifier_edges:
         if verbose:
             print(repr(item_qual_edge), file=sys.stderr, flush=True)
 
-        qual_edge_id: str
-        qual_relationship: str
-        qual_node2: str
-        qual_relationship_label: Optional[str]
-        qual_node2_label: Optional[str]
-        qual_node2_description: Optional[str]
-        _, _, qual_edge_id, qual_relationship, qual_node2, qual_relationship_label, qual_node2_label, qual_node2_description = item_qual_edge
+        qual_edge_id: str = item_qual_edge.qual_edge_id
+        qual_relationship: str = item_qual_edge.qual_relationship
+        qual_node2: str = item_qual_edge.qual_node2
 
         if current_qual_edge_id is not None and current_qual_edge_id == qual_edge_id:
             if verbose:
@@ -1401,8 +1743,7 @@ def rb_render_item_qualifiers(backend,
             continue
         current_qual_edge_id = qual_edge_id
 
-        qual_value: KgtkValue = KgtkValue(qual_node2)
-        qual_rb_type: str = rb_find_type(qual_node2, qual_value)
+        qual_rb_type: str = rb_find_type(qual_node2)
 
         if current_qual_relationship is None or qual_relationship != current_qual_relationship:
             # We are starting a new qualifier. Create the entry for the
@@ -1411,7 +1752,7 @@ def rb_render_item_qualifiers(backend,
             current_qual_values = list()
             current_qual_property_map: MutableMapping[str, any] = {
                 "ref": qual_relationship,
-                "property": rb_unstringify(qual_relationship_label, default=qual_relationship),
+                "property": rb_unstringify(item_qual_edge.qual_relationship_label, default=qual_relationship),
                 "type": qual_rb_type,  # TODO: check for consistency
                 "values": current_qual_values
             }
@@ -1419,10 +1760,9 @@ def rb_render_item_qualifiers(backend,
 
         current_qual_value: MutableMapping[str, any] = rb_build_current_value(backend,
                                                                               qual_node2,
-                                                                              qual_value,
                                                                               qual_rb_type,
-                                                                              qual_node2_label,
-                                                                              qual_node2_description,
+                                                                              item_qual_edge.qual_node2_label,
+                                                                              item_qual_edge.qual_node2_description,
                                                                               lang)
 
         current_qual_values.append(current_qual_value)
@@ -1452,8 +1792,6 @@ def rb_render_related_kb_items(item_edges: List[List[str]],
         node1_label: str
         edge_id, node1, relationship, relationship_label, node1_label = item_edge
 
-        value: KgtkValue = KgtkValue(node1)
-
         # If a relationship has multiple values, they must be next to each
         # other in the sorted list of item_edges.
         if current_relationship is None or relationship != current_relationship:
@@ -1480,7 +1818,7 @@ def rb_render_related_kb_items(item_edges: List[List[str]],
 
 def rb_render_kb_items(backend,
                        item: str,
-                       item_edges: List[List[str]],
+                       item_edges: List[ItemEdge],
                        proplist_max_len: int = 0,
                        valuelist_max_len: int = 0,
                        lang: str = 'en',
@@ -1493,25 +1831,25 @@ def rb_render_kb_items(backend,
     current_relationship: Optional[str] = None
     current_values: List[MutableMapping[str, any]] = list()
 
-    value_drop_count: int = 0
-
-    item_edge: List[str]
+    # Downsample before rendering, so we never render values that would be dropped:
+    item_edges = downsample_edges(item_edges,
+                                  relationship_idx=2,
+                                  proplist_max_len=proplist_max_len,
+                                  valuelist_max_len=valuelist_max_len,
+                                  who=repr(item),
+                                  is_sampled=lambda edge: edge.wikidatatype != "external-id",
+                                  verbose=verbose)
+    rb_resolve_units_nodes(backend, (edge.target_node for edge in item_edges), lang, verbose=verbose)
+
+    item_edge: ItemEdge
     for item_edge in item_edges:
         if verbose:
             print(repr(item_edge), file=sys.stderr, flush=True)
 
-        edge_id: str
-        node1: str
-        relationship: str
-        node2: str
-        relationship_label: Optional[str]
-        target_node: str
-        target_label: Optional[str]
-        target_description: Optional[str]
-        wikidatatype: Optional[str]
-        edge_id, node1, relationship, node2, relationship_label, target_node, target_label, target_description, wikidatatype = item_edge
-        value: KgtkValue = KgtkValue(target_node)
-        rb_type: str = rb_find_type(target_node, value)
+        relationship: str = item_edge.relationship
+        target_node: str = item_edge.target_node
+        wikidatatype: Optional[str] = item_edge.wikidatatype
+        rb_type: str = rb_find_type(target_node)
 
         # If a relationship has multiple values, they must be next to each
         # other in the sorted list of item_edges.
@@ -1519,7 +1857,7 @@ def rb_render_kb_items(backend,
             # We are starting a new relationship.
             current_relationship = relationship
             current_values = list()
-            relationship_label: str = rb_unstringify(relationship_label, default=relationship)
+            relationship_label: str = rb_unstringify(item_edge.relationship_label, default=relationship)
             current_property_map: MutableMapping[str, any] = {
                 "ref": relationship,
                 "property": relationship_label,
@@ -1536,14 +1874,13 @@ def rb_render_kb_items(backend,
 
         current_value: MutableMapping[str, any] = rb_build_current_value(backend,
                                                                          target_node,
-                                                                         value,
                                                                          rb_type,
-                                                                         target_label,
-                                                                         target_description,
+                                                                         item_edge.target_label,
+                                                                         item_edge.target_description,
                                                                          lang,
                                                                          relationship,
                                                                          wikidatatype)
-        current_value["edge_id"] = edge_id  # temporarily save the current edge ID.
+        current_value["edge_id"] = item_edge.edge_id  # temporarily save the current edge ID.
         current_values.append(current_value)
 
     downsample_properties(response_properties, proplist_max_len, valuelist_max_len, repr(item), verbose)
@@ -1566,56 +1903,56 @@ def rb_build_edge_id_tuple(response_properties: List[MutableMapping[str, any]]):
     return tuple(list(edge_set))
 
 
-edge_id_tuple_results_cache: MutableMapping[str, List[List[str]]] = dict()
+edge_id_tuple_results_cache: BoundedCache = BoundedCache('qualifier_results',
+                                                          max_bytes=app.config['QUALIFIER_CACHE_MAX_BYTES'])
+
+
+def rb_choose_qualifier_fetch_strategy(num_edge_ids: int) -> str:
+    """Return 'values' or 'temp_table', whichever way of fetching the qualifiers of
+    'num_edge_ids' edge IDs has the lower estimated cost.
+    """
+    values_cost: float = num_edge_ids * QUALIFIER_FETCH_VALUES_COST_PER_ID
+    temp_table_cost: float = QUALIFIER_FETCH_TEMP_TABLE_SETUP_COST + num_edge_ids * QUALIFIER_FETCH_TEMP_TABLE_COST_PER_ID
+    return 'values' if values_cost <= temp_table_cost else 'temp_table'
 
 
 def rb_fetch_qualifiers_using_id_list(backend,
                                       edge_id_tuple,
                                       qual_query_limit: int = 0,
                                       lang: str = 'en',
-                                      verbose: bool = False) -> List[List[str]]:
-    edge_id_tuple_key = "|".join(sorted(edge_id_tuple)) + "|" + lang + "}" + str(qual_query_limit)
-    if edge_id_tuple_key in edge_id_tuple_results_cache:
+                                      verbose: bool = False) -> Tuple[List[QualifierEdge], int]:
+    """Return the qualifier edges of the edges in 'edge_id_tuple' and the number of
+    qualifier queries that were run to fetch them, which is 0 if they were cached.
+    """
+    edge_id_tuple_key: bytes = hash_key(*sorted(edge_id_tuple), lang, qual_query_limit)
+    cached_qualifier_edges: Optional[List[QualifierEdge]] = edge_id_tuple_results_cache.get(edge_id_tuple_key)
+    if cached_qualifier_edges is not None:
         if verbose:
             print("Fetching qualifier edges for ID in %s (len=%d lang=%s, limit=%d) from cache" % (repr(edge_id_tuple),
                                                                                                    len(edge_id_tuple),
                                                                                                    repr(lang),
                                                                                                    qual_query_limit),
                   file=sys.stderr, flush=True)  # ***
-        return edge_id_tuple_results_cache[edge_id_tuple_key]
+        return cached_qualifier_edges, 0
 
+    strategy: str = rb_choose_qualifier_fetch_strategy(len(edge_id_tuple))
     if verbose:
-        print("Fetching qualifier edges for ID in %s (len=%d, lang=%s, limit=%d)" % (repr(edge_id_tuple),
-                                                                                     len(edge_id_tuple),
-                                                                                     repr(lang),
-                                                                                     qual_query_limit),
+        print("Fetching qualifier edges for ID in %s (len=%d, lang=%s, limit=%d) using %s" % (repr(edge_id_tuple),
+                                                                                             len(edge_id_tuple),
+                                                                                             repr(lang),
+                                                                                             qual_query_limit,
+                                                                                             strategy),
               file=sys.stderr, flush=True)  # ***
-    item_qualifier_edges = backend.rb_get_node_edge_qualifiers_in(edge_id_tuple, lang=lang, limit=qual_query_limit)
+    item_qualifier_edges: List[QualifierEdge]
+    if strategy == 'values':
+        item_qualifier_edges = backend.rb_get_node_edge_qualifiers_in(edge_id_tuple, lang=lang, limit=qual_query_limit)
+    else:
+        item_qualifier_edges = backend.rb_get_node_edge_qualifiers_joined(edge_id_tuple, lang=lang,
+                                                                          limit=qual_query_limit)
 
-    # TODO: limit the size of the cache or apply LRU discipline.
     edge_id_tuple_results_cache[edge_id_tuple_key] = item_qualifier_edges  # Cache the results.
 
-    return item_qualifier_edges
-
-
-def rb_fetch_qualifiers_using_id_queries(backend,
-                                         edge_id_tuple,
-                                         qual_query_limit: int = 0,
-                                         lang: str = 'en',
-                                         verbose: bool = False) -> List[List[str]]:
-    item_qualifier_edges: List[List[str]] = list()
-    if verbose:
-        print("Fetching qualifier edges for ID in %s (len=%d, lang=%s, limit=%d) as queries" % (repr(edge_id_tuple),
-                                                                                                len(edge_id_tuple),
-                                                                                                repr(lang),
-                                                                                                qual_query_limit),
-              file=sys.stderr, flush=True)  # ***
-    edge_id: str
-    for edge_id in edge_id_tuple:
-        item_qualifier_edges.extend(
-            backend.rb_get_node_edge_qualifiers_by_edge_id(edge_id, lang=lang, limit=qual_query_limit))
-
-    return item_qualifier_edges
+    return item_qualifier_edges, 1
 
 
 def rb_fetch_qualifiers(backend,
@@ -1624,32 +1961,24 @@ def rb_fetch_qualifiers(backend,
                         qual_query_limit: int = 0,
                         lang: str = 'en',
                         verbose: bool = False,
-                        is_related_item: bool = False) -> List[List[str]]:
+                        is_related_item: bool = False) -> Tuple[List[QualifierEdge], int]:
+    """Fetch the qualifiers of the edges in 'edge_id_tuple', which are the edges of 'item'
+    (or of its related items) that survived downsampling.  Qualifiers of dropped edges
+    are never fetched.  Return the qualifier edges and the number of qualifier queries run.
+    """
     verbose2: bool = verbose
 
-    item_qualifier_edges: List[List[str]]
-    if len(edge_id_tuple) <= ID_SEARCH_THRESHOLD or is_related_item:
-        if ID_SEARCH_USING_IN:
-            item_qualifier_edges = rb_fetch_qualifiers_using_id_list(backend,
-                                                                     edge_id_tuple,
-                                                                     qual_query_limit=qual_query_limit,
-                                                                     lang=lang,
-                                                                     verbose=verbose2)
-
-        else:
-            item_qualifier_edges = rb_fetch_qualifiers_using_id_queries(backend, edge_id_tuple,
-                                                                        qual_query_limit=qual_query_limit, lang=lang,
-                                                                        verbose=verbose2)
-    else:
-        if verbose2:
-            print("Fetching qualifier edges for item %s (lang=%s, limit=%d)" % (repr(item),
-                                                                                repr(lang),
-                                                                                qual_query_limit),
-                  file=sys.stderr, flush=True)  # ***
-        item_qualifier_edges = backend.rb_get_node_edge_qualifiers(item, lang=lang, limit=qual_query_limit)
+    item_qualifier_edges: List[QualifierEdge] = list()
+    query_count: int = 0
+    if len(edge_id_tuple) > 0:
+        item_qualifier_edges, query_count = rb_fetch_qualifiers_using_id_list(backend,
+                                                                              edge_id_tuple,
+                                                                              qual_query_limit=qual_query_limit,
+                                                                              lang=lang,
+                                                                              verbose=verbose2)
     if verbose2:
         print("Fetched %d qualifier edges" % len(item_qualifier_edges), file=sys.stderr, flush=True)  # ***
-    return item_qualifier_edges
+    return item_qualifier_edges, query_count
 
 
 def rb_fetch_and_render_qualifiers(backend,
@@ -1661,25 +1990,40 @@ def rb_fetch_and_render_qualifiers(backend,
                                    lang: str = 'en',
                                    verbose: bool = False,
                                    is_related_item: bool = False,
-                                   call_from=None):
+                                   call_from=None,
+                                   response_xrefs: Optional[List[MutableMapping[str, any]]] = None) -> int:
+    """Fetch the qualifiers of the edges in 'response_properties' and, if given,
+    'response_xrefs' with a single query and render them into their values.
+    'qual_query_limit' applies to the properties and the xrefs each, as it did when
+    they were fetched separately.  Return the number of qualifier queries run.
+    """
     scanned_property_map: MutableMapping[str, any]
     scanned_value: MutableMapping[str, any]
     scanned_edge_id: str
 
+    if response_xrefs is not None:
+        # the property maps are shared, so rendering into the joined list renders into both:
+        response_properties = response_properties + response_xrefs
+        if len(response_xrefs) > 0 and qual_query_limit > 0:
+            qual_query_limit *= 2
+
     edge_id_tuple = rb_build_edge_id_tuple(response_properties)
 
-    item_qualifier_edges: List[List[str]] = rb_fetch_qualifiers(backend,
-                                                                item,
-                                                                edge_id_tuple,
-                                                                qual_query_limit=qual_query_limit,
-                                                                lang=lang,
-                                                                verbose=verbose,
-                                                                is_related_item=is_related_item)
+    item_qualifier_edges: List[QualifierEdge]
+    query_count: int
+    item_qualifier_edges, query_count = rb_fetch_qualifiers(backend,
+                                                            item,
+                                                            edge_id_tuple,
+                                                            qual_query_limit=qual_query_limit,
+                                                            lang=lang,
+                                                            verbose=verbose,
+                                                            is_related_item=is_related_item)
 
     # Group the qualifiers by the item they qualify, identified by the item's
     # edge_id (which should be unique):
-    item_qual_map: Mapping[str, List[List[str]]] = rb_build_item_qualifier_map(
+    item_qual_map: Mapping[str, List[QualifierEdge]] = rb_build_item_qualifier_map(
         item_qualifier_edges)
+    rb_resolve_units_nodes(backend, (qual_edge.qual_node2 for qual_edge in item_qualifier_edges), lang, verbose=verbose)
     if verbose:
         print("len(item_qual_map) = %d" % len(item_qual_map), file=sys.stderr, flush=True)  # ***
 
@@ -1712,10 +2056,12 @@ def rb_fetch_and_render_qualifiers(backend,
             if "edge_id" in scanned_value:
                 del scanned_value["edge_id"]
 
+    return query_count
+
 
 def rb_render_kb_items_and_qualifiers(backend,
                                       item: str,
-                                      item_edges: List[List[str]],
+                                      item_edges: List[ItemEdge],
                                       proplist_max_len: int = 0,
                                       valuelist_max_len: int = 0,
                                       qual_proplist_max_len: int = 0,
@@ -1737,27 +2083,77 @@ def rb_render_kb_items_and_qualifiers(backend,
                                                              lang=lang,
                                                              verbose=verbose)
 
-    rb_fetch_and_render_qualifiers(backend,
-                                   item,
-                                   response_properties,
-                                   qual_proplist_max_len=qual_proplist_max_len,
-                                   qual_valuelist_max_len=qual_valuelist_max_len,
-                                   qual_query_limit=qual_query_limit,
-                                   lang=lang,
-                                   verbose=verbose, call_from=calling_from)
-
-    rb_fetch_and_render_qualifiers(backend,
-                                   item,
-                                   response_xrefs,
-                                   qual_proplist_max_len=qual_proplist_max_len,
-                                   qual_valuelist_max_len=qual_valuelist_max_len,
-                                   qual_query_limit=qual_query_limit,
-                                   lang=lang,
-                                   verbose=verbose)
+    qualifier_query_count: int = rb_fetch_and_render_qualifiers(backend,
+                                                                item,
+                                                                response_properties,
+                                                                qual_proplist_max_len=qual_proplist_max_len,
+                                                                qual_valuelist_max_len=qual_valuelist_max_len,
+                                                                qual_query_limit=qual_query_limit,
+                                                                lang=lang,
+                                                                verbose=verbose, call_from=calling_from,
+                                                                response_xrefs=response_xrefs)
+    if qualifier_query_count > 1:
+        print("WARNING: %d qualifier queries for item %s, expected at most one" % (qualifier_query_count, repr(item)),
+              file=sys.stderr, flush=True)
 
     return response_properties, response_xrefs
 
 
+def rb_sample(values: List[any], max_len: int, seed: str) -> List[any]:
+    """Return a sample of 'max_len' elements of 'values' in their original order, or
+    'values' itself if it isn't longer than that.  The sample only depends on 'seed'
+    and the length of 'values', so the same request always gets the same sample,
+    which keeps responses cacheable.
+    """
+    if max_len <= 0 or len(values) <= max_len:
+        return values
+    keep: List[int] = random.Random(seed).sample(range(len(values)), max_len)
+    keep.sort()
+    return [values[idx] for idx in keep]
+
+
+def downsample_edges(edges: List[List[str]],
+                     relationship_idx: int,
+                     proplist_max_len: int,
+                     valuelist_max_len: int,
+                     who: str,
+                     is_sampled: Optional[Callable[[List[str]], bool]] = None,
+                     verbose: bool = False) -> List[List[str]]:
+    """Downsample sorted 'edges' before rendering, so that at most 'proplist_max_len'
+    relationships and at most 'valuelist_max_len' edges per relationship remain.
+    Edges of a relationship must be adjacent.  Only relationships whose first edge
+    satisfies 'is_sampled' (if given) are downsampled.  The samples are the same that
+    'downsample_properties' takes from the rendered property list.
+    """
+    if proplist_max_len <= 0 and valuelist_max_len <= 0:
+        return edges
+
+    groups: List[List[List[str]]] = list()
+    for edge in edges:
+        if len(groups) == 0 or edge[relationship_idx] != groups[-1][0][relationship_idx]:
+            groups.append([edge])
+        else:
+            groups[-1].append(edge)
+
+    sampled_groups: List[List[List[str]]] = groups
+    if is_sampled is not None:
+        sampled_groups = [group for group in groups if is_sampled(group[0])]
+    kept_groups: List[List[List[str]]] = rb_sample(sampled_groups, proplist_max_len, who)
+    if verbose and len(kept_groups) < len(sampled_groups):
+        print("Dropping %d of %d properties for %s before rendering"
+              % (len(sampled_groups) - len(kept_groups), len(sampled_groups), who), file=sys.stderr, flush=True)
+    kept_ids: Set[int] = set(id(group) for group in kept_groups)
+    sampled_ids: Set[int] = set(id(group) for group in sampled_groups)
+
+    sampled_edges: List[List[str]] = list()
+    for group in groups:
+        if id(group) not in sampled_ids:
+            sampled_edges.extend(group)
+        elif id(group) in kept_ids:
+            sampled_edges.extend(rb_sample(group, valuelist_max_len, who + "|" + group[0][relationship_idx]))
+    return sampled_edges
+
+
 def downsample_properties(property_list: MutableMapping[str, any],
                           proplist_max_len: int,
                           valuelist_max_len: int,
@@ -1766,16 +2162,17 @@ def downsample_properties(property_list: MutableMapping[str, any],
     if proplist_max_len > 0 and len(property_list) > proplist_max_len:
         if verbose:
             print("Downsampling the properties for %s" % who, file=sys.stderr, flush=True)
-        property_drop_count: int = 0
-        while len(property_list) > proplist_max_len:
-            property_drop_count += 1
-            dropped_property_map: Mapping[str, any] = property_list.pop(random.randrange(len(property_list)))
-            if verbose:
-                print("Dropping property %s (%s)" % (
-                    repr(dropped_property_map["property"]), repr(dropped_property_map["ref"])), file=sys.stderr,
-                      flush=True)
+        kept_properties: List[Mapping[str, any]] = rb_sample(property_list, proplist_max_len, who)
         if verbose:
-            print("Dropped %d properties" % property_drop_count, file=sys.stderr, flush=True)
+            kept_ids: Set[int] = set(id(property_map) for property_map in kept_properties)
+            dropped_property_map: Mapping[str, any]
+            for dropped_property_map in property_list:
+                if id(dropped_property_map) not in kept_ids:
+                    print("Dropping property %s (%s)" % (
+                        repr(dropped_property_map["property"]), repr(dropped_property_map["ref"])), file=sys.stderr,
+                          flush=True)
+            print("Dropped %d properties" % (len(property_list) - len(kept_properties)), file=sys.stderr, flush=True)
+        property_list[:] = kept_properties
 
     if valuelist_max_len > 0:
         if verbose:
@@ -1791,14 +2188,9 @@ def downsample_properties(property_list: MutableMapping[str, any],
                     print("Downsampling values for property %s (%s)" % (repr(scanned_property_map["property"]),
                                                                         repr(scanned_property_map["ref"])),
                           file=sys.stderr, flush=True)
-                value_drop_count: int = 0
-                while len(scanned_values) > valuelist_max_len:
-                    value_drop_count += 1
-                    dropped_value: Mapping[str, str] = scanned_values.pop(random.randrange(len(scanned_values)))
-                    if verbose:
-                        print("dropping value %s (%s)" % (
-                            repr(dropped_value["text"]), repr(dropped_value.get("ref", ""))), file=sys.stderr,
-                              flush=True)
+                value_drop_count: int = len(scanned_values) - valuelist_max_len
+                scanned_values[:] = rb_sample(scanned_values, valuelist_max_len,
+                                              who + "|" + scanned_property_map["ref"])
                 total_value_drop_count += value_drop_count
                 if verbose:
                     print("Dropped %d values" % value_drop_count, file=sys.stderr, flush=True)
@@ -1904,8 +2296,7 @@ def create_intial_hc_properties_response(high_cardinality_properties: List[Tuple
     response = list()
     for high_cardinality_property_edge in high_cardinality_properties:
         property, count, wikidatatype, label = high_cardinality_property_edge
-        value: KgtkValue = KgtkValue(wikidatatype)
-        datatype = rb_find_type(property, value)
+        datatype = rb_find_type(wikidatatype)
         label_ = rb_unstringify(label, property)
         if property in profiled_property_metadata:
             profiled = True
@@ -1951,6 +2342,88 @@ def sort_related_item_properties(response_properties: List[dict]) -> List[dict]:
     return sorted_properties
 
 
+# Request parameters that limit the rendering of materializable endpoints, with
+# the configuration variables that hold their defaults:
+rb_page_limit_parameters: Mapping[str, Tuple[Tuple[str, str], ...]] = {
+    materialize.XITEM_ENDPOINT: (('proplist_max_len', 'PROPLIST_MAX_LEN'),
+                                 ('valuelist_max_len', 'VALUELIST_MAX_LEN'),
+                                 ('qual_proplist_max_len', 'QUAL_PROPLIST_MAX_LEN'),
+                                 ('qual_valuelist_max_len', 'QUAL_VALUELIST_MAX_LEN'),
+                                 ('query_limit', 'QUERY_LIMIT'),
+                                 ('qual_query_limit', 'QUAL_QUERY_LIMIT'),
+                                 ('prop_val_limit', 'PROPERTY_VALUES_COUNT_LIMIT')),
+    materialize.RITEM_ENDPOINT: (('qual_proplist_max_len', 'QUAL_PROPLIST_MAX_LEN'),
+                                 ('qual_valuelist_max_len', 'QUAL_VALUELIST_MAX_LEN'),
+                                 ('query_limit', 'QUERY_LIMIT'),
+                                 ('qual_query_limit', 'QUAL_QUERY_LIMIT'),
+                                 ('prop_val_limit', 'PROPERTY_VALUES_COUNT_LIMIT')),
+}
+
+
+def rb_get_page_limits(endpoint: str, args=None) -> Dict[str, int]:
+    """Return the rendering limits of an 'endpoint' request with 'args', or the
+    default limits if 'args' is None.  Materialized pages are keyed by these.
+    """
+    limits: Dict[str, int] = dict()
+    for parameter, config_name in rb_page_limit_parameters[endpoint]:
+        if args is None:
+            limits[parameter] = app.config[config_name]
+        else:
+            limits[parameter] = args.get(parameter, type=int, default=app.config[config_name])
+    return limits
+
+
+def rb_send_materialized_page(endpoint: str, item: str, lang: str, limits: Mapping[str, int]):
+    """Return a response with the materialized 'endpoint' page of 'item', or None
+    if there is none for these limits.  The stored gzip data is sent as is to
+    clients that accept it.
+    """
+    if materialized_store is None or item is None:
+        return None
+    key: str = materialize.make_key(endpoint, item, lang, limits)
+    data: Optional[bytes] = materialized_store.get_compressed(key)
+    if data is None:
+        return None
+    if 'gzip' in flask.request.accept_encodings:
+        response = flask.Response(data, status=200, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = flask.Response(materialize.decompress_response(data), status=200, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def materialize_page_helper(endpoint: str, item: str, lang: str) -> bytes:
+    """Render the gzip-compressed 'endpoint' response for 'item' with the default
+    limits.  Runs in the worker processes of 'kgtk browser materialize'.
+    """
+    limits: Dict[str, int] = rb_get_page_limits(endpoint)
+    if endpoint == materialize.XITEM_ENDPOINT:
+        response = xitem_helper(app.config['KG_ABSTRACT_LABEL'],
+                                app.config['KG_INSTANCE_COUNT'],
+                                app.config['KG_INSTANCE_COUNT_STAR'],
+                                item,
+                                lang,
+                                limits['prop_val_limit'],
+                                limits['proplist_max_len'],
+                                limits['qual_proplist_max_len'],
+                                limits['qual_query_limit'],
+                                limits['qual_valuelist_max_len'],
+                                limits['query_limit'],
+                                app.config['KG_SUBCLASS_COUNT_STAR'],
+                                limits['valuelist_max_len'],
+                                False, logging.getLogger('perf'))
+    else:
+        response = ritem_helper(item,
+                                lang,
+                                limits['prop_val_limit'],
+                                limits['qual_proplist_max_len'],
+                                limits['qual_query_limit'],
+                                limits['qual_valuelist_max_len'],
+                                limits['query_limit'])
+    return materialize.compress_response(response)
+
+
 @app.route('/kb/ritem', methods=['GET'])
 def rb_get_related_items():
     args = flask.request.args
@@ -1968,8 +2441,14 @@ def rb_get_related_items():
     qual_query_limit: int = args.get('qual_query_limit', type=int,
                                      default=app.config['QUAL_QUERY_LIMIT'])
 
-    if id is None:
+    if item is None:
         return flask.make_response({'error': 'parameter `id` required.'}, 400)
+    materialized_page = rb_send_materialized_page(materialize.RITEM_ENDPOINT,
+                                                  item.upper() if re.match(item_regex, item) else item,
+                                                  lang,
+                                                  rb_get_page_limits(materialize.RITEM_ENDPOINT, args))
+    if materialized_page is not None:
+        return materialized_page
     try:
         s = time.time()
         response = p.apply(ritem_helper, args=(item,
@@ -2026,11 +2505,7 @@ def ritem_helper(item: str,
         f'{multiprocessing.current_process().pid}\tEndpoint:ritem-get-edges\tQnode:{item}\tTime taken:{time.time() - s}')
     response: MutableMapping[dict, any] = list()
     response_properties: List[MutableMapping[str, any]]
-    sorted_item_edges: List[List[str]] = list()
-    keyed_item_edges: MutableMapping[str, List[str]] = rb_build_keyed_related_item_edges(item_edges)
-    item_edge_key: str
-    for item_edge_key in sorted(keyed_item_edges.keys()):
-        sorted_item_edges.append(keyed_item_edges[item_edge_key])
+    sorted_item_edges: List[List[str]] = rb_sort_related_item_edges(item_edges)
     response_properties = rb_render_related_kb_items(sorted_item_edges)
 
     if len(response_properties) > 0:
@@ -2100,11 +2575,7 @@ def rproperty_helper(item: str,
     item_rp_edges = backend.rb_get_node_one_property_related_edges(item, property, limit, skip, lang=lang)
     response: MutableMapping[str, any] = dict()
     response_properties: List[MutableMapping[str, any]]
-    sorted_item_edges: List[List[str]] = list()
-    keyed_item_edges: MutableMapping[str, List[str]] = rb_build_keyed_related_item_edges(item_rp_edges)
-    item_edge_key: str
-    for item_edge_key in sorted(keyed_item_edges.keys()):
-        sorted_item_edges.append(keyed_item_edges[item_edge_key])
+    sorted_item_edges: List[List[str]] = rb_sort_related_item_edges(item_rp_edges)
     response_properties = rb_render_related_kb_items(sorted_item_edges)
     rb_fetch_and_render_qualifiers(backend,
                                    item,
@@ -2186,11 +2657,13 @@ def property_helper(item: str,
     is_sort_by_quantity = False
 
     if qualifier_property is not None:
-        sort_by = 'qn2label' if sort_metadata['qualifier_datatype'] == 'wikibase-item' else 'qn2'
-        if sort_metadata['qualifier_datatype'] == 'quantity':
+        sort_datatype = sort_metadata['qualifier_datatype']
+        sort_by = 'qn2label' if sort_datatype == 'wikibase-item' else 'qn2'
+        if sort_datatype == 'quantity':
             is_sort_by_quantity = True
     else:
-        sort_by = 'n2label' if sort_metadata.get('datatype', 'wikibase-item') == 'wikibase-item' else 'n2'
+        sort_datatype = sort_metadata.get('datatype', 'wikibase-item')
+        sort_by = 'n2label' if sort_datatype == 'wikibase-item' else 'n2'
 
     item_p_edges = backend.rb_get_node_one_property_with_qualifiers_edges(item,
                                                                           property,
@@ -2200,7 +2673,8 @@ def property_helper(item: str,
                                                                           sort_by=sort_by,
                                                                           lang=lang,
                                                                           sort_order=sort_order,
-                                                                          is_sort_by_quantity=is_sort_by_quantity)
+                                                                          is_sort_by_quantity=is_sort_by_quantity,
+                                                                          sort_datatype=sort_datatype)
     response: MutableMapping[str, any] = dict()
     response_properties: List[MutableMapping[str, any]]
     response_properties, _ = rb_send_kb_items_and_qualifiers(backend,
@@ -2265,6 +2739,11 @@ def rb_get_kb_xitem():
     if re.match(item_regex, item):
         item = item.upper()
 
+    materialized_page = rb_send_materialized_page(materialize.XITEM_ENDPOINT, item, lang,
+                                                  rb_get_page_limits(materialize.XITEM_ENDPOINT, args))
+    if materialized_page is not None:
+        return materialized_page
+
     try:
         s = time.time()
         response = p.apply(xitem_helper, args=(abstract_property,
@@ -2331,12 +2810,21 @@ def xitem_helper(abstract_property,
     if verbose2:
         print("Fetching item edges for %s (lang=%s, limit=%d)" % (repr(item), repr(lang), query_limit),
               file=sys.stderr, flush=True)  # ***
-    item_edges: List[List[str]] = []
+    item_edges: List[ItemEdge] = []
     s = time.time()
-    _item_edges: List[List[str]] = backend.rb_get_node_edges(item,
+    # Values beyond 'valuelist_max_len' would be dropped when rendering, so we
+    # don't fetch them unless they are needed for Wikipedia links and the like:
+    max_values_per_property: int = valuelist_max_len if app.config['CAP_VALUELISTS_IN_QUERY'] else 0
+    _item_edges: List[ItemEdge] = backend.rb_get_node_edges(item,
                                                              lang=lang,
                                                              limit=query_limit,
-                                                             lc_properties=low_cardinality_properties_list_str)
+                                                             lc_properties=low_cardinality_properties_list_str,
+                                                             max_values_per_property=max_values_per_property,
+                                                             uncapped_properties=(abstract_property,
+                                                                                  instance_count_property,
+                                                                                  instance_count_star_property,
+                                                                                  subclass_count_star_property,
+                                                                                  WIKIDATA_URL_LABEL))
     logger.error(
         f'{multiprocessing.current_process().pid}\tEndpoint:xitem-get-node-edges\tQnode:{item}\tTime taken:{time.time() - s}')
 
@@ -2372,19 +2860,19 @@ def xitem_helper(abstract_property,
     response['instance_count_star'] = ''
     response['subclass_count_star'] = ''
     for item_edge in _item_edges:
-        if item_edge[2] == abstract_property:
-            abstract = item_edge[3]
+        if item_edge.relationship == abstract_property:
+            abstract = item_edge.node2
             if abstract.endswith('@en'):
                 abstract = abstract[:-3].replace("'", "").replace('"', '')
             response['abstract'] = abstract
-        elif item_edge[2] == instance_count_property:
-            response['instance_count'] = item_edge[3]
-        elif item_edge[2] == instance_count_star_property:
-            response['instance_count_star'] = item_edge[3]
-        elif item_edge[2] == subclass_count_star_property:
-            response['subclass_count_star'] = item_edge[3]
-        elif item_edge[2] == WIKIDATA_URL_LABEL:
-            wiki_lang, wiki_url_part = parse_wikipedia_url(item_edge[3])
+        elif item_edge.relationship == instance_count_property:
+            response['instance_count'] = item_edge.node2
+        elif item_edge.relationship == instance_count_star_property:
+            response['instance_count_star'] = item_edge.node2
+        elif item_edge.relationship == subclass_count_star_property:
+            response['subclass_count_star'] = item_edge.node2
+        elif item_edge.relationship == WIKIDATA_URL_LABEL:
+            wiki_lang, wiki_url_part = parse_wikipedia_url(item_edge.node2)
             wikipedia_urls.append({
                 'lang': wiki_lang,
                 'text': wiki_url_part,
@@ -2534,52 +3022,67 @@ def get_request_args():
 def sort_property_values_by_qualifiers(properties_values_list: List[dict]) -> List[dict]:
     sorted_properties_values_list = list()
     for prop_val_dict in properties_values_list:
-        _property = prop_val_dict['ref']
         if len(prop_val_dict['values']) == 1:  # no point sorting a single value
             sorted_properties_values_list.append(prop_val_dict)
         else:
-            priority_qualifier = find_sort_qualifier(prop_val_dict)
-            sorted_properties_values_list.append(sort_values_for_a_property(prop_val_dict, priority_qualifier))
+            priority_qualifier, values_qualifiers = find_sort_qualifier(prop_val_dict)
+            sorted_properties_values_list.append(sort_values_for_a_property(prop_val_dict,
+                                                                            priority_qualifier,
+                                                                            values_qualifiers))
 
     return sorted_properties_values_list
 
 
-def sort_values_for_a_property(property_values_dict: dict, priority_qualifier: str) -> dict:
+def sort_values_for_a_property(property_values_dict: dict,
+                               priority_qualifier: Optional[str],
+                               values_qualifiers: List[Mapping[str, dict]]) -> dict:
+    """Sort the values of a property by the first value of their 'priority_qualifier' (given
+    for each value in 'values_qualifiers'), comparing parsed times and quantities as numbers
+    and putting values without that qualifier last, or by their text if there is no
+    priority qualifier.
+    """
     _property = property_values_dict['ref']
     values = property_values_dict['values']
     if priority_qualifier is None:
         sort_order = sync_properties_sort_metadata.get(_property, 'asc')
         property_values_dict['values'] = sorted(values, key=itemgetter('text'), reverse=sort_order == 'desc')
         return property_values_dict
-    sort_order = sync_properties_sort_metadata.get(f'{_property}_{priority_qualifier}')
-    padding = 'Z' * 1000 if sort_order == 'asc' else '0' * 1000
-    for val in values:
-        quals = val.get('qualifiers', None)
-        if quals is not None:
-            for qual in quals:
-                if qual['ref'] == priority_qualifier:
-                    val['priority'] = f"{qual['values'][0]['text']}"  # can qualifiers have more than one value?
-                    continue
-        if val.get('priority', None) is None:
-            val['priority'] = f"{padding}{val['text']}"
-
-    sorted_values = sorted(values, key=itemgetter('priority'), reverse=sort_order == 'desc')
-
-    for v in sorted_values:
-        del v['priority']
-    property_values_dict['values'] = sorted_values
+    sort_order = sync_properties_sort_metadata.get(f'{_property}_{priority_qualifier}', 'asc')
+    reverse: bool = sort_order == 'desc'
+    # values without the qualifier (or without a parsed qualifier value) sort last,
+    # whichever the direction:
+    missing: int = 0 if reverse else 1
+    present: int = 1 - missing
+
+    def sort_key(indexed_value: Tuple[int, dict]) -> Tuple[int, int, float, str]:
+        idx, val = indexed_value
+        qual_value: Optional[dict] = values_qualifiers[idx].get(priority_qualifier)
+        if qual_value is None:
+            return missing, missing, 0, val['text']
+        sort_value: Optional[float] = getattr(qual_value, 'sort_value', None)
+        if sort_value is None:
+            return present, missing, 0, qual_value['text']
+        return present, present, sort_value, qual_value['text']
+
+    property_values_dict['values'] = [val for _, val in sorted(enumerate(values), key=sort_key, reverse=reverse)]
     return property_values_dict
 
 
-def find_sort_qualifier(property_value_dict: dict) -> str:
+def find_sort_qualifier(property_value_dict: dict) -> Tuple[Optional[str], List[Mapping[str, dict]]]:
+    """Return the time qualifier (or else the quantity qualifier) used by the most values
+    of a property in 'sync' mode, or None, together with a map per value from each of its
+    qualifiers to the first value of that qualifier.
+    """
+    values_qualifiers: List[Mapping[str, dict]] = list()
     if property_value_dict.get('mode') == 'ajax':
-        return None
+        return None, values_qualifiers
 
     qualifiers_type_dict = {}
-    _property = property_value_dict['ref']
     if property_value_dict.get('mode') == 'sync':  # mode == 'ajax' cannot be sorted here
         prop_values: List[dict] = property_value_dict['values']
         for prop_val in prop_values:
+            value_qualifiers: MutableMapping[str, dict] = dict()
+            values_qualifiers.append(value_qualifiers)
             val_quals = prop_val.get('qualifiers', None)
             if val_quals is not None:
                 for val_qual in val_quals:
@@ -2590,17 +3093,19 @@ def find_sort_qualifier(property_value_dict: dict) -> str:
                     if q_property not in qualifiers_type_dict[_type]:
                         qualifiers_type_dict[_type][q_property] = 0
                     qualifiers_type_dict[_type][q_property] += 1
+                    if len(val_qual['values']) > 0:
+                        value_qualifiers[q_property] = val_qual['values'][0]  # can qualifiers have more than one value?
 
     if not qualifiers_type_dict:
-        return None
+        return None, values_qualifiers
     if '/w/time' in qualifiers_type_dict:
         _ = qualifiers_type_dict['/w/time']
-        return max(_.items(), key=itemgetter(1))[0]
+        return max(_.items(), key=itemgetter(1))[0], values_qualifiers
     elif '/w/quantity' in qualifiers_type_dict:
         _ = qualifiers_type_dict['/w/quantity']
-        return max(_.items(), key=itemgetter(1))[0]
+        return max(_.items(), key=itemgetter(1))[0], values_qualifiers
     else:
-        return None
+        return None, values_qualifiers
 
 
 def parse_wikipedia_url(wiki_url: str) -> Tuple[str, str]:
@@ -2613,6 +3118,17 @@ def parse_wikipedia_url(wiki_url: str) -> Tuple[str, str]:
 
 if __name__ == '__main__':
 
+    for message in backend.check_label_fts():
+        print('WARNING: %s, rebuild it with kgtk browser build-fts' % message, file=sys.stderr, flush=True)
+    for message in backend.check_display_tables():
+        print('WARNING: %s and is not used, rebuild it with kgtk browser build-display-edges/qualifiers' % message,
+              file=sys.stderr, flush=True)
+
+    # Load shared tables before forking the workers:
+    rb_load_language_names(backend, app.config['LANGUAGE_NAMES_PRELOAD'])
+    # SQLite connections must not be carried across a fork, each process opens its own:
+    backend.close_sql_store()
+
     p = multiprocessing.Pool(int(multiprocessing.cpu_count() / 4))
 
     # send all error level logs to a separate file
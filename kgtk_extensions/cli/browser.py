@@ -3,16 +3,24 @@ Run the KGTK-Browser Flask server
 Open a browser window with the kgtk-browser location
 
 Optional params:
+    - action (run, build-trigram-index, build-search-index, build-class-bitmaps, build-fts,
+      build-display-edges, build-display-qualifiers, build-sortkeys, materialize), defaults to run
     - hostname (--host)
     - port number (-p, --port)
     - kgtk browser config file (-c, --config)
     - kgtk browser flask app file (-a, --app)
+    - graph cache file used by build actions (--graph-cache)
 
 Example usage:
     kgtk browser --host 0.0.0.0 --port 1234 --app flask_app.py --config config.py
+    kgtk browser build-trigram-index --graph-cache wikidata.sqlite3.db --languages en
+    kgtk browser build-search-index --graph-cache wikidata.sqlite3.db --languages en es
+    kgtk browser build-fts --graph-cache wikidata.sqlite3.db --fts-prefix '2 3 4'
+    kgtk browser materialize --graph-cache wikidata.sqlite3.db --store pages.sqlite3.db --count 10000
 """
 
 from argparse import Namespace, SUPPRESS
+import typing
 
 from kgtk.cli_argparse import KGTKArgumentParser, KGTKFiles
 
@@ -20,6 +28,20 @@ from kgtk.cli_argparse import KGTKArgumentParser, KGTKFiles
 BROWSER_COMMAND: str = "browser"
 BROWSE_COMMAND: str = "browse"
 
+# Actions supported by the command:
+RUN_ACTION: str = "run"
+BUILD_TRIGRAM_INDEX_ACTION: str = "build-trigram-index"
+BUILD_SEARCH_INDEX_ACTION: str = "build-search-index"
+BUILD_CLASS_BITMAPS_ACTION: str = "build-class-bitmaps"
+BUILD_FTS_ACTION: str = "build-fts"
+BUILD_DISPLAY_EDGES_ACTION: str = "build-display-edges"
+BUILD_DISPLAY_QUALIFIERS_ACTION: str = "build-display-qualifiers"
+BUILD_SORTKEYS_ACTION: str = "build-sortkeys"
+MATERIALIZE_ACTION: str = "materialize"
+BROWSER_ACTIONS = [RUN_ACTION, BUILD_TRIGRAM_INDEX_ACTION, BUILD_SEARCH_INDEX_ACTION, BUILD_CLASS_BITMAPS_ACTION,
+                   BUILD_FTS_ACTION, BUILD_DISPLAY_EDGES_ACTION, BUILD_DISPLAY_QUALIFIERS_ACTION, BUILD_SORTKEYS_ACTION,
+                   MATERIALIZE_ACTION]
+
 
 def parser():
     return {
@@ -51,6 +73,15 @@ def add_arguments_extended(parser: KGTKArgumentParser, parsed_shared_args: Names
         else:
             return SUPPRESS
 
+    # KGTK Browser action
+    parser.add_argument(
+        'kgtk_browser_action',
+        nargs='?',
+        choices=BROWSER_ACTIONS,
+        default=RUN_ACTION,
+        help="Action to perform: run the browser (the default), or build an auxiliary index in the graph cache",
+    )
+
     # KGTK Browser hostname
     parser.add_argument(
         '--host',
@@ -83,12 +114,94 @@ def add_arguments_extended(parser: KGTKArgumentParser, parsed_shared_args: Names
         default="kgtk_browser_app.py",
     )
 
+    # KGTK Browser graph cache for build actions
+    parser.add_argument(
+        '--graph-cache',
+        dest="kgtk_browser_graph_cache",
+        help="Graph cache file to build auxiliary indexes in, defaults to $KGTK_BROWSER_GRAPH_CACHE",
+        default=None,
+    )
+
+    parser.add_argument(
+        '--languages',
+        dest="kgtk_browser_languages",
+        nargs='+',
+        help=h("Languages to index, defaults to all languages for the trigram index "
+               "and the default language for the search index"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        dest="kgtk_browser_batch_size",
+        type=int,
+        help=h("Number of labels or documents to index in memory at a time"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--fts-tokenizer',
+        dest="kgtk_browser_fts_tokenizer",
+        help=h("FTS5 tokenizer of the label FTS index, defaults to LABEL_FTS_TOKENIZER of the browser config "
+               "or 'unicode61 remove_diacritics 2'"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--fts-prefix',
+        dest="kgtk_browser_fts_prefix",
+        help=h("Token prefix lengths indexed by the label FTS index, defaults to LABEL_FTS_PREFIX of the browser "
+               "config or '2 3 4'"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--store',
+        dest="kgtk_browser_store",
+        help=h("Materialized page store file, defaults to MATERIALIZED_STORE of the browser config"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--count',
+        dest="kgtk_browser_count",
+        type=int,
+        help=h("Number of top pagerank items to materialize, defaults to 10000"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--items-file',
+        dest="kgtk_browser_items_file",
+        help=h("File listing the items to materialize one per line (e.g., the most requested items "
+               "in the access logs), instead of the top pagerank items"),
+        default=None,
+    )
+
+    parser.add_argument(
+        '--processes',
+        dest="kgtk_browser_processes",
+        type=int,
+        help=h("Number of worker processes rendering pages, defaults to the number of CPUs"),
+        default=None,
+    )
+
 
 def run(
+        kgtk_browser_action: str = RUN_ACTION,
         kgtk_browser_host: str = '0.0.0.0',
         kgtk_browser_port: str = '5000',
         kgtk_browser_config: str = 'kgtk_browser_config.py',
         kgtk_browser_app: str = 'kgtk_browser_app.py',
+        kgtk_browser_graph_cache: typing.Optional[str] = None,
+        kgtk_browser_languages: typing.Optional[typing.List[str]] = None,
+        kgtk_browser_batch_size: typing.Optional[int] = None,
+        kgtk_browser_fts_tokenizer: typing.Optional[str] = None,
+        kgtk_browser_fts_prefix: typing.Optional[str] = None,
+        kgtk_browser_store: typing.Optional[str] = None,
+        kgtk_browser_count: typing.Optional[int] = None,
+        kgtk_browser_items_file: typing.Optional[str] = None,
+        kgtk_browser_processes: typing.Optional[int] = None,
 
         errors_to_stdout: bool = False,
         errors_to_stderr: bool = True,
@@ -116,6 +229,41 @@ def run(
         # Set the flask app and configuration file settings
         os.environ["FLASK_APP"] = kgtk_browser_app
         os.environ["KGTK_BROWSER_CONFIG"] = kgtk_browser_config
+        if kgtk_browser_graph_cache is not None:
+            os.environ["KGTK_BROWSER_GRAPH_CACHE"] = kgtk_browser_graph_cache
+
+        if kgtk_browser_action != RUN_ACTION:
+            # Build actions run in-process against the graph cache:
+            import browser.backend.commands as commands
+            if kgtk_browser_action == BUILD_TRIGRAM_INDEX_ACTION:
+                commands.build_trigram_index(languages=kgtk_browser_languages,
+                                             batch_size=kgtk_browser_batch_size,
+                                             log=error_file)
+            elif kgtk_browser_action == BUILD_SEARCH_INDEX_ACTION:
+                commands.build_search_index(languages=kgtk_browser_languages,
+                                            batch_size=kgtk_browser_batch_size,
+                                            log=error_file)
+            elif kgtk_browser_action == BUILD_CLASS_BITMAPS_ACTION:
+                commands.build_class_bitmaps(log=error_file)
+            elif kgtk_browser_action == BUILD_FTS_ACTION:
+                commands.build_fts(tokenizer=kgtk_browser_fts_tokenizer,
+                                   prefix=kgtk_browser_fts_prefix,
+                                   batch_size=kgtk_browser_batch_size,
+                                   log=error_file)
+            elif kgtk_browser_action == BUILD_DISPLAY_EDGES_ACTION:
+                commands.build_display_edges(languages=kgtk_browser_languages, log=error_file)
+            elif kgtk_browser_action == BUILD_DISPLAY_QUALIFIERS_ACTION:
+                commands.build_display_qualifiers(languages=kgtk_browser_languages, log=error_file)
+            elif kgtk_browser_action == BUILD_SORTKEYS_ACTION:
+                commands.build_sort_keys(log=error_file)
+            elif kgtk_browser_action == MATERIALIZE_ACTION:
+                commands.materialize_pages(count=kgtk_browser_count,
+                                           items_file=kgtk_browser_items_file,
+                                           languages=kgtk_browser_languages,
+                                           processes=kgtk_browser_processes,
+                                           store_path=kgtk_browser_store,
+                                           log=error_file)
+            return 0
 
         # Open the default web browser at the kgtk-browser location
         url = "http://{}:{}/browser".format(kgtk_browser_host, kgtk_browser_port)